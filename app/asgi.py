@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI 服务模块
+与 run_server.py 提供相同的接口（/face_compare、/bar_detect、/bar_decode、/jobs、/healthz、/readyz），
+区别在于请求体在事件循环中异步接收，慢速上传的客户端只占用一个协程，不再占住持有模型的 worker：
+- 请求体接收完成后，JSON 解析、base64 解码和图片校验提交到有界的解码执行器（线程池或进程池）
+- 模型推理提交到推理线程池，仍然经过执行通道（lanes）排队，模型并发数由 lanes.slots 决定，与连接数无关
+客户端在请求体接收完成之前断开时不会进入解码和推理。
+
+启动（需要安装 uvicorn）:
+    python -m app.asgi
+或由 gunicorn 管理 worker:
+    gunicorn -c pygunicorn.py -k uvicorn.workers.UvicornWorker app.asgi:app
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from config_loader import get_config
+from app.context import request_context
+from app.handlers import (
+    ENDPOINTS, Outcome, enabled_endpoints, prepare_request, run_request, request_timeout,
+    log_outcome, health_status, ready_status, start_warmup, scheduler, metrics,
+    profiler, profiled, admin_profile, tracer, capture, cleanup,
+)
+from app.jobs import manager as jobs, jobs_config, start_jobs
+from app.logs import setup_logging
+from app.metrics import setup_multiprocess
+from app.pipelines import registry, roles
+
+logger = logging.getLogger(__name__)
+
+
+def asgi_config():
+    """读取 server_config.json 中的 asgi 配置"""
+    s_configs = get_config("server_config.json")
+    config = s_configs.get("asgi") or {}
+    return {
+        "host": config.get("host", s_configs["host"] if "host" in s_configs else "0.0.0.0"),
+        "port": config.get("port", s_configs["port"] if "port" in s_configs else 5002),
+        "workers": config.get("workers", 1),
+        "decode_workers": config.get("decode_workers", 2),
+        "decode_executor": config.get("decode_executor", "thread"),
+        "infer_workers": config.get("infer_workers", 0),
+        "max_body_mb": config.get("max_body_mb", 20),
+    }
+
+
+class Headers(dict):
+    """请求头，名称统一为小写，查找时不区分大小写"""
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+def _is_json(content_type):
+    """与 Flask 的 request.is_json 一致：application/json 或 application/*+json"""
+    mimetype = content_type.split(";")[0].strip().lower()
+    return mimetype == "application/json" or (mimetype.startswith("application/") and mimetype.endswith("+json"))
+
+
+def _prepare(path, body, headers, timeout):
+    """
+    在解码执行器中执行：解析 JSON、校验参数、解码并保存图片
+    进程池中没有调用方的请求上下文，按剩余时限重新建立，阶段耗时随结果返回
+
+    Args:
+        path: 接口路由
+        body: 请求体字节
+        headers: 请求头
+        timeout: 剩余的处理时限（秒），None 表示不限制
+
+    Returns:
+        (prepared, outcome, stages, info)
+    """
+    def load():
+        if not _is_json(headers.get("Content-Type", "")):
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    with request_context(timeout) as ctx:
+        prepared, outcome = prepare_request(path, load, headers)
+    return prepared, outcome, ctx.stages, ctx.info
+
+
+class AsgiApp:
+    """
+    ASGI 应用
+    """
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config: asgi 配置，None 时读取 server_config.json
+        """
+        config = config or asgi_config()
+        self.endpoints = enabled_endpoints()
+        self.max_body = int(config["max_body_mb"] * 1024 * 1024)
+        # 批量任务可能内联上千张图片，单独的请求体上限
+        self.jobs_max_body = int(jobs_config()["max_body_mb"] * 1024 * 1024)
+        if config["decode_executor"] == "process":
+            # 事件循环进程中可能已有预热线程和模型，子进程用 spawn 方式启动，只导入解码所需的模块
+            self.decode_executor = ProcessPoolExecutor(max_workers=config["decode_workers"],
+                                                       mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.decode_executor = ThreadPoolExecutor(max_workers=config["decode_workers"],
+                                                      thread_name_prefix="decode")
+        # 推理线程在执行通道中阻塞排队，线程数需要覆盖槽位数和所有通道的队列长度，
+        # 否则排队的请求会占满线程池，通道的优先级调度失效
+        infer_workers = config["infer_workers"] or (
+            scheduler.slots + sum(lane.queue for lane in scheduler.lanes.values()))
+        self.infer_executor = ThreadPoolExecutor(max_workers=infer_workers, thread_name_prefix="infer")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        path, method = scope["path"], scope["method"]
+        if path == "/healthz" and method == "GET":
+            await _send_json(send, health_status())
+        elif path == "/readyz" and method == "GET":
+            body, status = ready_status()
+            await _send_json(send, body, status)
+        elif path == "/metrics" and method == "GET":
+            await self._metrics(send)
+        elif path == "/admin/profile" and method in ("GET", "POST"):
+            await self._admin_profile(method, scope, receive, send)
+        elif path in self.endpoints and method == "POST":
+            await self._handle(path, scope, receive, send)
+        elif path == "/jobs" or path.startswith("/jobs/"):
+            await self._jobs(method, path, scope, receive, send)
+        elif path in self.endpoints or path in ("/healthz", "/readyz", "/metrics", "/admin/profile"):
+            await _send_json(send, {"message": "Method Not Allowed"}, 405)
+        else:
+            await _send_json(send, {"message": "Not Found"}, 404)
+
+    async def _lifespan(self, receive, send):
+        """启动时按 warmup 配置预热模型，退出时关闭执行器"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                setup_logging()
+                # gunicorn preload 模式下 post_fork 已经执行过预热
+                if not registry.eager:
+                    start_warmup()
+                start_jobs()
+                logger.info(f"ASGI 服务已启动, 角色: {roles}, pid: {os.getpid()}")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.decode_executor.shutdown(wait=False)
+                self.infer_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _metrics(self, send):
+        """Prometheus 指标，多进程模式下读取所有 worker 的数据"""
+        rendered = metrics.render()
+        if rendered is None:
+            await _send_json(send, {"message": "监控指标未启用"}, 404)
+            return
+        data, content_type = rendered
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type.encode("latin-1")),
+                                (b"content-length", str(len(data)).encode())]})
+        await send({"type": "http.response.body", "body": data})
+
+    async def _admin_profile(self, method, scope, receive, send):
+        """性能分析管理接口"""
+        headers = _headers(scope)
+        data = None
+        if method == "POST":
+            body = await self._read_body(receive, headers)
+            if body is None:
+                return
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                data = False
+        body, status = admin_profile(data, headers)
+        await _send_json(send, body, status)
+
+    async def _jobs(self, method, path, scope, receive, send):
+        """批量任务接口，任务文件的读写在默认线程池中执行"""
+        if jobs is None:
+            await _send_json(send, {"message": "批量任务未启用"}, 404)
+            return
+        loop = asyncio.get_running_loop()
+        parts = path.strip("/").split("/")
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+        def arg(name, default=None):
+            return query[name][0] if name in query else default
+
+        if parts == ["jobs"] and method == "POST":
+            headers = _headers(scope)
+            body = await self._read_body(receive, headers, self.jobs_max_body)
+            if body is None:
+                return
+            if body is False:
+                await _send_json(send, {"message": f"请求体超过 {self.jobs_max_body} 字节"}, 413)
+                return
+            try:
+                data = json.loads(body) if _is_json(headers.get("Content-Type", "")) else None
+            except ValueError:
+                data = None
+            body, status = await loop.run_in_executor(None, jobs.submit, data)
+        elif len(parts) == 2 and method in ("GET", "DELETE"):
+            body, status = await loop.run_in_executor(
+                None, jobs.cancel if method == "DELETE" else jobs.status, parts[1])
+        elif len(parts) == 3 and parts[2] == "results" and method == "GET":
+            if arg("format") == "ndjson":
+                await self._stream_results(parts[1], arg("follow") == "1", receive, send)
+                return
+            try:
+                offset, limit = int(arg("offset", 0)), int(arg("limit", 100))
+            except ValueError:
+                await _send_json(send, {"message": "offset 和 limit 必须为整数"}, 400)
+                return
+            body, status = await loop.run_in_executor(None, jobs.results, parts[1], offset, limit)
+        else:
+            body, status = {"message": "Not Found"}, 404
+        await _send_json(send, body, status)
+
+    async def _stream_results(self, job_id, follow, receive, send):
+        """
+        以 NDJSON 分块发送任务结果
+        每次在线程池中读取当前已有的结果（最多 256 行）立即发送，不等待凑满；
+        follow 时没有新结果则在事件循环中等待 1 秒再读，期间客户端断开即停止
+        """
+        loop = asyncio.get_running_loop()
+        drained = await loop.run_in_executor(None, jobs.drain, job_id, 0)
+        if drained is None:
+            await _send_json(send, {"message": f"任务不存在: {job_id}"}, 404)
+            return
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            while drained is not None:
+                chunk, position, finished = drained
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                if finished or not (chunk or follow):
+                    break
+                if not chunk:
+                    await asyncio.wait({disconnect}, timeout=1)
+                if disconnect.done():
+                    return
+                drained = await loop.run_in_executor(None, jobs.drain, job_id, position)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnect.cancel()
+
+    async def _read_body(self, receive, headers, limit=None):
+        """
+        异步接收请求体
+
+        Args:
+            receive: ASGI receive
+            headers: 请求头
+            limit: 请求体上限（字节），None 时使用 max_body
+
+        Returns:
+            bytes；超过上限时返回 False；客户端断开时返回 None
+        """
+        limit = limit or self.max_body
+        content_length = headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            return False
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > limit:
+                return False
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    async def _handle(self, path, scope, receive, send):
+        """处理推理接口：异步接收请求体，解码和推理分别提交到对应的执行器"""
+        logging.debug(f"Call {path}")
+        start_time = time.time()
+        endpoint = ENDPOINTS[path]
+        headers = _headers(scope)
+        body = await self._read_body(receive, headers)
+        if body is None:
+            logging.info(f"客户端在请求体接收完成前断开: {path}")
+            return
+        if body is False:
+            outcome = Outcome(dict(endpoint.error, message=f"请求体超过 {self.max_body} 字节"), 413)
+        else:
+            outcome = await self._process(path, body, headers)
+            capture.record(path, body, headers, outcome, time.time() - start_time)
+        log_outcome(path, outcome, start_time)
+        await _send_json(send, outcome.body, outcome.status, outcome.headers())
+
+    async def _process(self, path, body, headers):
+        """在请求上下文中依次执行解码和推理"""
+        loop = asyncio.get_running_loop()
+        prepared, handed_off = None, False
+        with request_context(request_timeout(headers), headers.get("X-Request-Id")) as ctx:
+            ctx.trace = tracer.start(path, headers, ctx.request_id)
+            try:
+                remaining = ctx.remaining()
+                if remaining is not None:
+                    remaining = max(remaining, 0.001)
+                prepared, outcome, stages, info = await loop.run_in_executor(
+                    self.decode_executor, _prepare, path, body, headers, remaining)
+                ctx.stages.extend(stages)
+                ctx.info.update(info)
+                if outcome is None:
+                    # 推理线程继承请求上下文，执行通道和各处理阶段按同一截止时间检查
+                    mode, armed = profiler.take(path, headers)
+                    future = loop.run_in_executor(
+                        self.infer_executor, contextvars.copy_context().run,
+                        profiled, mode, armed, path, run_request, path, prepared)
+                    # 已提交到推理线程，临时文件由 run_request 清理（请求被取消时推理线程仍在读取）
+                    handed_off = True
+                    outcome = await future
+            except Exception as e:
+                logging.error(f"服务器错误: {str(e)}", exc_info=True)
+                outcome = Outcome(dict(ENDPOINTS[path].error, message=f"服务器错误: {str(e)}"), 500)
+            finally:
+                # 推理未提交（执行器已关闭、解码后请求被取消）时 run_request 不会清理临时文件
+                if prepared is not None and not handed_off:
+                    cleanup(prepared['paths'])
+        outcome.finish(ctx, debug=prepared is not None and prepared['debug'])
+        return outcome
+
+
+def _headers(scope):
+    """ASGI scope 中的请求头"""
+    return Headers((k.decode("latin-1").lower(), v.decode("latin-1")) for k, v in scope["headers"])
+
+
+async def _wait_disconnect(receive):
+    """等待客户端断开连接"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _send_json(send, body, status=200, headers=None):
+    """发送 JSON 响应"""
+    data = json.dumps(body).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": data})
+
+
+app = AsgiApp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ASGI 服务")
+    config = asgi_config()
+    parser.add_argument("--host", default=config["host"])
+    parser.add_argument("--port", type=int, default=config["port"])
+    parser.add_argument("--workers", type=int, default=config["workers"], help="uvicorn worker 进程数")
+    args = parser.parse_args()
+
+    import uvicorn
+    if args.workers > 1:
+        # 多个 uvicorn worker 的指标通过 multiprocess 目录汇总，worker 进程继承该环境变量
+        setup_multiprocess()
+    uvicorn.run("app.asgi:app", host=args.host, port=args.port, workers=args.workers, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,10 @@ from PIL import Image
 import cv2
 from nets.model_manager import manager
 from pyzbar.pyzbar import decode
+from config_loader import get_config
+from app.frame_cache import build_frame_cache, dhash
+from app.context import stage, annotate
+from app.tracing import span, set_attribute
 
 
 class BarDetect:
@@ -15,8 +19,22 @@ class BarDetect:
     条形码检测业务类
     """
     
-    def __init__(self):
-        self.model = manager.get_model("barcode")
+    def __init__(self, model=None):
+        """
+        Args:
+            model: 条形码模型实例，None 时从模型管理器加载（评估工具可传入指定精度的模型）
+        """
+        self._model = model
+        if model is None:
+            # 启动时加载模型，之后由模型管理器缓存
+            manager.get_model("barcode")
+        # 近重复帧缓存（可选，server_config.json 中 frame_dedup.enabled 开启）
+        self.frame_cache = build_frame_cache(get_config('server_config.json'))
+    
+    @property
+    def model(self):
+        """当前使用的模型实例，每次从模型管理器获取，热更新后自动切换到新版本"""
+        return self._model or manager.get_model("barcode")
     
     def preprocess(self, image_path):
         """
@@ -51,7 +69,7 @@ class BarDetect:
         
         return input_tensor, original_size, img
     
-    def postprocess(self, outputs, img_width, img_height):
+    def postprocess(self, outputs, img_width, img_height, model=None):
         """
         后处理模型输出
         
@@ -70,6 +88,8 @@ class BarDetect:
         Returns:
             results: 检测结果列表
         """
+        # 同一次请求使用同一个模型实例的参数
+        model = model or self.model
         # 提取输出
         output0 = outputs[0][0].transpose()  # (8400, 37)
         output1 = outputs[1][0]  # (32, 160, 160) - 掩码原型
@@ -79,67 +99,73 @@ class BarDetect:
         confs = output0[:, 4]    # objectness
         masks = output0[:, 5:37] # 32 个掩码系数
         
-        # 第一步: 根据置信度过滤，并转换坐标格式
-        candidates = []
-        for i in range(len(boxes)):
-            conf = confs[i]
-            
-            # 过滤低置信度检测
-            if conf < self.model.conf_threshold:
-                continue
-            
-            # 获取边界框坐标 (中心点格式)
-            xc, yc, w, h = boxes[i]
-            
-            # 转换为左上角右下角格式，并缩放到原始图像尺寸
-            x1 = (xc - w / 2) / 640 * img_width
-            y1 = (yc - h / 2) / 640 * img_height
-            x2 = (xc + w / 2) / 640 * img_width
-            y2 = (yc + h / 2) / 640 * img_height
-            
-            # 保存候选检测框（暂不计算掩码）
-            candidates.append({
-                'bbox': [x1, y1, x2, y2],
-                'confidence': float(conf),
-                'mask_coeffs': masks[i],  # 保存掩码系数
-                'index': i
-            })
+        # nms、mask 是 postprocess 的子阶段，耗时已计入 postprocess
+        with stage('postprocess.nms'):
+            # 第一步: 根据置信度过滤，并转换坐标格式
+            candidates = []
+            for i in range(len(boxes)):
+                conf = confs[i]
+            
+                # 过滤低置信度检测
+                if conf < model.conf_threshold:
+                    continue
+            
+                # 获取边界框坐标 (中心点格式)
+                xc, yc, w, h = boxes[i]
+            
+                # 转换为左上角右下角格式，并缩放到原始图像尺寸
+                x1 = (xc - w / 2) / 640 * img_width
+                y1 = (yc - h / 2) / 640 * img_height
+                x2 = (xc + w / 2) / 640 * img_width
+                y2 = (yc + h / 2) / 640 * img_height
+            
+                # 保存候选检测框（暂不计算掩码）
+                candidates.append({
+                    'bbox': [x1, y1, x2, y2],
+                    'confidence': float(conf),
+                    'mask_coeffs': masks[i],  # 保存掩码系数
+                    'index': i
+                })
         
-        # 第二步: 对候选框应用 NMS
-        candidates.sort(key=lambda x: x['confidence'], reverse=True)
-        nms_results = []
+            # 第二步: 对候选框应用 NMS
+            candidates.sort(key=lambda x: x['confidence'], reverse=True)
+            num_candidates = len(candidates)
+            nms_results = []
         
-        while len(candidates) > 0:
-            nms_results.append(candidates[0])
-            candidates = [obj for obj in candidates if self.model.iou(obj['bbox'], nms_results[-1]['bbox']) < self.model.iou_threshold]
+            while len(candidates) > 0:
+                nms_results.append(candidates[0])
+                candidates = [obj for obj in candidates if model.iou(obj['bbox'], nms_results[-1]['bbox']) < model.iou_threshold]
+        annotate('nms', {'candidates': num_candidates, 'kept': len(nms_results)})
         
         # 第三步: 只对 NMS 保留的少量检测框计算掩码（大幅减少矩阵乘法）
         results = []
         
-        # 重塑 output1 用于矩阵乘法（只做一次）
-        output1_reshaped = output1.reshape(32, 160 * 160)  # (32, 25600)
+        with stage('postprocess.mask'):
+            # 重塑 output1 用于矩阵乘法（只做一次）
+            output1_reshaped = output1.reshape(32, 160 * 160)  # (32, 25600)
         
-        for obj in nms_results:
-            x1, y1, x2, y2 = obj['bbox']
-            box = [x1, y1, x2, y2]
+            for obj in nms_results:
+                x1, y1, x2, y2 = obj['bbox']
+                box = [x1, y1, x2, y2]
             
-            # 矩阵乘法生成掩码（只对 NMS 后的少量框计算）
-            mask_coeffs = obj['mask_coeffs']  # (32,)
-            mask_flat = mask_coeffs @ output1_reshaped  # (25600,)
+                # 矩阵乘法生成掩码（只对 NMS 后的少量框计算）
+                mask_coeffs = obj['mask_coeffs']  # (32,)
+                mask_flat = mask_coeffs @ output1_reshaped  # (25600,)
             
-            # 获取最终掩码
-            mask = self.model.get_mask(mask_flat, box, img_width, img_height)
+                # 获取最终掩码
+                mask = model.get_mask(mask_flat, box, img_width, img_height)
             
-            # 从掩码中提取多边形轮廓（传入box参数，返回与box重合最多的多边形）
-            polygon = self.model.mask_to_polygon(mask, box)
+                # 从掩码中提取多边形轮廓（传入box参数，返回与box重合最多的多边形）
+                polygon = model.mask_to_polygon(mask, box)
             
-            results.append({
-                'bbox': box,
-                'label': self.model.classes[0],  # barcode
-                'confidence': obj['confidence'],
-                'mask': mask,
-                'polygon': polygon
-            })
+                results.append({
+                    'bbox': box,
+                    'label': model.classes[0],  # barcode
+                    'confidence': obj['confidence'],
+                    'mask': mask,
+                    'polygon': polygon
+                })
+        set_attribute('detections', len(results))
         
         return results
     
@@ -303,21 +329,92 @@ class BarDetect:
         Returns:
             results: 检测结果列表
         """
-        # 预处理
-        input_tensor, (img_width, img_height), img = self.preprocess(image_path)
+        with span('BarDetect.predict'):
+            # 预处理
+            with stage('preprocess'):
+                input_tensor, (img_width, img_height), img = self.preprocess(image_path)
+            set_attribute('image_size', [img_width, img_height])
+            
+            # 推理 + 后处理
+            results = self.detect(input_tensor, img_width, img_height)
+            set_attribute('detections', len(results))
         
-        # 运行推理
-        outputs = self.model.infer(input_tensor)
+        return results, img
+    
+    def detect(self, input_tensor, img_width, img_height):
+        """
+        对预处理后的张量执行推理和后处理
         
-        # 后处理
-        results = self.postprocess(outputs, img_width, img_height)
+        Args:
+            input_tensor: preprocess 输出的模型输入张量
+            img_width: 原始图像宽度
+            img_height: 原始图像高度
+            
+        Returns:
+            results: 检测结果列表
+        """
+        # 只获取一次模型实例，推理期间发生热更新也不影响本次请求
+        model = self.model
+        with stage('infer'):
+            # BarcodeModel.infer 的 span 即本阶段
+            set_attribute('input_shape', list(input_tensor.shape))
+            outputs = model.infer(input_tensor)
+        with stage('postprocess'):
+            return self.postprocess(outputs, img_width, img_height, model)
+    
+    def barcode_decode(self, image_path, client_id=None):
+        """
+        检测并解码条形码
         
-        return results, img
+        Args:
+            image_path: 图像路径或 PIL Image 对象
+            client_id: 客户端标识，开启近重复帧缓存时用于复用同一相机的上一帧结果
+            
+        Returns:
+            results: 解码结果列表
+        """
+        with span('BarDetect.barcode_decode', frame_cache=self.frame_cache is not None):
+            results = self._barcode_decode(image_path, client_id)
+            set_attribute('decoded', len(results))
+        return results
+    
+    def _barcode_decode(self, image_path, client_id):
+        """barcode_decode 的实现，按是否开启近重复帧缓存选择处理路径"""
+        if self.frame_cache is None or client_id is None:
+            annotate('decode_path', 'detect')
+            bar_results, original_img = self.predict(image_path)
+            return self.decode_detections(bar_results, original_img)
+        
+        # 近重复帧：在检测输入上计算哈希，命中则跳过推理
+        with stage('preprocess'):
+            input_tensor, image_size, original_img = self.preprocess(image_path)
+            frame_hash = dhash(input_tensor)
+        cached = self.frame_cache.lookup(client_id, frame_hash, image_size)
+        if cached is not None:
+            if self.frame_cache.mode == "decode":
+                # 复用上一帧的检测框，只重新解码
+                annotate('decode_path', 'frame_cache_detections')
+                return self.decode_detections(cached["detections"], original_img)
+            annotate('decode_path', 'frame_cache_results')
+            return list(cached["results"])
+        
+        annotate('decode_path', 'detect')
+        bar_results = self.detect(input_tensor, *image_size)
+        results = self.decode_detections(bar_results, original_img)
+        self.frame_cache.store(client_id, frame_hash, image_size, bar_results, results)
+        return results
     
-    def barcode_decode(self, image_path):
-        # 1. 获取检测结果和原图
-        bar_results, original_img = self.predict(image_path)
+    def decode_detections(self, bar_results, original_img):
+        """
+        按检测结果裁剪原图并用 pyzbar 解码
         
+        Args:
+            bar_results: 检测结果列表
+            original_img: 原始 PIL 图像
+            
+        Returns:
+            results: 解码结果列表
+        """
         # 转换为 numpy 数组
         original_img_np = np.array(original_img)
         
@@ -339,15 +436,16 @@ class BarDetect:
             mask_resized = cv2.resize(mask, (x2 - x1, y2 - y1))
             full_mask[y1:y2, x1:x2] = mask_resized
             
-            # 使用多边形过滤掩码（向外扩展 10 像素）
-            full_mask = self.filter_mask_by_polygon(full_mask, polygon, result['bbox'], expand_pixels=10)
-            
-            # 检查是否需要旋转校正
-            need_correction, rotation_angle = self.should_correct_rotation(polygon, threshold=15)
-            
-            # 如果需要旋转校正，则旋转图像和掩码
-            if need_correction:
-                original_img_np, full_mask = self.rotate_image_and_mask(original_img_np, full_mask, rotation_angle)
+            with stage('rectify'):
+                # 使用多边形过滤掩码（向外扩展 10 像素）
+                full_mask = self.filter_mask_by_polygon(full_mask, polygon, result['bbox'], expand_pixels=10)
+                
+                # 检查是否需要旋转校正
+                need_correction, rotation_angle = self.should_correct_rotation(polygon, threshold=15)
+                
+                # 如果需要旋转校正，则旋转图像和掩码
+                if need_correction:
+                    original_img_np, full_mask = self.rotate_image_and_mask(original_img_np, full_mask, rotation_angle)
             
             # 使用掩码提取 ROI
             cropped = cv2.bitwise_and(original_img_np, original_img_np, mask=full_mask)
@@ -364,7 +462,15 @@ class BarDetect:
             # cropped_pil.save(f"/data/cjl/ai-supervise-server/data/cropped/cropped_{len(results)}.jpg")
             
             # 使用 pyzbar 解码
-            barcodes = decode(cropped_pil)
+            with stage('zbar'):
+                barcodes = decode(cropped_pil)
+            annotate('detections', {
+                'confidence': result['confidence'],
+                'rotated': bool(need_correction),
+                'angle': float(rotation_angle) if need_correction else 0.0,
+                'crop': list(cropped.shape[:2]),
+                'decoded': len(barcodes)
+            })
             
             for barcode in barcodes:
                 results.append({
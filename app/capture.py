@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流量采样记录模块
+按采样率记录线上请求（原始图片字节、其他参数、请求头、各阶段耗时和响应），写入带大小上限的滚动二进制文件，
+之后可以用 tools/replay.py 按原始节奏（或加速）回放到进程内的处理流程或 HTTP 服务，
+在真实的流量形态上比较两个版本的输出和延迟。
+
+文件格式（logs/capture/capture-<pid>.bin，每个 worker 一个文件）：
+    文件头 MAGIC
+    记录: [4 字节长度][4 字节 CRC32][内容]
+    内容: [4 字节元数据长度][元数据 JSON][4 字节图片长度][图片字节]...
+图片以解码后的原始字节保存（比 base64 小约 1/4），元数据中记录每张图片对应的请求字段。
+请求线程只做采样判断并把请求体放入有界队列，base64 解码和写文件在后台线程中完成，队列已满时丢弃。
+单个文件超过 file_mb 时轮转，目录内所有记录文件的总大小超过 max_mb 时删除最旧的已轮转文件
+（各 worker 正在写入的 capture-<pid>.bin 不会被删除）。
+记录中包含原始图片，只应在允许保存业务数据的环境中开启。
+"""
+
+import base64
+import glob
+import json
+import os
+import random
+import re
+import struct
+import time
+import zlib
+
+from config_loader import get_config
+from app.tracing import BatchExporter
+
+MAGIC = b"AICAP1\n"
+# 保存为原始字节的图片字段；gallery 为图片列表
+IMAGE_FIELDS = ("image", "image1", "image2", "gallery")
+# 回放时需要带上的请求头
+HEADERS = ("Content-Type", "X-Client-Id", "X-Request-Timeout-Ms")
+# 正在写入的记录文件（capture-<pid>.bin）；轮转后的文件名带时间戳
+ACTIVE_FILE = re.compile(r"capture-\d+\.bin")
+
+
+def capture_config():
+    """读取 server_config.json 中的 capture 配置"""
+    config = get_config("server_config.json").get("capture") or {}
+    return {
+        "enabled": config.get("enabled", False),
+        "sample": config.get("sample", 0.01),
+        "dir": config.get("dir", "logs/capture"),
+        "file_mb": config.get("file_mb", 64),
+        "max_mb": config.get("max_mb", 1024),
+        "queue_size": config.get("queue_size", 64),
+    }
+
+
+def _split_image(value):
+    """拆分 base64 图片的 data:...;base64, 前缀，返回 (前缀, 原始字节)"""
+    prefix = ""
+    if "," in value:
+        prefix, value = value.split(",", 1)
+        prefix += ","
+    return prefix, base64.b64decode(value)
+
+
+def _decode_images(key, value):
+    """图片字段解码为 [(前缀, 原始字节)]；不是图片字段或无法解码时返回 None"""
+    if key not in IMAGE_FIELDS:
+        return None
+    values = value if key == "gallery" else [value]
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        return None
+    try:
+        return [_split_image(v) for v in values]
+    except ValueError:
+        return None
+
+
+def encode_record(meta, blobs):
+    """
+    编码一条记录
+
+    Args:
+        meta: 元数据字典
+        blobs: 图片字节列表
+
+    Returns:
+        bytes: 含长度和校验的记录
+    """
+    header = json.dumps(meta, ensure_ascii=False, default=str).encode("utf-8")
+    parts = [struct.pack(">I", len(header)), header]
+    for blob in blobs:
+        parts.append(struct.pack(">I", len(blob)))
+        parts.append(blob)
+    payload = b"".join(parts)
+    return struct.pack(">II", len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_record(payload):
+    """解码一条记录的内容，返回 (元数据, 图片字节列表)"""
+    (size,) = struct.unpack_from(">I", payload, 0)
+    meta = json.loads(payload[4:4 + size].decode("utf-8"))
+    blobs, offset = [], 4 + size
+    while offset < len(payload):
+        (size,) = struct.unpack_from(">I", payload, offset)
+        blobs.append(payload[offset + 4:offset + 4 + size])
+        offset += 4 + size
+    return meta, blobs
+
+
+def read_records(path):
+    """
+    逐条读取记录文件；文件末尾未写完或校验失败的记录被跳过
+
+    Yields:
+        (元数据, 图片字节列表)
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是流量记录文件: {path}")
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                return
+            size, crc = struct.unpack(">II", head)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            if zlib.crc32(payload) != crc:
+                continue
+            yield decode_record(payload)
+
+
+def rebuild_body(meta, blobs):
+    """
+    由记录还原请求体
+
+    Returns:
+        dict: 与原始请求相同的 JSON 请求体
+    """
+    body = dict(meta["params"])
+    for item, blob in zip(meta["images"], blobs):
+        value = item["prefix"] + base64.b64encode(blob).decode("ascii")
+        if item["index"] is None:
+            body[item["field"]] = value
+        else:
+            body.setdefault(item["field"], []).append(value)
+    return body
+
+
+class CaptureWriter(BatchExporter):
+    """在后台线程中编码记录并追加写入本进程的记录文件"""
+
+    def __init__(self, out_dir, file_mb=64, max_mb=1024, queue_size=64):
+        """
+        Args:
+            out_dir: 记录目录
+            file_mb: 单个文件的大小上限（MB），超过时轮转
+            max_mb: 目录内记录文件的总大小上限（MB），超过时删除最旧的文件
+            queue_size: 队列长度
+        """
+        super().__init__(queue_size, thread_name="capture-writer")
+        self.out_dir = out_dir
+        self.file_bytes = int(file_mb * 1024 * 1024)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def export(self, items):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"capture-{os.getpid()}.bin")
+        for item in items:
+            record = self._encode(item)
+            if record is None:
+                continue
+            if os.path.exists(path) and os.path.getsize(path) + len(record) > self.file_bytes:
+                self._rotate(path)
+            with open(path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(MAGIC)
+                f.write(record)
+
+    @staticmethod
+    def _encode(item):
+        """请求体拆分为参数和图片字节；不是 JSON 对象的请求体不记录"""
+        body, meta = item
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        params, images, blobs = {}, [], []
+        for key, value in data.items():
+            decoded = _decode_images(key, value)
+            if not decoded:
+                # 不是图片字段，或无法解码的图片（原样保存，回放时得到相同的错误）
+                params[key] = value
+                continue
+            for index, (prefix, blob) in enumerate(decoded):
+                images.append({"field": key, "index": index if key == "gallery" else None, "prefix": prefix})
+                blobs.append(blob)
+        meta = dict(meta, params=params, images=images)
+        return encode_record(meta, blobs)
+
+    def _rotate(self, path):
+        """
+        当前文件改名为带时间戳的文件，并按总大小上限删除最旧的已轮转文件
+        其他 worker 正在写入的 capture-<pid>.bin 计入总大小，但不会被删除
+        """
+        os.replace(path, f"{path[:-4]}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**6:06d}.bin")
+        # 其他 worker 可能同时在轮转和删除文件，已经不存在的文件跳过
+        sizes = {}
+        for f in glob.glob(os.path.join(self.out_dir, "capture-*.bin")):
+            try:
+                sizes[f] = (os.path.getmtime(f), os.path.getsize(f))
+            except OSError:
+                continue
+        total = sum(size for _, size in sizes.values())
+        rotated = sorted((f for f in sizes if ACTIVE_FILE.fullmatch(os.path.basename(f)) is None),
+                         key=lambda f: sizes[f][0])
+        for old in rotated:
+            if total <= self.max_bytes:
+                break
+            total -= sizes[old][1]
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+
+class Capture:
+    """
+    流量采样入口
+    """
+
+    def __init__(self, writer=None, sample=0.01):
+        """
+        Args:
+            writer: CaptureWriter，None 表示关闭
+            sample: 采样率
+        """
+        self.writer = writer
+        self.sample = sample
+
+    @property
+    def enabled(self):
+        return self.writer is not None
+
+    def record(self, path, body, headers, outcome, cost):
+        """
+        按采样率记录一次请求
+
+        Args:
+            path: 接口路由
+            body: 原始请求体（bytes）
+            headers: 请求头
+            outcome: 处理结果（Outcome）
+            cost: 请求总耗时（秒）
+        """
+        if self.writer is None or random.random() >= self.sample:
+            return
+        meta = {
+            # 请求开始时间，回放时按相邻请求的间隔还原节奏
+            "time": time.time() - cost,
+            "endpoint": path,
+            "request_id": outcome.request_id,
+            "headers": {name: headers.get(name) for name in HEADERS if headers.get(name) is not None},
+            "status": outcome.status,
+            "response": outcome.body,
+            "cost_ms": round(cost * 1000, 3),
+            "queue_wait_ms": round(outcome.wait * 1000, 3),
+            "timings": {name: round(ms, 3) for name, ms in outcome.timings().items()},
+        }
+        self.writer.submit([(body, meta)])
+
+
+def build_capture():
+    """
+    根据 server_config.json 创建流量采样入口
+
+    Returns:
+        Capture
+    """
+    config = capture_config()
+    if not config["enabled"]:
+        return Capture(None)
+    writer = CaptureWriter(config["dir"], config["file_mb"], config["max_mb"], config["queue_size"])
+    return Capture(writer, config["sample"])
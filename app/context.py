@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求上下文模块
+用 contextvars 在一次请求的处理过程中传递截止时间，并记录各处理阶段的耗时。
+业务代码用 stage() 标记处理阶段：进入阶段前检查截止时间，已超时的请求直接放弃，
+不再为已经不等待结果的客户端继续计算；用 annotate() 记录图片尺寸、NMS 候选数等调试信息。开启请求追踪时每个阶段同时是一个 span。
+没有请求上下文时（脚本、预热）stage() 和 annotate() 不做任何事。
+"""
+
+import contextvars
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("request_context", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """请求已超过客户端给出的截止时间"""
+
+    def __init__(self, stage):
+        super().__init__(f"请求已超过截止时间，在 {stage} 阶段之前放弃处理")
+        self.stage = stage
+
+
+class RequestContext:
+    """一次请求的截止时间和各阶段耗时"""
+
+    def __init__(self, deadline=None, request_id=None):
+        """
+        Args:
+            deadline: 截止时间（time.monotonic() 时钟），None 表示不限制
+            request_id: 请求 ID，None 时生成一个
+        """
+        self.deadline = deadline
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.stages = []
+        # tracemalloc 分析时记录各阶段内的峰值分配 [(阶段名称, 字节)]，未分析时为 None
+        self.memory = None
+        # 请求追踪（app.tracing.Trace），未开启或未被采样时为 None
+        self.trace = None
+        # 调试信息 {名称: [记录]}，请求携带 debug=timing 时随响应返回
+        self.info = {}
+
+    def remaining(self):
+        """剩余时间（秒），没有截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self, stage):
+        """
+        检查是否已超过截止时间
+
+        Args:
+            stage: 即将进入的阶段名称
+
+        Raises:
+            DeadlineExceeded: 已超时
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceeded(stage)
+
+
+def current():
+    """当前请求的上下文，没有时返回 None"""
+    return _current.get()
+
+
+@contextmanager
+def request_context(timeout=None, request_id=None):
+    """
+    为一次请求建立上下文
+
+    Args:
+        timeout: 客户端给出的处理时限（秒），None 表示不限制
+        request_id: 请求 ID（客户端的 X-Request-Id），None 时生成一个
+
+    Yields:
+        RequestContext
+    """
+    ctx = RequestContext(time.monotonic() + timeout if timeout else None, request_id)
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """
+    标记一个处理阶段：进入前检查截止时间，结束后记录耗时
+    嵌套在另一个阶段内的子阶段以 "父阶段.子阶段" 命名（如 postprocess.nms），其耗时已包含在父阶段中
+
+    Args:
+        name: 阶段名称
+    """
+    ctx = _current.get()
+    if ctx is None:
+        yield
+        return
+    ctx.check(name)
+    if ctx.memory is not None:
+        tracemalloc.reset_peak()
+    span = ctx.trace.start(name) if ctx.trace is not None else None
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        ctx.stages.append((name, time.perf_counter() - start))
+        if ctx.memory is not None:
+            ctx.memory.append((name, tracemalloc.get_traced_memory()[1]))
+        if span is not None:
+            ctx.trace.end(span, error)
+
+
+def annotate(key, value):
+    """
+    记录一条调试信息，同一名称的记录按顺序追加
+
+    Args:
+        key: 名称
+        value: 记录（可 JSON 序列化）
+    """
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.info.setdefault(key, []).append(value)
+        # 开启追踪时同时作为当前 span 的属性
+        if ctx.trace is not None:
+            ctx.trace.current.attributes[key] = value
@@ -9,110 +9,337 @@
 4. 根据距离判断是否为同一人
 
 支持设备: CPU, GPU (CUDA), NPU (华为昇腾)
+推理引擎: torch (facenet-pytorch) 或 onnx (hexai_backend)，由 conf/config.json 的 engine 选择
 """
 
-import os
-
-# # 【NPU 修复】设置 NPU 相关环境变量，避免 TBE 子进程错误
-if os.getenv('DEVICE') == 'npu':
-    os.environ['TE_PARALLEL_COMPILER'] = '0'  # 禁用并行编译
-    os.environ['CPU_CORE_NUM'] = '1'  # 限制 CPU 核心数
-    os.environ['OMP_NUM_THREADS'] = '1'  # 限制 OpenMP 线程数
-    os.environ['MKL_NUM_THREADS'] = '1'  # 限制 MKL 线程数
-
-from facenet_pytorch import MTCNN, InceptionResnetV1
-from PIL import Image
-import torch
 import logging
+import numpy as np
+import cv2
+from PIL import Image
+from nets.model_manager import manager
 from config_loader import get_config
+from app.context import stage, annotate, DeadlineExceeded
+from app.tracing import span, set_attribute
 
 # 获取logger
 logger = logging.getLogger(__name__)
-device_type = os.getenv('DEVICE', 'cpu')
+
+# 人脸质量检查的原因码
+REASON_INVALID_IMAGE = 'INVALID_IMAGE'      # 图片无法读取
+REASON_NO_FACE = 'NO_FACE'                  # 未检测到人脸
+REASON_LOW_CONFIDENCE = 'LOW_CONFIDENCE'    # 人脸概率过低
+REASON_FACE_TOO_SMALL = 'FACE_TOO_SMALL'    # 人脸尺寸过小
+REASON_BLURRY = 'BLURRY'                    # 人脸模糊
+
+
+class FaceQualityError(Exception):
+    """
+    人脸质量检查未通过
+    
+    Attributes:
+        reason: 原因码（REASON_*）
+        image: 未通过的图片标识（image1/image2）
+    """
+    
+    def __init__(self, reason, message, image=None):
+        super().__init__(message)
+        self.reason = reason
+        self.image = image
+
 
 class FaceComparator:
     def __init__(self):
         # 从配置文件获取阈值
         config = get_config()
-        # 根据环境变量初始化设备
-        if device_type == 'npu':
-            self.device = self._init_npu_device()
-        elif device_type == 'gpu':
-            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        else:  # 'cpu' or 其他
-            self.device = torch.device('cpu')
-        
+        # 启动时加载人脸模型，之后由模型管理器缓存
+        manager.get_model("face")
         self.threshold = config['threshold']
-        logger.info(f"使用设备: {self.device} (DEVICE: {device_type})")
-        
-        # 初始化MTCNN人脸检测
-        self.mtcnn = MTCNN(
-            image_size=160,      # 输出图像大小
-            margin=0,            # 人脸边距
-            min_face_size=20,    # 最小人脸尺寸
-            thresholds=[0.6, 0.7, 0.7],  # MTCNN三个网络的阈值
-            factor=0.709,        # 图像金字塔缩放因子
-            post_process=True,
-            device=self.device
-        )
-        # 初始化InceptionResnetV1特征提取
-        self.resnet = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
+        # 检测前将输入缩放到最长边不超过 max_side（0 表示不缩放），人脸裁剪仍在原图上进行
+        self.max_side = config.get('max_side', 1024)
+        # 原图坐标下的最小人脸尺寸，缩放后按比例换算
+        self.min_face_size = config.get('min_face_size', 20)
+        # 人脸质量阈值：MTCNN 概率、原图中人脸框最短边（像素）、清晰度（拉普拉斯方差，0 表示不检查）
+        self.quality_min_prob = config.get('quality_min_prob', 0.9)
+        self.quality_min_face_size = config.get('quality_min_face_size', 40)
+        self.quality_min_sharpness = config.get('quality_min_sharpness', 0)
+    
+    @property
+    def model(self):
+        """
+        人脸模型（torch 或 onnx 引擎，接口一致，输入输出均为 numpy 数组）
+        每次从模型管理器获取，热更新后自动切换到新版本；
+        compare/compare_many 在开始时取一次并向下传递，同一请求内的检测、对齐和特征提取使用同一版本
+        """
+        return manager.get_model("face")
+    
+    def load_image(self, img_path):
+        """读取图片为 RGB 的 PIL Image，支持路径或 PIL Image 对象"""
+        with stage('image_decode'):
+            if isinstance(img_path, Image.Image):
+                return img_path.convert('RGB')
+            return Image.open(img_path).convert('RGB')
     
-    def _init_npu_device(self):
-        """初始化华为 NPU 设备"""
+    def align(self, img, boxes, model=None):
+        """按人脸框在原图上裁剪并对齐到 160x160；model 为 None 时使用当前版本的模型"""
+        model = self.model if model is None else model
+        with stage('align'):
+            return model.extract(img, boxes)
+    
+    def detect(self, img, model=None):
+        """
+        检测人脸框，先把图片缩小到 max_side 再跑 MTCNN 图像金字塔
+        
+        Args:
+            img: RGB 的 PIL Image（原图分辨率）
+            model: 人脸模型，None 时使用当前版本
+            
+        Returns:
+            boxes: 原图坐标下的人脸框 [N, 4]，按面积从大到小排序，未检测到返回 None
+            probs: 对应的人脸概率 [N]
+        """
+        model = self.model if model is None else model
+        width, height = img.size
+        scale = 1.0
+        small = img
+        if self.max_side and max(width, height) > self.max_side:
+            scale = self.max_side / max(width, height)
+            small = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+        
+        # 最小人脸尺寸随缩放比例换算，P-Net 的最小窗口为 12
+        min_face_size = max(12, round(self.min_face_size * scale))
+        with stage('mtcnn'):
+            boxes = model.detect(small, min_face_size)
+        annotate('mtcnn', {'input': list(small.size), 'faces': len(boxes)})
+        if len(boxes) == 0:
+            return None, None
+        # 与 MTCNN(select_largest=True) 一致，按面积从大到小排序
+        order = np.argsort((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))[::-1]
+        boxes = boxes[order]
+        # 映射回原图坐标
+        return boxes[:, :4] / scale, boxes[:, 4]
+    
+    def extract_face(self, img_path, model=None):
+        """
+        从图片中检测并裁剪人脸
+        """
+        return self.extract_largest_face(img_path, model)[0]
+    
+    def extract_largest_face(self, img_path, model=None):
+        """
+        检测并裁剪图片中最大的人脸
+        
+        Returns:
+            face: 人脸数组 [3, 160, 160]，未检测到返回 None
+            box: 人脸框 [x1, y1, x2, y2]，未检测到返回 None
+        """
         try:
-            import torch_npu
-            torch.npu.set_compile_mode(jit_compile=False)
-            torch_npu.npu.set_device("npu:0")
-            return torch.device('npu')
+            img = self.load_image(img_path)
+            # 在缩小图上检测，在原图上裁剪对齐到 160x160
+            boxes, _ = self.detect(img, model)
+            if boxes is None:
+                logger.warning(f"在图片 {img_path} 中未检测到人脸")
+                return None, None
+            return self.align(img, boxes[:1], model)[0], [round(float(v), 1) for v in boxes[0]]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            import logging
-            logging.warning(f"NPU 初始化失败，降级到 CPU: {e}")
-            return torch.device('cpu')
+            logger.error(f"处理图片 {img_path} 时出错: {str(e)}")
+            return None, None
     
-    def extract_face(self, img_path):
+    def extract_faces(self, img_path, model=None):
         """
-        从图片中检测并裁剪人脸
+        检测并裁剪图片中的所有人脸
+        
+        Returns:
+            faces: 人脸数组 [N, 3, 160, 160]，未检测到返回 None
+            boxes: 人脸框列表 [[x1, y1, x2, y2], ...]
         """
         try:
-            img = Image.open(img_path).convert('RGB')
-            # 使用MTCNN检测并裁剪人脸
-            face = self.mtcnn(img)
-            if face is None:
-                print(f"警告: 在图片 {img_path} 中未检测到人脸")
-                return None
-            return face
+            img = self.load_image(img_path)
+            boxes, _ = self.detect(img, model)
+            if boxes is None:
+                logger.warning(f"在图片 {img_path} 中未检测到人脸")
+                return None, []
+            faces = self.align(img, boxes, model)
+            return faces, [[round(float(v), 1) for v in box] for box in boxes]
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            print(f"错误: 处理图片 {img_path} 时出错: {str(e)}")
-            return None
+            logger.error(f"处理图片 {img_path} 时出错: {str(e)}")
+            return None, []
+    
+    def extract_embeddings(self, faces, model=None):
+        """
+        批量提取人脸特征向量，一次 resnet 调用
+        
+        Args:
+            faces: 人脸数组 [N, 3, 160, 160]
+            model: 人脸模型，None 时使用当前版本
+            
+        Returns:
+            embeddings: 特征向量 [N, 512]
+        """
+        model = self.model if model is None else model
+        with stage('embedding'):
+            return model.embed(faces)
     
-    def extract_embedding(self, face_tensor):
+    def extract_embedding(self, face, model=None):
         """
         提取人脸特征向量（512维embedding）
         """
-        with torch.no_grad():
-            # 添加batch维度并提取特征
-            embedding = self.resnet(face_tensor.unsqueeze(0).to(self.device))
-        return embedding
+        # 添加batch维度并提取特征
+        return self.extract_embeddings(face[np.newaxis], model)
+    
+    def sharpness(self, img, box):
+        """
+        估计人脸区域清晰度：裁剪人脸框并缩放到 160x160 后计算拉普拉斯方差
+        
+        Args:
+            img: RGB 的 PIL Image
+            box: 人脸框 [x1, y1, x2, y2]
+            
+        Returns:
+            float: 拉普拉斯方差，越小越模糊
+        """
+        x1, y1, x2, y2 = [int(round(v)) for v in box]
+        crop = img.crop((max(0, x1), max(0, y1), min(img.width, x2), min(img.height, y2)))
+        gray = cv2.cvtColor(np.asarray(crop.resize((160, 160), Image.BILINEAR)), cv2.COLOR_RGB2GRAY)
+        return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    
+    def check_face(self, img_path, name=None, model=None):
+        """
+        检测人脸并做质量检查，未通过时立即抛出 FaceQualityError
+        
+        Args:
+            img_path: 图片路径或 PIL Image 对象
+            name: 图片标识，写入异常中返回给客户端
+            model: 人脸模型，None 时使用当前版本
+            
+        Returns:
+            face: 对齐后的人脸数组 [3, 160, 160]
+        """
+        try:
+            img = self.load_image(img_path)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise FaceQualityError(REASON_INVALID_IMAGE, f"图片无法读取: {str(e)}", name)
+        
+        boxes, probs = self.detect(img, model)
+        if boxes is None:
+            raise FaceQualityError(REASON_NO_FACE, "未检测到人脸", name)
+        
+        # 只检查最大的人脸（与 extract_face 的选择一致）
+        box, prob = boxes[0], float(probs[0])
+        if prob < self.quality_min_prob:
+            raise FaceQualityError(REASON_LOW_CONFIDENCE, f"人脸概率过低: {prob:.3f}", name)
+        
+        face_size = min(box[2] - box[0], box[3] - box[1])
+        if face_size < self.quality_min_face_size:
+            raise FaceQualityError(REASON_FACE_TOO_SMALL, f"人脸尺寸过小: {face_size:.0f}px", name)
+        
+        if self.quality_min_sharpness:
+            sharpness = self.sharpness(img, box)
+            if sharpness < self.quality_min_sharpness:
+                raise FaceQualityError(REASON_BLURRY, f"人脸模糊: {sharpness:.1f}", name)
+        
+        return self.align(img, boxes[:1], model)[0]
     
     def compare(self, img_path1, img_path2):
         """
         比对两张图片中的人脸
+        任意一张图片未通过质量检查时抛出 FaceQualityError，image1 未通过时不再处理 image2
         """
-        # 1. 检测并裁剪人脸
-        face1 = self.extract_face(img_path1)
-        face2 = self.extract_face(img_path2)
-        if face1 is None or face2 is None:
-            print("\n人脸检测失败, 无法进行比对")
-            return None, None
-        # 2. 提取特征向量
-        embedding1 = self.extract_embedding(face1)
-        embedding2 = self.extract_embedding(face2)
-        print(f"特征向量维度: {embedding1.shape[1]}")
+        # 整个请求使用同一个模型版本，避免处理过程中热更新导致两张图片的特征来自不同模型
+        model = self.model
+        with span('FaceComparator.compare'):
+            # 1. 检测并裁剪人脸，逐张做质量检查
+            face1 = self.check_face(img_path1, 'image1', model)
+            face2 = self.check_face(img_path2, 'image2', model)
+            
+            # 2. 一次 resnet 调用提取两个特征向量
+            embeddings = self.extract_embeddings(np.stack([face1, face2]), model)
+            
+            # 3. 计算欧氏距离
+            distance = float(np.linalg.norm(embeddings[0] - embeddings[1]))
+            
+            # 判断是否为同一人
+            is_same_person = distance < self.threshold
+            set_attribute('distance', distance)
+            set_attribute('is_same_person', bool(is_same_person))
+        return distance, is_same_person
+
+    def compare_many(self, img_path1, img_paths2, gallery=False):
+        """
+        多人脸 N×M 比对
+        不做 check_face 的质量检查：多人合影中的人脸通常偏小，所有检测到的人脸都参与比对
         
-        # 3. 计算欧氏距离
-        distance = (embedding1 - embedding2).norm().item()
+        Args:
+            img_path1: 图片 A，检测其中所有人脸
+            img_paths2: 图片 B 的路径列表；gallery=False 时只取第一张并检测所有人脸，
+                        gallery=True 时每张图片取一个人脸作为底库中的一项
+            gallery: 是否为底库模式
+            
+        Returns:
+            dict: faces1/faces2 人脸框、distances 距离矩阵 [N][M]、matches 一对一最佳匹配；
+                  底库模式下另有 gallery_indices（faces2 各项对应的底库下标）和 no_face（未检测到人脸的底库下标），
+                  matches 中的 face2 为底库下标；图片 A 或 B 中没有人脸时返回 None
+        """
+        model = self.model
+        # 1. 检测图片 A 的所有人脸
+        faces1, boxes1 = self.extract_faces(img_path1, model)
+        if faces1 is None:
+            return None
         
-        # 判断是否为同一人
-        is_same_person = distance < self.threshold
-        return distance, is_same_person
+        # 2. 检测图片 B（或底库）的人脸
+        indices2, no_face = None, []
+        if gallery:
+            faces2, boxes2, indices2 = [], [], []
+            for idx, img_path in enumerate(img_paths2):
+                face, box = self.extract_largest_face(img_path, model)
+                if face is None:
+                    no_face.append(idx)
+                    continue
+                faces2.append(face)
+                boxes2.append(box)
+                indices2.append(idx)
+            if not faces2:
+                return None
+            faces2 = np.stack(faces2)
+        else:
+            faces2, boxes2 = self.extract_faces(img_paths2[0], model)
+            if faces2 is None:
+                return None
+        
+        # 3. 一次 resnet 调用提取全部特征向量
+        embeddings = self.extract_embeddings(np.concatenate([faces1, faces2]), model)
+        embeddings1 = embeddings[:len(faces1)]
+        embeddings2 = embeddings[len(faces1):]
+        
+        # 4. 距离矩阵与一对一匹配（按距离从小到大贪心选取，只保留阈值内的匹配）
+        distances = np.linalg.norm(embeddings1[:, np.newaxis] - embeddings2[np.newaxis], axis=2)
+        order = np.argsort(distances, axis=None)
+        used1, used2, matches = set(), set(), []
+        for k in order.tolist():
+            i, j = divmod(k, distances.shape[1])
+            distance = float(distances[i, j])
+            if distance >= self.threshold:
+                break
+            if i in used1 or j in used2:
+                continue
+            used1.add(i)
+            used2.add(j)
+            # 底库模式下返回底库下标，跳过的底库图片不影响客户端按下标取图
+            matches.append({'face1': i, 'face2': j if indices2 is None else indices2[j],
+                            'distance': round(distance, 4)})
+        
+        result = {
+            'faces1': boxes1,
+            'faces2': boxes2,
+            'distances': [[round(d, 4) for d in row] for row in distances.tolist()],
+            'matches': matches
+        }
+        if gallery:
+            result['gallery_indices'] = indices2
+            result['no_face'] = no_face
+        return result
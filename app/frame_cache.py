@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+近重复帧缓存模块
+固定机位的流水线相机会连续上传几乎相同的画面，重新编码后字节不同，精确哈希无法命中。
+这里在 BarDetect.preprocess 得到的 640x640 检测输入上计算差值哈希 (dHash)，
+汉明距离在阈值内即认为是同一画面，可直接复用上一次的结果或检测框。
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+
+
+def dhash(input_tensor, hash_size=8):
+    """
+    计算检测输入张量的差值哈希
+
+    Args:
+        input_tensor: BarDetect.preprocess 输出的张量 [1, 3, H, W]，取值 0-1
+        hash_size: 哈希边长，结果为 hash_size * hash_size 位
+
+    Returns:
+        int: 哈希值
+    """
+    # 转灰度并缩小到 (hash_size + 1) x hash_size
+    gray = input_tensor[0].mean(axis=0).astype(np.float32)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+
+    # 相邻像素比较得到位图
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(hash1, hash2):
+    """计算两个哈希值的汉明距离"""
+    return bin(hash1 ^ hash2).count("1")
+
+
+class FrameCache:
+    """
+    按客户端保存最近若干帧的哈希和结果
+    线程安全，客户端数量超过上限时按 LRU 淘汰
+    """
+
+    def __init__(self, threshold=5, history=4, ttl=2.0, max_clients=256, mode="result"):
+        """
+        Args:
+            threshold: 汉明距离阈值，小于等于该值视为近重复
+            history: 每个客户端保留的最近帧数
+            ttl: 缓存条目有效期（秒）
+            max_clients: 最多缓存的客户端数量
+            mode: 命中后的处理方式，result 直接返回上次结果，decode 复用检测框重新解码
+        """
+        self.threshold = threshold
+        self.history = history
+        self.ttl = ttl
+        self.max_clients = max_clients
+        self.mode = mode
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, client_id, frame_hash, image_size):
+        """
+        查找近重复帧
+
+        Args:
+            client_id: 客户端标识
+            frame_hash: 当前帧的哈希
+            image_size: 当前帧原始尺寸 (width, height)，尺寸不同不复用
+
+        Returns:
+            dict: 命中的缓存条目，未命中返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entries = self._clients.get(client_id)
+            if not entries:
+                return None
+            self._clients.move_to_end(client_id)
+            best = None
+            best_distance = self.threshold + 1
+            for entry in entries:
+                if now - entry["time"] > self.ttl or entry["size"] != image_size:
+                    continue
+                distance = hamming(entry["hash"], frame_hash)
+                if distance < best_distance:
+                    best = entry
+                    best_distance = distance
+            return best
+
+    def store(self, client_id, frame_hash, image_size, detections, results):
+        """
+        保存一帧的检测框和解码结果
+
+        Args:
+            client_id: 客户端标识
+            frame_hash: 帧哈希
+            image_size: 原始尺寸 (width, height)
+            detections: BarDetect.predict 的检测结果
+            results: barcode_decode 的解码结果
+        """
+        entry = {
+            "hash": frame_hash,
+            "size": image_size,
+            "detections": detections,
+            "results": results,
+            "time": time.time(),
+        }
+        with self._lock:
+            entries = self._clients.get(client_id)
+            if entries is None:
+                entries = deque(maxlen=self.history)
+                self._clients[client_id] = entries
+            self._clients.move_to_end(client_id)
+            entries.append(entry)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+
+
+def build_frame_cache(s_configs):
+    """
+    根据 server_config.json 的 frame_dedup 配置构建缓存，未开启返回 None
+
+    Args:
+        s_configs: 服务器配置
+
+    Returns:
+        FrameCache: 缓存实例或 None
+    """
+    dedup = s_configs.get("frame_dedup") or {}
+    if not dedup.get("enabled", False):
+        return None
+    return FrameCache(
+        threshold=dedup.get("hamming_threshold", 5),
+        history=dedup.get("history", 4),
+        ttl=dedup.get("ttl", 2.0),
+        max_clients=dedup.get("max_clients", 256),
+        mode=dedup.get("mode", "result"),
+    )
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+接口处理模块
+人脸比对、条形码检测、条形码解码三个接口与 Web 框架无关的处理逻辑，
+Flask（run_server.py）和 ASGI（app/asgi.py）两种服务方式共用。
+
+一次请求分为两步：
+- prepare: 校验参数、解码 base64 图片并保存为临时文件，不占用推理槽位
+- run: 在执行通道中排队，占用推理槽位执行模型推理，结束后清理临时文件
+"""
+
+import base64
+import io
+import logging
+import os
+import time
+import uuid
+
+from PIL import Image
+
+from config_loader import get_config
+from app.pipelines import registry, roles
+from app.lanes import build_scheduler, LaneFullError, Ticket
+from app.context import current, request_context, stage, annotate, DeadlineExceeded
+from app.logs import stats as logging_stats
+from app.metrics import Metrics
+from app.profiling import build_profiler
+from app.tracing import build_tracer
+from app.capture import build_capture
+
+# 按接口划分的执行通道（并发上限、有界队列、优先级）
+scheduler = build_scheduler(get_config('server_config.json'))
+
+# 监控指标（/metrics），通道的排队数和执行数变化时同步更新
+metrics = Metrics()
+if metrics.enabled:
+    scheduler.observer = metrics.lane_changed
+
+# 按需性能分析（/admin/profile 或 X-Profile 请求头）
+profiler = build_profiler(get_config('server_config.json'))
+
+# 请求追踪（tracing.enabled 开启时导出到 logs/traces.jsonl 或 OTLP）
+tracer = build_tracer()
+
+# 流量采样记录（capture.enabled 开启时写入 logs/capture/，用 tools/replay.py 回放）
+capture = build_capture()
+
+# 准入控制配置：客户端未携带 X-Request-Timeout-Ms 时使用 default_timeout_ms（0 表示不限制）
+admission_config = get_config('server_config.json').get('admission') or {}
+
+
+def start_warmup():
+    """
+    模型在第一次请求时加载；开启 warmup.eager 时启动即加载并用合成输入预热
+    环境变量 WARMUP_EAGER=0/1 可覆盖配置
+    """
+    warmup_config = get_config('server_config.json').get('warmup') or {}
+    eager = os.getenv('WARMUP_EAGER')
+    eager = eager == '1' if eager is not None else warmup_config.get('eager', False)
+    if eager:
+        registry.warmup(background=warmup_config.get('background', True))
+
+
+class RequestError(Exception):
+    """请求参数错误，直接返回给客户端"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Outcome:
+    """一次请求的处理结果"""
+
+    def __init__(self, body, status=200, retry_after=None, wait=0.0, service=0.0):
+        """
+        Args:
+            body: 响应体字典
+            status: HTTP 状态码
+            retry_after: 被拒绝时建议的重试等待秒数
+            wait: 排队时间（秒）
+            service: 处理时间（秒）
+        """
+        self.body = body
+        self.status = status
+        self.retry_after = retry_after
+        self.wait = wait
+        self.service = service
+        self.request_id = None
+        self.trace_id = None
+        # 各处理阶段的耗时 [(阶段名称, 秒)]
+        self.stages = []
+
+    def timings(self):
+        """
+        按阶段汇总的耗时（毫秒），同一阶段多次执行（如每个检测框一次 zbar）时累加
+        子阶段（如 postprocess.nms）已包含在父阶段中，求和时应排除
+
+        Returns:
+            dict: {阶段名称: 毫秒}，排队时间记为 queue
+        """
+        totals = {'queue': self.wait * 1000} if self.wait else {}
+        for name, secs in self.stages:
+            totals[name] = totals.get(name, 0.0) + secs * 1000
+        return totals
+
+    def headers(self):
+        """附加的响应头"""
+        headers = {
+            'X-Queue-Wait-Ms': f"{self.wait * 1000:.1f}",
+            'X-Service-Time-Ms': f"{self.service * 1000:.1f}",
+        }
+        if self.retry_after is not None:
+            headers['Retry-After'] = str(self.retry_after)
+        if self.request_id is not None:
+            headers['X-Request-Id'] = self.request_id
+        if self.trace_id is not None:
+            headers['X-Trace-Id'] = self.trace_id
+        timings = self.timings()
+        if timings:
+            headers['Server-Timing'] = ', '.join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+        return headers
+
+    def finish(self, ctx, debug=False):
+        """
+        请求结束时补充各阶段耗时并提交追踪数据；请求携带 debug=timing 时在响应体中附带耗时明细和调试信息
+
+        Args:
+            ctx: 请求上下文
+            debug: 是否附带调试信息
+        """
+        self.request_id = ctx.request_id
+        self.stages = ctx.stages
+        if ctx.trace is not None:
+            self.trace_id = ctx.trace.trace_id
+            tracer.finish(ctx.trace, self.status)
+        if debug:
+            self.body = dict(self.body, debug=dict(
+                ctx.info,
+                timings={name: round(ms, 2) for name, ms in self.timings().items()},
+                stages=[[name, round(secs * 1000, 2)] for name, secs in ctx.stages],
+                queue_wait_ms=round(self.wait * 1000, 2),
+                service_time_ms=round(self.service * 1000, 2),
+            ))
+
+
+def validate_image_format(image_data):
+    """验证数据是否为有效的图片格式"""
+    try:
+        # 使用Pillow验证图片格式
+        img = Image.open(io.BytesIO(image_data))
+        img.verify()  # 验证图片完整性
+
+        # 重新打开因为verify()会消耗文件
+        img = Image.open(io.BytesIO(image_data))
+
+        # 支持的图片格式列表
+        supported_formats = {'JPEG', 'PNG', 'JPG', 'WEBP', 'BMP', 'GIF'}
+        img_format = img.format.upper() if img.format else ''
+
+        if img_format not in supported_formats:
+            raise ValueError(f"不支持的图片格式: {img_format}")
+        annotate('images', {'format': img_format, 'width': img.width, 'height': img.height, 'bytes': len(image_data)})
+
+        return True, img_format
+    except Exception as e:
+        logging.error(f"图片错误: {str(e)}")
+        return False, str(e)
+
+
+def save_base64_image(base64_string, upload_dir='./data/uploads'):
+    """将base64字符串保存为图片文件"""
+    # 确保上传目录存在
+    os.makedirs(upload_dir, exist_ok=True)
+
+    # 解码base64
+    if ',' in base64_string:
+        # 移除data:image/jpeg;base64,等前缀
+        base64_string = base64_string.split(',')[1]
+
+    with stage('base64_decode'):
+        image_data = base64.b64decode(base64_string)
+
+    # 验证是否为有效的图片格式
+    with stage('image_decode'):
+        is_valid, result = validate_image_format(image_data)
+    if not is_valid:
+        raise ValueError(f"图片格式错误: {result}")
+
+    # 生成唯一文件名
+    filename = f"{uuid.uuid4()}.jpg"
+    filepath = os.path.join(upload_dir, filename)
+
+    # 保存图片，写入失败（如磁盘已满）时删除写了一半的文件
+    try:
+        with open(filepath, 'wb') as f:
+            f.write(image_data)
+    except BaseException:
+        cleanup([filepath])
+        raise
+
+    return filepath
+
+
+def save_images(images):
+    """
+    保存一组 base64 图片，任意一张格式错误时清理已保存的文件
+
+    Args:
+        images: base64 字符串列表
+
+    Returns:
+        list: 临时文件路径
+    """
+    paths = []
+    try:
+        for image in images:
+            paths.append(save_base64_image(image))
+    except ValueError as ve:
+        logging.error(f"图片格式错误: {str(ve)}")
+        cleanup(paths)
+        raise RequestError(str(ve))
+    except BaseException:
+        cleanup(paths)
+        raise
+    logging.debug(f"保存base64图片: {', '.join(paths)}")
+    return paths
+
+
+def cleanup(paths):
+    """清理临时文件"""
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as cleanup_error:
+            logging.warning(f"清理临时文件失败: {str(cleanup_error)}")
+
+
+def prepare_face(data, headers):
+    """人脸比对：校验参数并保存图片，mode=multi 时为多人脸 N×M 比对"""
+    if data.get('mode') == 'multi':
+        if 'image1' not in data or ('image2' not in data and 'gallery' not in data):
+            raise RequestError('缺少必需参数：image1和image2/gallery')
+        gallery = 'gallery' in data
+        if gallery and (not isinstance(data['gallery'], list) or not data['gallery']):
+            raise RequestError('gallery 必须为非空的图片列表')
+        images2 = data['gallery'] if gallery else [data['image2']]
+        return {'mode': 'multi', 'gallery': gallery, 'paths': save_images([data['image1']] + images2)}
+    if 'image1' not in data or 'image2' not in data:
+        raise RequestError('缺少必需参数：image1和image2')
+    return {'mode': 'pair', 'paths': save_images([data['image1'], data['image2']])}
+
+
+def run_face(prepared):
+    """人脸比对推理"""
+    from app.face_compare import FaceQualityError
+
+    comparator = registry.get('face')
+    img_paths = prepared['paths']
+    if prepared['mode'] == 'multi':
+        logging.debug(f"开始多人脸比对: {img_paths[0]} vs {len(img_paths) - 1} 张图片")
+        result = comparator.compare_many(img_paths[0], img_paths[1:], gallery=prepared['gallery'])
+        if result is None:
+            return {'is_same_person': False, 'message': '人脸检测失败'}
+        result['is_same_person'] = len(result['matches']) > 0
+        result['message'] = 'ok'
+        logging.info(f"多人脸比对完成: matches={len(result['matches'])}")
+        return result
+
+    logging.debug(f"开始比对人脸: {img_paths[0]} vs {img_paths[1]}")
+    try:
+        distance, is_same_person = comparator.compare(img_paths[0], img_paths[1])
+    except FaceQualityError as qe:
+        # 质量检查未通过，返回结构化原因码，客户端无需重试
+        logging.info(f"人脸质量检查未通过: {qe.image} {qe.reason} {str(qe)}")
+        return {
+            'is_same_person': False,
+            'message': str(qe),
+            'reason': qe.reason,
+            'image': qe.image
+        }, 422
+    logging.info(f"比对完成: distance={distance}, is_same_person={is_same_person}")
+    return {'is_same_person': is_same_person, 'message': 'ok'}
+
+
+def prepare_barcode(data, headers):
+    """条形码接口：校验参数并保存图片"""
+    if 'image' not in data:
+        raise RequestError('缺少必需参数：image')
+    # 客户端标识（用于近重复帧复用），可放在请求体或请求头中
+    client_id = data.get('client_id') or headers.get('X-Client-Id')
+    return {'paths': save_images([data['image']]), 'client_id': client_id}
+
+
+def run_bar_detect(prepared):
+    """条形码检测推理"""
+    img_path = prepared['paths'][0]
+    logging.debug(f"开始检测条形码: {img_path}")
+    results, _ = registry.get('barcode').predict(img_path)
+    # 删除 mask 字段
+    for result in results:
+        result.pop('mask', None)
+    if 0 == len(results):
+        return {'code': 0, 'message': '未检测到条形码！', 'results': results}
+    return {'code': 0, 'message': 'ok', 'results': results}
+
+
+def run_bar_decode(prepared):
+    """条形码解码推理"""
+    img_path = prepared['paths'][0]
+    logging.debug(f"开始解码条形码: {img_path}")
+    results = registry.get('barcode').barcode_decode(img_path, client_id=prepared['client_id'])
+    message = 'ok'
+    if 0 == len(results):
+        message = '解码失败！'
+    return {'code': 0, 'message': message, 'results': results}
+
+
+class Endpoint:
+    """接口定义"""
+
+    def __init__(self, path, lane, error, prepare, run, done_message):
+        """
+        Args:
+            path: 路由
+            lane: 执行通道（同时也是服务角色）
+            error: 错误响应的公共字段
+            prepare: 参数校验和图片解码函数
+            run: 推理函数
+            done_message: 完成日志的前缀
+        """
+        self.path = path
+        self.lane = lane
+        self.error = error
+        self.prepare = prepare
+        self.run = run
+        self.done_message = done_message
+
+
+ENDPOINTS = {
+    '/face_compare': Endpoint('/face_compare', 'face', {'is_same_person': False},
+                              prepare_face, run_face, '比对请求完成'),
+    '/bar_detect': Endpoint('/bar_detect', 'barcode', {'code': -1},
+                            prepare_barcode, run_bar_detect, '检测完成'),
+    '/bar_decode': Endpoint('/bar_decode', 'barcode', {'code': -1},
+                            prepare_barcode, run_bar_decode, '解码完成'),
+}
+
+
+def enabled_endpoints():
+    """本进程启用角色对应的接口"""
+    return {path: endpoint for path, endpoint in ENDPOINTS.items() if endpoint.lane in roles}
+
+
+def request_timeout(headers):
+    """
+    读取客户端给出的处理时限
+
+    Args:
+        headers: 请求头（支持 get 的映射）
+
+    Returns:
+        float: 秒，None 表示不限制
+    """
+    timeout_ms = headers.get('X-Request-Timeout-Ms') or admission_config.get('default_timeout_ms', 0)
+    try:
+        timeout_ms = float(timeout_ms)
+    except ValueError:
+        return None
+    return timeout_ms / 1000 if timeout_ms > 0 else None
+
+
+def _as_outcome(result):
+    """处理函数的返回值（字典或 (字典, 状态码)）转换为 Outcome"""
+    if isinstance(result, tuple):
+        return Outcome(result[0], result[1])
+    return Outcome(result)
+
+
+def prepare_request(path, load, headers):
+    """
+    第一步：解析请求体、校验参数、解码并保存图片（不占用推理槽位）
+
+    Args:
+        path: 接口路由
+        load: 解析请求体的函数，返回 JSON 字典，非 JSON 请求返回 None
+        headers: 请求头
+
+    Returns:
+        (prepared, outcome): 成功时 outcome 为 None；失败时 prepared 为 None，outcome 为错误响应
+    """
+    endpoint = ENDPOINTS[path]
+    try:
+        with stage('body_parse'):
+            data = load()
+        if not isinstance(data, dict):
+            raise RequestError('只支持 JSON 请求格式')
+        prepared = endpoint.prepare(data, headers)
+        # debug=timing：响应体附带各阶段耗时、图片尺寸、NMS 候选数和解码路径
+        prepared['debug'] = data.get('debug') == 'timing'
+        return prepared, None
+    except RequestError as e:
+        logging.error(str(e))
+        return None, Outcome(dict(endpoint.error, message=str(e)), e.status)
+    except DeadlineExceeded as e:
+        logging.warning(f"请求超时放弃: {str(e)}")
+        return None, Outcome(dict(endpoint.error, message=str(e)), 504)
+    except Exception as e:
+        logging.error(f"服务器错误: {str(e)}", exc_info=True)
+        return None, Outcome(dict(endpoint.error, message=f'服务器错误: {str(e)}'), 500)
+
+
+def run_request(path, prepared):
+    """
+    第二步：在执行通道中排队并执行推理，结束后清理临时文件
+    - 模型预热未完成、通道排队已满或排队超时时立即拒绝（429/503，附带 Retry-After）
+    - 携带处理时限时，排队和各处理阶段之间检查截止时间，已超时的请求放弃处理并返回 504
+
+    Args:
+        path: 接口路由
+        prepared: prepare_request 的结果
+
+    Returns:
+        Outcome
+    """
+    endpoint = ENDPOINTS[path]
+    ticket = Ticket(endpoint.lane)
+    try:
+        if registry.eager and not registry.ready(endpoint.lane):
+            return Outcome(dict(endpoint.error, message='模型预热中，请稍后重试'), 503, retry_after=5)
+        ctx = current()
+        with scheduler.slot(endpoint.lane, ctx.remaining() if ctx is not None else None) as ticket:
+            outcome = _as_outcome(endpoint.run(prepared))
+    except LaneFullError as e:
+        logging.warning(f"请求被拒绝: {str(e)}")
+        outcome = Outcome(dict(endpoint.error, message=str(e)), e.status, retry_after=e.retry_after)
+    except DeadlineExceeded as e:
+        logging.warning(f"请求超时放弃: {str(e)}")
+        outcome = Outcome(dict(endpoint.error, message=str(e)), 504)
+    except Exception as e:
+        logging.error(f"服务器错误: {str(e)}", exc_info=True)
+        outcome = Outcome(dict(endpoint.error, message=f'服务器错误: {str(e)}'), 500)
+    finally:
+        cleanup(prepared['paths'])
+    outcome.wait = ticket.wait
+    outcome.service = ticket.service
+    return outcome
+
+
+def handle_request(path, load, headers):
+    """
+    同步处理一次请求（Flask 使用）
+
+    Args:
+        path: 接口路由
+        load: 解析请求体的函数，返回 JSON 字典，非 JSON 请求返回 None
+        headers: 请求头
+
+    Returns:
+        Outcome
+    """
+    prepared = None
+    with request_context(request_timeout(headers), headers.get('X-Request-Id')) as ctx:
+        ctx.trace = tracer.start(path, headers, ctx.request_id)
+        try:
+            mode, armed = profiler.take(path, headers)
+            with profiler.profile(mode, path, ctx, armed):
+                prepared, outcome = prepare_request(path, load, headers)
+                if outcome is None:
+                    outcome = run_request(path, prepared)
+        finally:
+            # run_request 未执行（如性能分析出错）时临时文件也要清理，已清理的文件会被跳过
+            if prepared is not None:
+                cleanup(prepared['paths'])
+    outcome.finish(ctx, debug=prepared is not None and prepared['debug'])
+    return outcome
+
+
+def profiled(mode, armed, path, func, *args):
+    """
+    在分析模式下执行 func（ASGI 在推理线程中使用，只分析推理步骤）
+
+    Args:
+        mode: 分析模式，None 表示不分析
+        armed: 是否占用了 arm 开启的次数
+        path: 接口路由
+        func: 处理函数
+        *args: 处理函数的参数
+    """
+    with profiler.profile(mode, path, current(), armed):
+        return func(*args)
+
+
+def admin_profile(data, headers):
+    """
+    性能分析管理接口
+    GET 返回当前设置；POST {"mode": "cprofile|tracemalloc", "count": N, "endpoint": "/bar_decode"} 开启分析，
+    count 为 0 时关闭。只作用于处理该请求的 worker
+
+    Args:
+        data: POST 的 JSON 请求体，GET 时为 None
+        headers: 请求头（X-Admin-Token）
+
+    Returns:
+        (body, status)
+    """
+    if not profiler.token:
+        return {'message': '性能分析未启用'}, 404
+    if not profiler.authorized(headers):
+        return {'message': '管理令牌错误'}, 403
+    if data is not None:
+        if not isinstance(data, dict):
+            return {'message': '只支持 JSON 请求格式'}, 400
+        endpoint = data.get('endpoint')
+        if endpoint is not None and endpoint not in ENDPOINTS:
+            return {'message': f'未知的接口: {endpoint}'}, 400
+        try:
+            profiler.arm(data.get('mode', 'cprofile'), data.get('count', 1), endpoint)
+        except (TypeError, ValueError) as e:
+            return {'message': str(e)}, 400
+    return dict(profiler.status(), pid=os.getpid()), 200
+
+
+def log_outcome(path, outcome, start_time):
+    """记录请求耗时（日志和监控指标），排队时间单独记录"""
+    cost = time.time() - start_time
+    metrics.observe(path, outcome, cost)
+    cost_time = round(cost, 3)
+    # JSON 日志中以结构化字段输出，便于按请求 ID 和阶段耗时检索
+    fields = {
+        'endpoint': path,
+        'status': outcome.status,
+        'cost_ms': round(cost * 1000, 1),
+        'queue_wait_ms': round(outcome.wait * 1000, 1),
+        'service_ms': round(outcome.service * 1000, 1),
+        'timings': {name: round(ms, 1) for name, ms in outcome.timings().items()},
+    }
+    logging.info(f"{ENDPOINTS[path].done_message}: status={outcome.status}, cost_time: {cost_time}s, "
+                 f"queue_wait: {outcome.wait:.3f}s, service_time: {outcome.service:.3f}s",
+                 extra={'request_id': outcome.request_id, 'fields': fields})
+
+
+def health_status():
+    """存活检查的响应体"""
+    return {
+        'status': 'ok',
+        'pid': os.getpid(),
+        'uptime': round(time.time() - registry.started_at, 1),
+        'models': registry.status(),
+        'lanes': scheduler.status(),
+        'logging': logging_stats()
+    }
+
+
+def ready_status():
+    """
+    就绪检查的响应体和状态码
+    开启预热时所有模型加载并预热完成后返回 200，否则返回 503
+    """
+    ready = registry.ready()
+    return {
+        'ready': ready,
+        'pid': os.getpid(),
+        'models': registry.status()
+    }, 200 if ready else 503
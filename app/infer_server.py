@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地推理服务模块
+一个或几个长期运行的推理进程持有 FaceComparator / BarDetect，gunicorn 的 HTTP worker 不再加载模型，
+而是通过本地 Unix socket 把解码后的图片提交给推理进程：
+- 控制消息为 4 字节长度前缀 + JSON
+- 像素数据放在 multiprocessing.shared_memory 中，只传递共享内存名称和形状，图片不经过 pickle 序列化
+HTTP 并发与模型内存解耦，多个 worker 的请求汇集到同一进程，也为跨请求批处理提供了条件。
+
+启动推理进程（server_config.json 中 infer_server.spawn 为 true 时由 gunicorn 主进程自动启动）:
+    python -m app.infer_server --index 0
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+from app.context import current, request_context, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# 消息头：4 字节无符号大端整数，表示 JSON 的字节数
+_HEADER = struct.Struct(">I")
+
+
+def infer_server_config():
+    """读取 server_config.json 中的 infer_server 配置"""
+    from config_loader import get_config
+    config = get_config("server_config.json").get("infer_server") or {}
+    return {
+        "enabled": config.get("enabled", False),
+        "socket": config.get("socket", "/tmp/ai-supervise-infer.sock"),
+        "processes": config.get("processes", 1),
+        "max_concurrency": config.get("max_concurrency", 2),
+        "spawn": config.get("spawn", True),
+        "timeout": config.get("timeout", 300),
+    }
+
+
+def socket_path(base, index):
+    """第 index 个推理进程的 socket 路径"""
+    return f"{base}.{index}"
+
+
+def send_msg(sock, message):
+    """发送一条 JSON 消息"""
+    data = json.dumps(message, default=_json_default).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_msg(sock):
+    """
+    接收一条 JSON 消息
+
+    Returns:
+        dict，连接关闭时返回 None
+    """
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exact(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _recv_exact(sock, size):
+    """读取 size 字节，连接关闭时返回 None"""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _json_default(obj):
+    """numpy 类型转换为 JSON 可序列化的类型"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"不支持序列化的类型: {type(obj)}")
+
+
+def _attach_image(spec):
+    """
+    从共享内存读取图片
+
+    Args:
+        spec: {"shm": 共享内存名称, "shape": [h, w, 3]}
+
+    Returns:
+        RGB 的 PIL Image
+    """
+    shm = shared_memory.SharedMemory(name=spec["shm"])
+    try:
+        # 共享内存由客户端创建和释放，推理进程退出时不能被 resource_tracker 删除
+        resource_tracker.unregister(shm._name, "shared_memory")
+        pixels = np.ndarray(spec["shape"], dtype=np.uint8, buffer=shm.buf)
+        return Image.fromarray(pixels.copy())
+    finally:
+        shm.close()
+
+
+class InferHandler(socketserver.BaseRequestHandler):
+    """处理一个 HTTP worker 的长连接，逐条执行推理请求"""
+
+    def handle(self):
+        while True:
+            message = recv_msg(self.request)
+            if message is None:
+                return
+            with self.server.semaphore:
+                response = self.server.execute(message)
+            send_msg(self.request, response)
+
+
+class InferServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    推理服务
+    每个连接一个线程，实际同时执行推理的请求数由 max_concurrency 限制
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, max_concurrency=2):
+        """
+        Args:
+            path: Unix socket 路径
+            max_concurrency: 同时执行推理的请求数
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        super().__init__(path, InferHandler)
+
+    def execute(self, message):
+        """
+        执行一条推理请求
+
+        Args:
+            message: {"op": 操作, "images": 共享内存图片列表, "args": 其他参数}
+
+        Returns:
+            dict: {"result": 结果} 或 {"error": 错误类型, ...}
+        """
+        from app.pipelines import registry
+        from app.face_compare import FaceQualityError
+
+        op = message.get("op")
+        args = message.get("args") or {}
+        try:
+            with request_context(message.get("timeout")) as ctx:
+                response = self._execute(registry, op, message, args)
+            # 各处理阶段的耗时和调试信息随结果返回，由 HTTP worker 记录到监控指标和响应中
+            response["stages"] = ctx.stages
+            response["info"] = ctx.info
+            return response
+        except DeadlineExceeded as e:
+            return {"error": "deadline", "stage": e.stage}
+        except FaceQualityError as qe:
+            return {"error": "quality", "reason": qe.reason, "message": str(qe), "image": qe.image}
+        except Exception as e:
+            logger.error(f"推理请求失败 {op}: {e}", exc_info=True)
+            return {"error": "exception", "message": str(e)}
+
+    def _execute(self, registry, op, message, args):
+        """按操作调用对应的流水线"""
+        if op == "ping":
+            return {"result": {"pid": os.getpid(), "models": registry.status()}}
+        images = [_attach_image(spec) for spec in message.get("images", [])]
+        if op == "face_compare":
+            distance, is_same = registry.get("face").compare(images[0], images[1])
+            return {"result": [distance, is_same]}
+        if op == "face_compare_many":
+            return {"result": registry.get("face").compare_many(images[0], images[1:], **args)}
+        if op == "bar_detect":
+            results, _ = registry.get("barcode").predict(images[0])
+            for result in results:
+                result.pop("mask", None)
+            return {"result": results}
+        if op == "bar_decode":
+            return {"result": registry.get("barcode").barcode_decode(images[0], **args)}
+        return {"error": "exception", "message": f"不支持的操作: {op}"}
+
+
+class InferClient:
+    """
+    推理服务客户端
+    每个线程一条长连接，图片通过共享内存传递
+    """
+
+    def __init__(self, path=None, timeout=None):
+        """
+        Args:
+            path: 推理进程的 socket 路径，None 时按配置和当前进程 pid 选择一个推理进程
+            timeout: 单次请求超时（秒）
+        """
+        config = infer_server_config()
+        if path is None:
+            path = socket_path(config["socket"], os.getpid() % max(config["processes"], 1))
+        self.path = path
+        self.timeout = timeout or config["timeout"]
+        self._local = threading.local()
+
+    def _connect(self):
+        """获取当前线程的连接"""
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def call(self, op, images=(), **args):
+        """
+        提交一条推理请求
+
+        Args:
+            op: 操作名称
+            images: 图片列表（路径或 PIL Image）
+            **args: 其他参数
+
+        Returns:
+            推理结果
+        """
+        segments, specs = [], []
+        try:
+            for image in images:
+                if not isinstance(image, Image.Image):
+                    image = Image.open(image)
+                pixels = np.asarray(image.convert("RGB"), dtype=np.uint8)
+                shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+                segments.append(shm)
+                np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[:] = pixels
+                specs.append({"shm": shm.name, "shape": list(pixels.shape)})
+            message = {"op": op, "images": specs, "args": args}
+            # 把请求剩余的处理时限传给推理进程，推理进程在各阶段之间检查
+            ctx = current()
+            if ctx is not None and ctx.deadline is not None:
+                message["timeout"] = max(ctx.remaining(), 0.001)
+            # 推理进程重启后第一次请求会遇到断开的连接，重连一次
+            for attempt in range(2):
+                try:
+                    sock = self._connect()
+                    send_msg(sock, message)
+                    response = recv_msg(sock)
+                    if response is None:
+                        raise ConnectionError("推理服务关闭了连接")
+                    break
+                except (ConnectionError, FileNotFoundError):
+                    self._close()
+                    if attempt:
+                        raise
+                except socket.timeout:
+                    # 超时后连接上可能还有未读取的响应，不能复用
+                    self._close()
+                    raise
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+        if ctx is not None:
+            ctx.stages.extend(tuple(item) for item in response.get("stages", []))
+            for key, values in response.get("info", {}).items():
+                ctx.info.setdefault(key, []).extend(values)
+        if "error" not in response:
+            return response["result"]
+        if response["error"] == "deadline":
+            raise DeadlineExceeded(response["stage"])
+        if response["error"] == "quality":
+            from app.face_compare import FaceQualityError
+            raise FaceQualityError(response["reason"], response["message"], response["image"])
+        raise Exception(f"推理服务错误: {response['message']}")
+
+    def wait_ready(self, timeout=None):
+        """
+        等待推理进程启动完成（推理进程预热完成后才开始监听）
+
+        Args:
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            dict: 推理进程的模型状态
+        """
+        deadline = time.time() + (timeout or self.timeout)
+        while True:
+            try:
+                return self.call("ping")
+            except (ConnectionError, FileNotFoundError, socket.timeout):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+
+
+class RemoteFaceComparator:
+    """接口与 FaceComparator 一致，推理在推理进程中执行"""
+
+    def __init__(self, client=None):
+        self.client = client or InferClient()
+
+    def compare(self, img_path1, img_path2):
+        distance, is_same = self.client.call("face_compare", [img_path1, img_path2])
+        return distance, is_same
+
+    def compare_many(self, img_path1, img_paths2, gallery=False):
+        return self.client.call("face_compare_many", [img_path1] + list(img_paths2), gallery=gallery)
+
+
+class RemoteBarDetect:
+    """接口与 BarDetect 一致，推理在推理进程中执行"""
+
+    def __init__(self, client=None):
+        self.client = client or InferClient()
+
+    def predict(self, image_path):
+        """返回的检测结果不包含 mask，也不返回图片"""
+        return self.client.call("bar_detect", [image_path]), None
+
+    def barcode_decode(self, image_path, client_id=None):
+        return self.client.call("bar_decode", [image_path], client_id=client_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地推理服务")
+    parser.add_argument("--index", type=int, default=0, help="推理进程编号，socket 路径为 <socket>.<index>")
+    parser.add_argument("--socket", default=None, help="socket 路径前缀，默认读取 server_config.json")
+    args = parser.parse_args()
+
+    # 推理进程内使用本地模型（见 app.pipelines）
+    os.environ["INFER_SERVER_PROCESS"] = "1"
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    from app.pipelines import registry, roles
+
+    config = infer_server_config()
+    path = socket_path(args.socket or config["socket"], args.index)
+    # 先加载并预热所有模型，再开始监听，客户端连接成功即表示可以处理请求
+    registry.warmup()
+    server = InferServer(path, config["max_concurrency"])
+    logger.info(f"推理服务已启动: {path}, 角色: {roles}, pid: {os.getpid()}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    # 以 python app/infer_server.py 方式启动时补充项目根目录，模型路径相对于项目根目录
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if project_dir not in sys.path:
+        sys.path.insert(0, project_dir)
+    os.chdir(project_dir)
+    main()
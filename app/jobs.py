@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量任务模块
+几千张图片的审核任务无法在一个 HTTP 请求内完成（gunicorn timeout = 360），改为异步任务：
+- POST /jobs 提交任务（base64 图片，或 jobs.input_dir 下的本地图片路径/目录），立即返回任务 ID
+- GET /jobs/<id> 查询进度，GET /jobs/<id>/results 分页获取结果，format=ndjson 时以 NDJSON 流式返回
+- DELETE /jobs/<id> 取消任务
+
+每个任务保存在 jobs.dir/<id>/ 下：job.json（任务信息和进度）、items.jsonl（每项的图片路径）、
+results.jsonl（每完成一项追加一行）。任务由 worker 的后台线程执行，每项图片仍然经过执行通道（lanes），
+与在线请求共享推理槽位；同一 worker 同时执行一个任务，任务内最多 jobs.workers 项并行。
+执行中的任务持有 lock 文件的 flock 锁，worker 退出后锁自动释放，其他 worker 或重启后的 worker
+读取 results.jsonl 跳过已完成的项，从中断处继续执行。
+job.json 的每次读-改-写（开始执行、更新进度、结束、取消）都持有 meta.lock 的 flock 锁，
+同一进程的请求线程和执行线程之间、不同 worker 之间都互斥。
+"""
+
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from config_loader import get_config
+from app.context import request_context
+from app.lanes import LaneFullError
+from app.handlers import ENDPOINTS, RequestError, enabled_endpoints, save_base64_image, scheduler
+
+logger = logging.getLogger(__name__)
+
+# 任务类型 -> (接口, 图片字段, 本地路径字段)
+JOB_TYPES = {
+    "bar_decode": ("/bar_decode", ("image",), ("path",)),
+    "bar_detect": ("/bar_detect", ("image",), ("path",)),
+    "face_compare": ("/face_compare", ("image1", "image2"), ("path1", "path2")),
+}
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+FINISHED = ("completed", "cancelled", "failed")
+
+
+def jobs_config():
+    """读取 server_config.json 中的 jobs 配置"""
+    config = get_config("server_config.json").get("jobs") or {}
+    return {
+        "enabled": config.get("enabled", True),
+        "dir": config.get("dir", "data/jobs"),
+        "input_dir": config.get("input_dir", "data/jobs_input"),
+        "workers": config.get("workers", 1),
+        "max_items": config.get("max_items", 10000),
+        "max_body_mb": config.get("max_body_mb", 200),
+        "poll_interval": config.get("poll_interval", 2.0),
+        "keep_hours": config.get("keep_hours", 72),
+    }
+
+
+def _write_json(path, data):
+    """原子写入 JSON 文件（先写临时文件再替换）；临时文件名唯一，同时写入的线程互不干扰"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class JobManager:
+    """
+    任务的提交、查询和执行
+    """
+
+    def __init__(self, root, input_dir, workers=1, max_items=10000, poll_interval=2.0, keep_hours=72):
+        """
+        Args:
+            root: 任务目录
+            input_dir: 允许以本地路径提交的图片目录
+            workers: 一个任务内并行执行的项数
+            max_items: 一个任务的最大项数
+            poll_interval: 后台线程查找待执行任务的间隔（秒）
+            keep_hours: 已结束的任务保留的小时数
+        """
+        self.root = root
+        self.input_dir = os.path.realpath(input_dir)
+        self.workers = workers
+        self.max_items = max_items
+        self.poll_interval = poll_interval
+        self.keep_hours = keep_hours
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _dir(self, job_id):
+        """任务目录；任务 ID 只允许十六进制字符，防止路径穿越"""
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        path = os.path.join(self.root, job_id)
+        return path if os.path.isfile(os.path.join(path, "job.json")) else None
+
+    def start(self):
+        """启动本进程的后台执行线程（fork 出的 worker 中重新启动）"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            os.makedirs(self.root, exist_ok=True)
+            threading.Thread(target=self._loop, name="job-runner", daemon=True).start()
+
+    # ---------- 提交 ----------
+
+    def _resolve(self, relative):
+        """解析 input_dir 下的相对路径，不允许访问 input_dir 之外的文件"""
+        if not isinstance(relative, str) or not relative:
+            raise RequestError("图片路径必须为非空字符串")
+        path = os.path.realpath(os.path.join(self.input_dir, relative))
+        if not path.startswith(self.input_dir + os.sep):
+            raise RequestError(f"图片路径不在允许的目录内: {relative}")
+        if not os.path.isfile(path):
+            raise RequestError(f"图片不存在: {relative}")
+        return path
+
+    def _expand_dir(self, relative):
+        """目录下的所有图片（按文件名排序）"""
+        path = os.path.realpath(os.path.join(self.input_dir, relative))
+        if path != self.input_dir and not path.startswith(self.input_dir + os.sep):
+            raise RequestError(f"目录不在允许的范围内: {relative}")
+        if not os.path.isdir(path):
+            raise RequestError(f"目录不存在: {relative}")
+        files = sorted(f for f in glob.glob(os.path.join(path, "**", "*"), recursive=True)
+                       if f.lower().endswith(IMAGE_EXTENSIONS))
+        return [{"path": os.path.relpath(f, self.input_dir)} for f in files]
+
+    def submit(self, data):
+        """
+        提交任务
+        {"type": "bar_decode", "items": [{"image": "<base64>"}, {"path": "a/1.jpg"}]}
+        {"type": "bar_decode", "dir": "2024-06-01"}
+        {"type": "face_compare", "items": [{"image1": "...", "image2": "..."}, {"path1": "...", "path2": "..."}]}
+
+        Returns:
+            (body, status)
+        """
+        if not isinstance(data, dict):
+            return {"message": "只支持 JSON 请求格式"}, 400
+        job_type = data.get("type")
+        if job_type not in JOB_TYPES:
+            return {"message": f"不支持的任务类型: {job_type}，可选 {', '.join(JOB_TYPES)}"}, 400
+        path, image_fields, path_fields = JOB_TYPES[job_type]
+        if path not in enabled_endpoints():
+            return {"message": f"本服务未启用 {path}"}, 404
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.root, job_id)
+        inputs_dir = os.path.join(job_dir, "inputs")
+        os.makedirs(inputs_dir)
+        try:
+            items = data.get("items") or []
+            if data.get("dir") is not None:
+                if len(path_fields) != 1:
+                    raise RequestError("dir 只适用于条形码任务")
+                items = items + self._expand_dir(data["dir"])
+            if not isinstance(items, list) or not items:
+                raise RequestError("items 必须为非空列表，或指定 dir")
+            if len(items) > self.max_items:
+                raise RequestError(f"任务最多 {self.max_items} 项，实际 {len(items)} 项")
+
+            with open(os.path.join(job_dir, "items.jsonl"), "w", encoding="utf-8") as f:
+                for index, item in enumerate(items):
+                    if not isinstance(item, dict):
+                        raise RequestError(f"第 {index} 项必须为对象")
+                    paths, sources = [], []
+                    for image_field, path_field in zip(image_fields, path_fields):
+                        try:
+                            if item.get(path_field) is not None:
+                                paths.append(self._resolve(item[path_field]))
+                                sources.append(item[path_field])
+                            elif isinstance(item.get(image_field), str):
+                                paths.append(save_base64_image(item[image_field], inputs_dir))
+                                sources.append(None)
+                            else:
+                                raise RequestError(f"缺少 {image_field} 或 {path_field}")
+                        except (RequestError, ValueError) as e:
+                            raise RequestError(f"第 {index} 项: {str(e)}")
+                    line = {"index": index, "paths": paths, "sources": sources}
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except BaseException as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            if isinstance(e, RequestError):
+                return {"message": str(e)}, e.status
+            raise
+
+        now = time.time()
+        meta = {
+            "job_id": job_id,
+            "type": job_type,
+            "status": "queued",
+            "total": len(items),
+            "done": 0,
+            "failed": 0,
+            "created": now,
+            "updated": now,
+        }
+        _write_json(os.path.join(job_dir, "job.json"), meta)
+        self.start()
+        self._wakeup.set()
+        logger.info(f"批量任务已提交: {job_id}, type={job_type}, total={len(items)}")
+        return meta, 202
+
+    # ---------- 查询 ----------
+
+    def status(self, job_id):
+        """任务信息和进度"""
+        job_dir = self._dir(job_id)
+        if job_dir is None:
+            return {"message": f"任务不存在: {job_id}"}, 404
+        return _read_json(os.path.join(job_dir, "job.json")), 200
+
+    def results(self, job_id, offset=0, limit=100):
+        """
+        分页获取结果（按完成顺序，每项带 index）
+
+        Returns:
+            (body, status)；next_offset 为 None 表示任务已结束且没有更多结果
+        """
+        job_dir = self._dir(job_id)
+        if job_dir is None:
+            return {"message": f"任务不存在: {job_id}"}, 404
+        offset, limit = max(0, offset), max(1, min(limit, 1000))
+        meta = _read_json(os.path.join(job_dir, "job.json"))
+        results = []
+        path = os.path.join(job_dir, "results.jsonl")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in itertools.islice(f, offset, offset + limit):
+                    if line.endswith("\n"):
+                        results.append(json.loads(line))
+        next_offset = offset + len(results)
+        finished = meta["status"] in FINISHED and len(results) < limit
+        return {
+            "job_id": job_id,
+            "status": meta["status"],
+            "offset": offset,
+            "results": results,
+            "next_offset": None if finished else next_offset,
+        }, 200
+
+    def drain(self, job_id, position=0, max_lines=256):
+        """
+        读取 position 之后已经完整写入的结果行，不等待新结果
+
+        Args:
+            job_id: 任务 ID
+            position: 上一次读到的文件位置（字节）
+            max_lines: 本次最多读取的行数
+
+        Returns:
+            (bytes, 新的 position, 是否已读完全部结果)；任务不存在时返回 None
+        """
+        job_dir = self._dir(job_id)
+        if job_dir is None:
+            return None
+        # 先读状态再读结果：任务结束前写入的结果都能在本次读到
+        finished = _read_json(os.path.join(job_dir, "job.json"))["status"] in FINISHED
+        path = os.path.join(job_dir, "results.jsonl")
+        lines = []
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                f.seek(position)
+                for line in f:
+                    # 正在写入的最后一行不完整，下一次再读
+                    if not line.endswith(b"\n"):
+                        break
+                    position += len(line)
+                    lines.append(line)
+                    if len(lines) >= max_lines:
+                        finished = False
+                        break
+        return b"".join(lines), position, finished
+
+    def stream(self, job_id, follow=False):
+        """
+        以 NDJSON 逐行返回结果
+
+        Args:
+            job_id: 任务 ID
+            follow: 任务未结束时持续输出新完成的结果，直到任务结束
+
+        Returns:
+            生成 bytes 的迭代器，任务不存在时返回 None
+        """
+        if self._dir(job_id) is None:
+            return None
+
+        def generate():
+            position = 0
+            while True:
+                drained = self.drain(job_id, position)
+                if drained is None:
+                    return
+                chunk, position, finished = drained
+                if chunk:
+                    yield chunk
+                if finished or not (chunk or follow):
+                    return
+                if not chunk:
+                    time.sleep(1)
+        return generate()
+
+    @contextmanager
+    def _meta_lock(self, job_dir):
+        """job.json 读-改-写期间持有的锁（flock，同一进程的线程之间和不同 worker 之间都互斥）"""
+        with open(os.path.join(job_dir, "meta.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def cancel(self, job_id):
+        """取消任务；执行中的任务在当前并行的项完成后停止"""
+        job_dir = self._dir(job_id)
+        if job_dir is None:
+            return {"message": f"任务不存在: {job_id}"}, 404
+        meta_path = os.path.join(job_dir, "job.json")
+        with self._meta_lock(job_dir):
+            # 在锁内读取状态：已经完成的任务不会被改写为 cancelled
+            meta = _read_json(meta_path)
+            if meta["status"] in FINISHED:
+                return meta, 200
+            # 取消标记单独保存，执行线程在同一把锁内检查，标记存在后不再写入 running 或进度
+            open(os.path.join(job_dir, "cancelled"), "w").close()
+            meta["status"] = "cancelled"
+            meta["updated"] = time.time()
+            _write_json(meta_path, meta)
+        logger.info(f"批量任务已取消: {job_id}")
+        return meta, 200
+
+    @staticmethod
+    def _cancelled(job_dir):
+        """任务是否已被取消"""
+        return os.path.exists(os.path.join(job_dir, "cancelled"))
+
+    # ---------- 执行 ----------
+
+    def _loop(self):
+        """后台线程：查找未结束且没有被其他 worker 执行的任务"""
+        while True:
+            try:
+                self._run_pending()
+                self._expire()
+            except Exception as e:
+                logger.error(f"批量任务执行线程出错: {str(e)}", exc_info=True)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _run_pending(self):
+        metas = []
+        for meta_path in glob.glob(os.path.join(self.root, "*", "job.json")):
+            try:
+                metas.append(_read_json(meta_path))
+            except (OSError, ValueError):
+                continue
+        # 先提交的任务先执行
+        for meta in sorted(metas, key=lambda m: m["created"]):
+            if meta["status"] in FINISHED:
+                continue
+            job_dir = os.path.join(self.root, meta["job_id"])
+            lock = open(os.path.join(job_dir, "lock"), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # 其他 worker 正在执行
+                lock.close()
+                continue
+            try:
+                self._run(job_dir)
+            finally:
+                lock.close()
+
+    def _completed(self, results_path):
+        """
+        已完成的项；进程中断时最后一行可能写了一半，截断到最后一个完整的行
+
+        Returns:
+            (已完成的 index 集合, 非 200 的项数)
+        """
+        done, failed = set(), 0
+        if not os.path.exists(results_path):
+            return done, failed
+        valid = 0
+        with open(results_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                result = json.loads(line)
+                done.add(result["index"])
+                failed += result["status"] != 200
+                valid += len(line)
+        if valid != os.path.getsize(results_path):
+            with open(results_path, "r+b") as f:
+                f.truncate(valid)
+        return done, failed
+
+    def _run(self, job_dir):
+        """执行（或从中断处继续执行）一个任务"""
+        meta_path = os.path.join(job_dir, "job.json")
+        results_path = os.path.join(job_dir, "results.jsonl")
+        done, failed = self._completed(results_path)
+        with self._meta_lock(job_dir):
+            # 持有锁之后重新读取：扫描之后任务可能已被取消，或已由其他 worker 执行完成
+            meta = _read_json(meta_path)
+            if meta["status"] in FINISHED or self._cancelled(job_dir):
+                return
+            meta.update(status="running", done=len(done), failed=failed, updated=time.time(), pid=os.getpid())
+            _write_json(meta_path, meta)
+        with open(os.path.join(job_dir, "items.jsonl"), encoding="utf-8") as f:
+            items = [item for item in map(json.loads, f) if item["index"] not in done]
+        if done:
+            logger.info(f"批量任务从中断处继续: {meta['job_id']}, 已完成 {len(done)}/{meta['total']}")
+
+        state = {"done": len(done), "failed": failed, "saved": time.time(), "cancelled": False}
+        write_lock = threading.Lock()
+
+        def run_one(item):
+            # 每项开始前检查取消标记（只是一次 stat），取消后尚未开始的项不再执行
+            if state["cancelled"] or self._cancelled(job_dir):
+                state["cancelled"] = True
+                return
+            result = self._run_item(meta, item)
+            line = json.dumps(result, ensure_ascii=False, default=str) + "\n"
+            with write_lock:
+                results.write(line)
+                results.flush()
+                state["done"] += 1
+                state["failed"] += result["status"] != 200
+                # 每秒最多更新一次进度，同时检查是否已被取消
+                if time.time() - state["saved"] >= 1:
+                    state["saved"] = time.time()
+                    with self._meta_lock(job_dir):
+                        if self._cancelled(job_dir):
+                            state["cancelled"] = True
+                            return
+                        current = _read_json(meta_path)
+                        current.update(done=state["done"], failed=state["failed"], updated=state["saved"])
+                        _write_json(meta_path, current)
+
+        with open(results_path, "a", encoding="utf-8") as results, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job") as pool:
+            list(pool.map(run_one, items))
+
+        with self._meta_lock(job_dir):
+            status = "cancelled" if state["cancelled"] or self._cancelled(job_dir) else "completed"
+            meta = _read_json(meta_path)
+            meta.update(status=status, done=state["done"], failed=state["failed"], updated=time.time())
+            _write_json(meta_path, meta)
+        if status == "completed":
+            # 提交时保存的图片不再需要
+            shutil.rmtree(os.path.join(job_dir, "inputs"), ignore_errors=True)
+        logger.info(f"批量任务结束: {meta['job_id']}, status={status}, done={state['done']}, failed={state['failed']}")
+
+    def _run_item(self, meta, item):
+        """在执行通道中处理一项；通道已满时等待后重试，不因在线流量拒绝任务中的项"""
+        path = JOB_TYPES[meta["type"]][0]
+        endpoint = ENDPOINTS[path]
+        if path == "/face_compare":
+            prepared = {"mode": "pair", "paths": item["paths"]}
+        else:
+            prepared = {"paths": item["paths"], "client_id": None}
+        with request_context(request_id=f"{meta['job_id'][:8]}-{item['index']}"):
+            while True:
+                try:
+                    with scheduler.slot(endpoint.lane):
+                        result = endpoint.run(prepared)
+                    break
+                except LaneFullError as e:
+                    time.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error(f"批量任务项处理失败: {meta['job_id']} #{item['index']}: {str(e)}", exc_info=True)
+                    result = dict(endpoint.error, message=f"服务器错误: {str(e)}"), 500
+                    break
+        body, status = result if isinstance(result, tuple) else (result, 200)
+        sources = item.get("sources") or []
+        return {"index": item["index"], "source": sources[0] if len(sources) == 1 else sources,
+                "status": status, "result": body}
+
+    def _expire(self):
+        """删除超过保留时间的已结束任务"""
+        if not self.keep_hours:
+            return
+        deadline = time.time() - self.keep_hours * 3600
+        for meta_path in glob.glob(os.path.join(self.root, "*", "job.json")):
+            try:
+                meta = _read_json(meta_path)
+            except (OSError, ValueError):
+                continue
+            if meta["status"] in FINISHED and meta["updated"] < deadline:
+                shutil.rmtree(os.path.dirname(meta_path), ignore_errors=True)
+
+
+def build_job_manager():
+    """
+    根据 server_config.json 创建任务管理器
+
+    Returns:
+        JobManager，未开启时返回 None
+    """
+    config = jobs_config()
+    if not config["enabled"]:
+        return None
+    return JobManager(config["dir"], config["input_dir"], config["workers"], config["max_items"],
+                      config["poll_interval"], config["keep_hours"])
+
+
+manager = build_job_manager()
+
+
+def start_jobs():
+    """启动批量任务的后台执行线程（与 start_warmup 在同一时机调用）"""
+    if manager is not None:
+        manager.start()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+执行通道模块
+同一 worker 内的请求按接口划分到不同通道（face / barcode），共享 worker 的推理槽位：
+- 每个通道有独立的并发上限和有界等待队列，队列满或等待超时直接拒绝
+- 槽位空出时优先分配给高优先级通道的等待请求，人脸请求再多也不会占满所有槽位
+- 排队等待时间与处理时间分开统计
+- 可选自适应并发：按实测处理时间做加性增、乘性减（AIMD），处理变慢时自动收紧并发上限
+需要 worker 能同时处理多个请求（gunicorn gthread worker 或 waitress 多线程）才能体现效果。
+"""
+
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from app.context import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# 默认通道配置：priority 越小优先级越高
+DEFAULT_LANES = {
+    "barcode": {"priority": 0, "queue": 64, "max_wait": 10},
+    "face": {"concurrency": 1, "priority": 1, "queue": 16, "max_wait": 30},
+}
+
+
+class LaneFullError(Exception):
+    """通道队列已满（429）或排队超时（503）"""
+
+    def __init__(self, lane, message, status=503, retry_after=1):
+        """
+        Args:
+            lane: 通道名称
+            message: 错误信息
+            status: HTTP 状态码
+            retry_after: 建议客户端重试的等待秒数
+        """
+        super().__init__(message)
+        self.lane = lane
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Lane:
+    """单个执行通道的配置和统计"""
+
+    def __init__(self, name, concurrency, queue, priority, max_wait, target_ms=0):
+        """
+        Args:
+            name: 通道名称
+            concurrency: 同时执行的请求数上限
+            queue: 等待队列长度上限
+            priority: 优先级，越小越优先
+            max_wait: 最长排队时间（秒）
+            target_ms: 自适应并发的目标处理时间（毫秒），0 表示固定使用 concurrency
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.priority = priority
+        self.max_wait = max_wait
+        self.target = target_ms / 1000
+        self.limit = float(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.service_total = 0.0
+
+    def current_limit(self):
+        """当前生效的并发上限"""
+        return max(1, int(self.limit)) if self.target else self.concurrency
+
+    def record(self, service):
+        """
+        根据处理时间调整自适应并发上限：低于目标时每轮加 1，高于目标时乘以 0.8
+
+        Args:
+            service: 本次处理时间（秒）
+        """
+        if not self.target:
+            return
+        if service <= self.target:
+            self.limit = min(self.concurrency, self.limit + 1 / self.limit)
+        else:
+            self.limit = max(1.0, self.limit * 0.8)
+
+    def retry_after(self):
+        """按平均处理时间估算排队的请求处理完所需的秒数"""
+        avg_service = self.service_total / self.completed if self.completed else 1.0
+        return max(1, math.ceil(avg_service * (self.waiting + 1) / self.current_limit()))
+
+    def status(self):
+        """通道状态和累计统计"""
+        return {
+            "concurrency": self.concurrency,
+            "limit": self.current_limit(),
+            "queue": self.queue,
+            "priority": self.priority,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_total / self.completed * 1000, 1) if self.completed else 0,
+            "avg_service_ms": round(self.service_total / self.completed * 1000, 1) if self.completed else 0,
+        }
+
+
+class Ticket:
+    """一次请求在通道中的记录"""
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.wait = 0.0
+        self.service = 0.0
+
+
+class LaneScheduler:
+    """
+    通道调度器
+    """
+
+    def __init__(self, slots, lanes):
+        """
+        Args:
+            slots: worker 的推理槽位数（所有通道共享）
+            lanes: {通道名称: 配置}
+        """
+        self.slots = slots
+        self.in_use = 0
+        self.lanes = {}
+        top = min((config.get("priority", 1) for config in lanes.values()), default=1)
+        for name, config in lanes.items():
+            concurrency = min(config.get("concurrency", slots), slots)
+            if config.get("priority", 1) > top:
+                # 低优先级通道至少给最高优先级通道留出一个槽位，人脸请求再多也不会占满 worker
+                concurrency = min(concurrency, max(1, slots - 1))
+            self.lanes[name] = Lane(
+                name,
+                concurrency=concurrency,
+                queue=config.get("queue", 16),
+                priority=config.get("priority", 1),
+                max_wait=config.get("max_wait", 30),
+                target_ms=config.get("target_ms", 0),
+            )
+        if slots < 2 and len(lanes) > 1:
+            logger.warning(f"执行通道只有 {slots} 个槽位，无法为高优先级通道预留槽位，"
+                           f"需要 gthread worker 且 threads（或 lanes.slots）大于 1")
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        # 通道的排队数、执行数变化时调用，参数为 Lane（用于导出监控指标）
+        self.observer = None
+
+    def _notify(self, lane):
+        """通知观察者通道状态变化，调用时持有锁"""
+        if self.observer is not None:
+            self.observer(lane)
+
+    def _next_waiter(self):
+        """所属通道还有空余并发的等待请求中，优先级最高、最早到达的一个"""
+        eligible = [w for w in self._waiters if w[2].in_flight < w[2].current_limit()]
+        return min(eligible, key=lambda w: (w[0], w[1])) if eligible else None
+
+    @contextmanager
+    def slot(self, name, timeout=None):
+        """
+        在通道中排队并占用一个槽位
+
+        Args:
+            name: 通道名称
+            timeout: 请求剩余的处理时限（秒），排队超过时抛出 DeadlineExceeded
+
+        Yields:
+            Ticket: 记录排队时间和处理时间
+        """
+        lane = self.lanes[name]
+        ticket = Ticket(name)
+        start = time.perf_counter()
+        with self._cond:
+            if lane.waiting >= lane.queue:
+                lane.rejected += 1
+                raise LaneFullError(name, f"{name} 通道排队已满，请稍后重试", 429, lane.retry_after())
+            if timeout is not None and timeout <= 0:
+                raise DeadlineExceeded("queue")
+            waiter = (lane.priority, next(self._seq), lane)
+            self._waiters.append(waiter)
+            lane.waiting += 1
+            self._notify(lane)
+            try:
+                wait_limit = lane.max_wait if timeout is None else min(lane.max_wait, timeout)
+                deadline = start + wait_limit
+                while not (self.in_use < self.slots and self._next_waiter() is waiter):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        if timeout is not None and timeout <= lane.max_wait:
+                            raise DeadlineExceeded("queue")
+                        lane.rejected += 1
+                        raise LaneFullError(name, f"{name} 通道排队超时，请稍后重试", 503, lane.retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(waiter)
+                lane.waiting -= 1
+                self._notify(lane)
+                # 自己离开队列后，其他等待者的次序可能变化
+                self._cond.notify_all()
+            self.in_use += 1
+            lane.in_flight += 1
+            self._notify(lane)
+        ticket.wait = time.perf_counter() - start
+
+        service_start = time.perf_counter()
+        try:
+            yield ticket
+        finally:
+            ticket.service = time.perf_counter() - service_start
+            with self._cond:
+                self.in_use -= 1
+                lane.in_flight -= 1
+                lane.completed += 1
+                lane.wait_total += ticket.wait
+                lane.service_total += ticket.service
+                lane.record(ticket.service)
+                self._notify(lane)
+                self._cond.notify_all()
+
+    def status(self):
+        """所有通道的状态"""
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "in_use": self.in_use,
+                "lanes": {name: lane.status() for name, lane in self.lanes.items()},
+            }
+
+
+def build_scheduler(s_configs):
+    """
+    根据 server_config.json 创建通道调度器
+
+    Args:
+        s_configs: 服务器配置
+
+    Returns:
+        LaneScheduler
+    """
+    config = s_configs.get("lanes") or {}
+    slots = config.get("slots") or (s_configs["threads"] if "threads" in s_configs else 1)
+    lanes = {}
+    for name, default in DEFAULT_LANES.items():
+        lanes[name] = dict(default, **(config.get(name) or {}))
+    return LaneScheduler(slots, lanes)
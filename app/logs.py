@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志模块
+请求线程只把日志记录放入有界队列，格式化、写文件和日志轮转都在后台的 QueueListener 线程中完成，
+磁盘繁忙时日志 I/O 不再直接计入请求耗时：
+- 队列已满时丢弃记录而不阻塞请求（丢弃数见 /healthz 的 logging 字段）
+- 可按级别采样，例如只保留 10% 的 INFO 日志
+- 默认输出 JSON 格式，每条记录附带请求 ID；请求完成日志附带状态码、耗时和各阶段耗时
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config_loader import get_config
+from app.context import current
+
+
+def logging_config():
+    """读取 server_config.json 中的 logging 配置"""
+    config = get_config("server_config.json").get("logging") or {}
+    return {
+        "format": config.get("format", "json"),
+        "queue_size": config.get("queue_size", 10000),
+        "sample": config.get("sample") or {},
+        "console": config.get("console", True),
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON"""
+
+    def format(self, record):
+        data = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            data["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    非阻塞的队列日志处理器
+    在请求线程中只做采样判断、记录请求 ID 和放入队列，队列已满时丢弃
+    """
+
+    def __init__(self, log_queue, sample=None):
+        """
+        Args:
+            log_queue: 有界队列
+            sample: {级别名称: 保留比例}，未配置的级别全部保留
+        """
+        super().__init__(log_queue)
+        self.sample = {logging.getLevelName(name): rate for name, rate in (sample or {}).items()}
+        self.dropped = 0
+        self.sampled = 0
+
+    def emit(self, record):
+        rate = self.sample.get(record.levelno)
+        if rate is not None and random.random() >= rate:
+            self.sampled += 1
+            return
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+        在请求线程中固定消息和异常文本（参数可能在之后被修改），格式化留给后台线程
+        请求 ID 取自请求上下文，后台线程中无法获取
+        """
+        ctx = current()
+        if ctx is not None and not hasattr(record, "request_id"):
+            record.request_id = ctx.request_id
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _Pipeline:
+    """当前进程的日志队列和后台线程"""
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self.outputs = ()
+        self.queue_size = 10000
+
+    def start(self):
+        self.handler.queue = queue.Queue(maxsize=self.queue_size)
+        self.listener = QueueListener(self.handler.queue, *self.outputs, respect_handler_level=True)
+        self.listener.start()
+
+    def after_fork(self):
+        """后台线程不会被 fork 继承（gunicorn preload 模式），子进程中换一个新队列并重新启动"""
+        if self.handler is not None:
+            self.listener = None
+            self.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self):
+        """丢弃和采样跳过的记录数"""
+        if self.handler is None:
+            return {}
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled": self.handler.sampled,
+        }
+
+
+_pipeline = _Pipeline()
+
+
+def setup_logging(log_dir=None):
+    """
+    配置日志系统：根 logger 只挂一个非阻塞的队列处理器，文件和控制台输出在后台线程中执行
+
+    Args:
+        log_dir: 日志目录，默认为项目根目录下的 logs
+
+    Returns:
+        根 logger
+    """
+    config = logging_config()
+    if log_dir is None:
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        log_dir = os.path.join(project_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    if config["format"] == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+
+    # 文件处理器（带日志轮转，每个文件最大10MB，保留5个备份），轮转在后台线程中进行
+    file_handler = RotatingFileHandler(
+        os.path.join(log_dir, 'server.log'),
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    outputs = [file_handler]
+    if config["console"]:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(formatter)
+        outputs.append(console_handler)
+
+    _pipeline.stop()
+    _pipeline.handler = DroppingQueueHandler(None, config["sample"])
+    _pipeline.outputs = tuple(outputs)
+    _pipeline.queue_size = config["queue_size"]
+    _pipeline.start()
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()
+    logger.addHandler(_pipeline.handler)
+    return logger
+
+
+def stats():
+    """日志队列的统计信息"""
+    return _pipeline.stats()
+
+
+os.register_at_fork(after_in_child=_pipeline.after_fork)
+# 进程退出前把队列中剩余的记录写完
+atexit.register(_pipeline.stop)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控指标模块
+通过 /metrics 接口导出 Prometheus 格式的指标：
+- 按接口和处理阶段划分的耗时直方图（body_parse、base64_decode、image_decode、preprocess、infer、
+  postprocess、postprocess.nms、postprocess.mask、rectify、zbar、mtcnn、align、embedding、queue；
+  带点的子阶段已计入父阶段）
+- 按结果划分的请求数、每张图片的检测数
+- 各执行通道的排队数和执行数
+多个 gunicorn worker 的指标通过 prometheus_client 的 multiprocess 模式汇总：每个进程把数值写入
+PROMETHEUS_MULTIPROC_DIR 下的 mmap 文件，任意一个 worker 响应 /metrics 时读取所有文件合并。
+该环境变量必须在导入 prometheus_client 之前设置（见 setup_multiprocess），所以本模块导入时不创建指标，
+由 app.handlers 在 worker 中创建 Metrics 实例。
+未安装 prometheus_client 或 metrics.enabled 为 false 时，所有记录函数不做任何事。
+"""
+
+import logging
+import os
+import shutil
+
+from config_loader import get_config
+
+logger = logging.getLogger(__name__)
+
+# 阶段耗时的直方图分桶（秒），覆盖条形码的毫秒级阶段和人脸的秒级阶段
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DETECTION_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+
+def metrics_config():
+    """读取 server_config.json 中的 metrics 配置"""
+    config = get_config("server_config.json").get("metrics") or {}
+    return {
+        "enabled": config.get("enabled", True),
+        "multiproc_dir": config.get("multiproc_dir", "/tmp/ai-supervise-metrics"),
+    }
+
+
+def setup_multiprocess():
+    """
+    在 gunicorn 主进程（或 uvicorn 多 worker 启动前）中调用：清空并设置 multiprocess 目录
+    环境变量 PROMETHEUS_MULTIPROC_DIR 已设置时沿用该目录
+    """
+    config = metrics_config()
+    if not config["enabled"]:
+        return
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or config["multiproc_dir"]
+    # 上次运行遗留的文件会被当作已退出进程的数据合并进来，启动时清空
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+
+def mark_process_dead(pid):
+    """worker 退出时清理它的 gauge 文件，避免已退出 worker 的排队数和执行数仍被计入"""
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(pid)
+
+
+def _outcome(status):
+    """HTTP 状态码对应的请求结果"""
+    if status == 200:
+        return "ok"
+    if status == 422:
+        return "quality"
+    if status in (429, 503):
+        return "rejected"
+    if status == 504:
+        return "deadline"
+    if status >= 500:
+        return "error"
+    return "bad_request"
+
+
+class Metrics:
+    """
+    指标集合
+    """
+
+    def __init__(self):
+        self.enabled = False
+        if not metrics_config()["enabled"]:
+            return
+        try:
+            import prometheus_client
+        except ImportError:
+            logger.info("未安装 prometheus_client，/metrics 不可用")
+            return
+        from prometheus_client import Counter, Gauge, Histogram
+
+        self.enabled = True
+        self.prometheus_client = prometheus_client
+        self.requests = Counter(
+            "ai_requests_total", "请求数", ["endpoint", "outcome"])
+        self.latency = Histogram(
+            "ai_request_duration_seconds", "请求总耗时", ["endpoint"], buckets=STAGE_BUCKETS)
+        self.stages = Histogram(
+            "ai_stage_duration_seconds", "各处理阶段耗时", ["endpoint", "stage"], buckets=STAGE_BUCKETS)
+        self.detections = Histogram(
+            "ai_detections_per_image", "每张图片检测到的条形码数", ["endpoint"], buckets=DETECTION_BUCKETS)
+        self.waiting = Gauge(
+            "ai_lane_waiting", "通道排队数", ["lane"], multiprocess_mode="livesum")
+        self.in_flight = Gauge(
+            "ai_lane_in_flight", "通道执行数", ["lane"], multiprocess_mode="livesum")
+
+    def observe(self, path, outcome, cost):
+        """
+        记录一次请求
+
+        Args:
+            path: 接口路由
+            outcome: app.handlers.Outcome
+            cost: 请求总耗时（秒）
+        """
+        if not self.enabled:
+            return
+        endpoint = path.strip("/")
+        self.requests.labels(endpoint, _outcome(outcome.status)).inc()
+        self.latency.labels(endpoint).observe(cost)
+        if outcome.wait:
+            self.stages.labels(endpoint, "queue").observe(outcome.wait)
+        for name, secs in outcome.stages:
+            self.stages.labels(endpoint, name).observe(secs)
+        if outcome.status == 200 and isinstance(outcome.body.get("results"), list):
+            self.detections.labels(endpoint).observe(len(outcome.body["results"]))
+
+    def lane_changed(self, lane):
+        """LaneScheduler 的观察者：更新通道的排队数和执行数"""
+        self.waiting.labels(lane.name).set(lane.waiting)
+        self.in_flight.labels(lane.name).set(lane.in_flight)
+
+    def render(self):
+        """
+        生成 /metrics 响应
+
+        Returns:
+            (bytes, content_type)，不可用时返回 None
+        """
+        if not self.enabled:
+            return None
+        client = self.prometheus_client
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = client.REGISTRY
+        return client.generate_latest(registry), client.CONTENT_TYPE_LATEST
+
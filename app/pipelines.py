@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理流水线注册模块
+每个接口对应的业务对象（FaceComparator / BarDetect）在第一次使用时才创建，
+只注册本进程启用角色（face / barcode）的流水线，
+也可以在启动时预先加载并用合成输入预热，/healthz 和 /readyz 接口据此报告各模型的状态。
+"""
+
+import importlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 服务角色，每个角色对应一个流水线及其接口
+ROLES = ("face", "barcode")
+# 各角色的业务模块，preload 模式下在主进程中导入
+ROLE_MODULES = {"face": "app.face_compare", "barcode": "app.barcode_detect"}
+
+# 流水线状态
+STATE_IDLE = "idle"          # 尚未加载
+STATE_LOADING = "loading"    # 正在加载模型
+STATE_WARMING = "warming"    # 正在预热
+STATE_READY = "ready"        # 可以处理请求
+STATE_FAILED = "failed"      # 加载或预热失败
+
+
+class Pipeline:
+    """
+    单个推理流水线：延迟创建业务对象，记录加载和预热耗时
+    """
+
+    def __init__(self, name, factory, warmup=None):
+        """
+        Args:
+            name: 流水线名称
+            factory: 创建业务对象的函数，依赖在函数内部导入
+            warmup: 预热函数，参数为业务对象
+        """
+        self.name = name
+        self.factory = factory
+        self.warmup_fn = warmup
+        self.instance = None
+        self.state = STATE_IDLE
+        self.error = None
+        self.load_ms = None
+        self.warmup_ms = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        获取业务对象，第一次调用时加载
+
+        Returns:
+            业务对象实例
+        """
+        if self.instance is not None:
+            return self.instance
+        with self._lock:
+            if self.instance is None:
+                self.state = STATE_LOADING
+                start = time.perf_counter()
+                try:
+                    instance = self.factory()
+                except Exception as e:
+                    self.state = STATE_FAILED
+                    self.error = str(e)
+                    logger.error(f"流水线 {self.name} 加载失败: {e}", exc_info=True)
+                    raise
+                self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+                self.error = None
+                self.instance = instance
+                self.state = STATE_READY
+                logger.info(f"流水线 {self.name} 加载完成: {self.load_ms}ms")
+        return self.instance
+
+    def warmup(self):
+        """加载并用合成输入预热，失败时记录状态不抛出异常"""
+        try:
+            instance = self.get()
+            if self.warmup_fn is None or self.warmup_ms is not None:
+                return
+            self.state = STATE_WARMING
+            start = time.perf_counter()
+            self.warmup_fn(instance)
+            self.warmup_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.state = STATE_READY
+            logger.info(f"流水线 {self.name} 预热完成: {self.warmup_ms}ms")
+        except Exception as e:
+            self.state = STATE_FAILED
+            self.error = str(e)
+            logger.error(f"流水线 {self.name} 预热失败: {e}", exc_info=True)
+
+    def status(self):
+        """返回状态信息"""
+        return {
+            "state": self.state,
+            "load_ms": self.load_ms,
+            "warmup_ms": self.warmup_ms,
+            "error": self.error,
+        }
+
+
+class PipelineRegistry:
+    """
+    流水线注册表
+    """
+
+    def __init__(self):
+        self._pipelines = {}
+        self.eager = False
+        self.started_at = time.time()
+
+    def register(self, name, factory, warmup=None):
+        """
+        注册流水线
+
+        Args:
+            name: 流水线名称
+            factory: 创建业务对象的函数
+            warmup: 预热函数
+        """
+        self._pipelines[name] = Pipeline(name, factory, warmup)
+
+    def names(self):
+        """已注册的流水线名称"""
+        return list(self._pipelines)
+
+    def get(self, name):
+        """
+        获取流水线的业务对象（延迟加载）
+
+        Args:
+            name: 流水线名称
+
+        Returns:
+            业务对象实例
+        """
+        if name not in self._pipelines:
+            raise Exception(f"未注册的流水线: {name}")
+        return self._pipelines[name].get()
+
+    def warmup(self, background=False):
+        """
+        加载并预热所有流水线
+
+        Args:
+            background: 在后台线程中执行，worker 启动后即可响应 /healthz
+        """
+        self.eager = True
+        if background:
+            threading.Thread(target=self.warmup, name="pipeline-warmup", daemon=True).start()
+            return
+        for pipeline in self._pipelines.values():
+            pipeline.warmup()
+
+    def status(self):
+        """各流水线的状态"""
+        return {name: pipeline.status() for name, pipeline in self._pipelines.items()}
+
+    def ready(self, name=None):
+        """
+        是否可以接收流量
+        开启预热时要求所有流水线都已就绪；延迟加载模式下只要没有失败即视为就绪
+
+        Args:
+            name: 只检查指定的流水线，None 表示检查全部
+
+        Returns:
+            bool
+        """
+        pipelines = [self._pipelines[name]] if name else self._pipelines.values()
+        states = [pipeline.state for pipeline in pipelines]
+        if self.eager:
+            return all(state == STATE_READY for state in states)
+        return STATE_FAILED not in states
+
+
+def _synthetic_image(size=(640, 480)):
+    """生成随机噪声图片作为预热输入"""
+    pixels = np.random.RandomState(0).randint(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def create_face():
+    """创建人脸比对业务对象"""
+    from app.face_compare import FaceComparator
+    return FaceComparator()
+
+
+def warmup_face(comparator):
+    """人脸流水线预热：跑一遍检测（初始化 P/R/O-Net）和批大小 1 的特征提取"""
+    comparator.detect(_synthetic_image())
+    comparator.extract_embeddings(np.zeros((1, 3, 160, 160), dtype=np.float32))
+
+
+def create_barcode():
+    """创建条形码业务对象"""
+    from app.barcode_detect import BarDetect
+    return BarDetect()
+
+
+def warmup_barcode(bar):
+    """条形码流水线预热：完整跑一遍预处理、推理和后处理"""
+    bar.predict(_synthetic_image((640, 640)))
+
+
+def enabled_roles():
+    """
+    本进程启用的服务角色
+    优先级: 环境变量 SERVICE_ROLES（逗号分隔）> server_config.json 的 roles > 全部角色
+
+    Returns:
+        list: 角色名称列表
+    """
+    roles = os.getenv("SERVICE_ROLES")
+    if roles:
+        roles = [role.strip() for role in roles.split(",") if role.strip()]
+    else:
+        from config_loader import get_config
+        roles = get_config("server_config.json").get("roles") or list(ROLES)
+    unknown = [role for role in roles if role not in ROLES]
+    if unknown:
+        raise Exception(f"未知的服务角色: {unknown}，可选: {list(ROLES)}")
+    return roles
+
+
+def create_remote_face():
+    """推理服务模式：创建转发到推理进程的人脸比对对象"""
+    from app.infer_server import RemoteFaceComparator
+    return RemoteFaceComparator()
+
+
+def create_remote_barcode():
+    """推理服务模式：创建转发到推理进程的条形码对象"""
+    from app.infer_server import RemoteBarDetect
+    return RemoteBarDetect()
+
+
+def warmup_remote(remote):
+    """推理服务模式的预热：等待推理进程加载并预热完成"""
+    remote.client.wait_ready()
+
+
+def use_infer_server():
+    """
+    HTTP worker 是否把推理转发到本地推理进程
+    server_config.json 中 infer_server.enabled 为 true 且当前不是推理进程本身时启用
+    """
+    if os.getenv("INFER_SERVER_PROCESS") == "1":
+        return False
+    from app.infer_server import infer_server_config
+    return infer_server_config()["enabled"]
+
+
+def preload():
+    """
+    preload 模式下在 gunicorn 主进程 fork 之前调用：导入启用角色的业务模块，并由模型管理器预加载模型
+    推理服务模式下模型由推理进程持有，不做任何事
+
+    Returns:
+        list: 预加载的角色
+    """
+    if remote:
+        return []
+    from nets.model_manager import manager
+    for role in roles:
+        importlib.import_module(ROLE_MODULES[role])
+        manager.preload(role)
+    return roles
+
+
+registry = PipelineRegistry()
+# 只注册启用角色的流水线，未启用角色的依赖（torch、pyzbar 等）不会被导入
+roles = enabled_roles()
+remote = use_infer_server()
+if "face" in roles:
+    if remote:
+        registry.register("face", create_remote_face, warmup_remote)
+    else:
+        registry.register("face", create_face, warmup_face)
+if "barcode" in roles:
+    if remote:
+        registry.register("barcode", create_remote_barcode, warmup_remote)
+    else:
+        registry.register("barcode", create_barcode, warmup_barcode)
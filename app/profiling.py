@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按需性能分析模块
+线上某类图片处理变慢时，不需要挂调试器即可查看时间花在哪里：
+- 管理接口 POST /admin/profile 为本 worker 接下来的 N 个请求（可限定接口）开启分析
+- 或者单个请求携带 X-Profile 请求头，只分析这一个请求（多 worker 部署时更方便定位）
+两种方式都需要在 X-Admin-Token 请求头中给出 profiling.token（或环境变量 PROFILE_TOKEN），未配置令牌时关闭。
+
+分析模式：
+- cprofile: 记录函数调用耗时，保存 .prof 文件（可用 snakeviz 等工具查看）和按累计耗时排序的 .txt 摘要
+- tracemalloc: 记录每个处理阶段内的峰值内存分配和分配最多的代码行，保存为 .json
+结果写入 logs/profiles/，文件名包含请求 ID（响应头 X-Request-Id）。
+未开启时每个请求只多一次请求头查找和整数比较，不启动任何分析器。
+"""
+
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+MODES = ("cprofile", "tracemalloc")
+
+
+class Profiler:
+    """
+    性能分析开关和执行
+    """
+
+    def __init__(self, token="", out_dir="logs/profiles", max_count=100):
+        """
+        Args:
+            token: 管理令牌，为空时关闭分析功能
+            out_dir: 分析结果目录
+            max_count: 一次最多开启的请求数
+        """
+        self.token = token
+        self.out_dir = out_dir
+        self.max_count = max_count
+        self.mode = None
+        self.endpoint = None
+        self.remaining = 0
+        self._lock = threading.Lock()
+        # cProfile 和 tracemalloc 都是进程级的，同一时刻只分析一个请求
+        self._busy = threading.Lock()
+
+    def authorized(self, headers):
+        """请求头中的令牌是否正确"""
+        token = headers.get("X-Admin-Token")
+        return bool(self.token) and token is not None and hmac.compare_digest(token, self.token)
+
+    def arm(self, mode, count, endpoint=None):
+        """
+        为接下来的 count 个请求开启分析
+
+        Args:
+            mode: cprofile 或 tracemalloc
+            count: 请求数，0 表示关闭
+            endpoint: 只分析该接口的请求，None 表示全部
+        """
+        if mode not in MODES:
+            raise ValueError(f"不支持的分析模式: {mode}")
+        with self._lock:
+            self.mode = mode
+            self.endpoint = endpoint
+            self.remaining = max(0, min(int(count), self.max_count))
+        logger.info(f"性能分析已开启: mode={mode}, count={self.remaining}, endpoint={endpoint}")
+
+    def status(self):
+        """当前的分析设置"""
+        return {
+            "enabled": bool(self.token),
+            "mode": self.mode,
+            "endpoint": self.endpoint,
+            "remaining": self.remaining,
+            "dir": self.out_dir,
+        }
+
+    def take(self, path, headers):
+        """
+        判断本次请求是否需要分析
+
+        Args:
+            path: 接口路由
+            headers: 请求头
+
+        Returns:
+            (分析模式, 是否占用了 arm 开启的次数)，不需要分析时模式为 None
+        """
+        mode = headers.get("X-Profile")
+        if mode is not None and self.authorized(headers):
+            return (mode if mode in MODES else None), False
+        if not self.remaining:
+            return None, False
+        with self._lock:
+            if self.remaining and self.endpoint in (None, path):
+                self.remaining -= 1
+                return self.mode, True
+        return None, False
+
+    @contextmanager
+    def profile(self, mode, path, ctx, armed=False):
+        """
+        在分析模式下执行一段处理，结束后把结果写入文件
+
+        Args:
+            mode: cprofile 或 tracemalloc
+            path: 接口路由
+            ctx: 请求上下文（提供请求 ID 和阶段记录）
+            armed: 是否占用了 arm 开启的次数（take 的第二个返回值）
+        """
+        if mode is None:
+            yield
+            return
+        if not self._busy.acquire(blocking=False):
+            # 其他请求正在分析时跳过，不排队；占用的次数归还，留给之后的请求
+            if armed:
+                with self._lock:
+                    self.remaining = min(self.remaining + 1, self.max_count)
+            yield
+            return
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            # 请求 ID 可能来自客户端，只保留安全字符再用作文件名
+            request_id = re.sub(r"[^A-Za-z0-9_.-]", "_", ctx.request_id)[:64]
+            prefix = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{path.strip('/')}_{request_id}")
+            if mode == "cprofile":
+                with self._cprofile(prefix):
+                    yield
+            else:
+                with self._tracemalloc(prefix, ctx):
+                    yield
+            logger.info(f"性能分析结果已保存: {prefix}")
+        finally:
+            self._busy.release()
+
+    @contextmanager
+    def _cprofile(self, prefix):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(prefix + ".prof")
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(50)
+            with open(prefix + ".txt", "w", encoding="utf-8") as f:
+                f.write(summary.getvalue())
+
+    @contextmanager
+    def _tracemalloc(self, prefix, ctx):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        # stage() 检测到 memory 不为 None 时记录每个阶段内的峰值分配
+        ctx.memory = []
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started:
+                tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:30]
+            report = {
+                "request_id": ctx.request_id,
+                "stages": [{"stage": name, "peak_kb": round(peak_bytes / 1024, 1)} for name, peak_bytes in ctx.memory],
+                "current_kb": round(current / 1024, 1),
+                "peak_kb": round(peak / 1024, 1),
+                "top": [{"line": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                        for stat in top],
+            }
+            ctx.memory = None
+            with open(prefix + ".json", "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def build_profiler(s_configs):
+    """
+    根据 server_config.json 创建性能分析器
+
+    Args:
+        s_configs: 服务器配置
+
+    Returns:
+        Profiler
+    """
+    config = s_configs.get("profiling") or {}
+    return Profiler(
+        token=os.getenv("PROFILE_TOKEN") or config.get("token", ""),
+        out_dir=config.get("dir", "logs/profiles"),
+        max_count=config.get("max_count", 100),
+    )
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求追踪模块
+为每个请求生成一棵调用树（trace）：根 span 是整个请求，stage() 标记的每个处理阶段和
+span() 标记的业务函数（BarDetect.predict、FaceComparator.compare 等）都是其中的子 span，
+annotate() 记录的调试信息（图片尺寸、检测数等）作为当前 span 的属性。
+慢请求的完整调用树可以事后从文件中查看，不依赖额外的服务。
+
+导出方式（server_config.json 的 tracing.exporter）：
+- file: 默认，每个 span 一行 JSON，写入 logs/traces.jsonl
+- otlp: 以 OTLP/HTTP JSON 格式发送到 tracing.otlp_endpoint（如 OpenTelemetry Collector 的 4318 端口）
+span 在请求结束后放入有界队列，由后台线程批量导出，队列已满时丢弃，不阻塞请求。
+客户端携带 W3C traceparent 请求头时沿用其中的 trace id，便于与上游的调用链拼接。
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+
+from config_loader import get_config
+from app.context import current
+
+logger = logging.getLogger(__name__)
+
+
+def tracing_config():
+    """读取 server_config.json 中的 tracing 配置"""
+    config = get_config("server_config.json").get("tracing") or {}
+    return {
+        "enabled": config.get("enabled", False),
+        "sample": config.get("sample", 1.0),
+        "exporter": config.get("exporter", "file"),
+        "path": config.get("path", "logs/traces.jsonl"),
+        "otlp_endpoint": config.get("otlp_endpoint", "http://127.0.0.1:4318"),
+        "service_name": config.get("service_name", "ai-supervise-server"),
+        "queue_size": config.get("queue_size", 1000),
+    }
+
+
+class Span:
+    """一个处理步骤"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """
+    一个请求的全部 span
+    同一请求内的处理是顺序执行的（可能跨线程），用一个栈记录当前的父 span
+    """
+
+    def __init__(self, name, trace_id=None, parent_id=None, attributes=None):
+        """
+        Args:
+            name: 根 span 名称（接口路由）
+            trace_id: 沿用上游的 trace id，None 时生成
+            parent_id: 上游的 span id
+            attributes: 根 span 的属性
+        """
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.root = Span(name, self.trace_id, parent_id, attributes)
+        self.spans = [self.root]
+        self._stack = [self.root]
+
+    @property
+    def current(self):
+        """当前打开的 span"""
+        return self._stack[-1]
+
+    def start(self, name, attributes=None):
+        """打开一个子 span"""
+        span = Span(name, self.trace_id, self._stack[-1].span_id, attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+
+    def end(self, span, error=None):
+        """关闭 span"""
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.status = "error"
+            span.attributes["error"] = f"{type(error).__name__}: {error}"
+        if span in self._stack:
+            self._stack.remove(span)
+
+
+def parse_traceparent(value):
+    """
+    解析 W3C traceparent 请求头（00-<trace id>-<span id>-<flags>）
+
+    Returns:
+        (trace_id, parent_id)，格式不正确时返回 (None, None)
+    """
+    parts = (value or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        try:
+            int(parts[1], 16)
+            int(parts[2], 16)
+        except ValueError:
+            return None, None
+        return parts[1], parts[2]
+    return None, None
+
+
+class BatchExporter:
+    """
+    导出器基类：数据（span、流量记录）放入有界队列，后台线程批量调用 export
+    后台线程在第一次提交时启动，fork 出的子进程中重新启动
+    """
+
+    def __init__(self, queue_size=1000, thread_name="trace-exporter"):
+        """
+        Args:
+            queue_size: 队列长度
+            thread_name: 后台线程名称，在线程转储中区分不同的导出器
+        """
+        self.queue_size = queue_size
+        self.thread_name = thread_name
+        self.dropped = 0
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, spans):
+        """提交一个请求的 span，队列已满时丢弃"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.queue_size)
+                    threading.Thread(target=self._run, name=self.thread_name, daemon=True).start()
+                    self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 64:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.export([span for spans in batch for span in spans])
+            except Exception as e:
+                logger.warning(f"{type(self).__name__} 导出失败: {e}")
+
+    def export(self, spans):
+        raise NotImplementedError
+
+
+class FileExporter(BatchExporter):
+    """每个 span 一行 JSON，追加写入本地文件"""
+
+    def __init__(self, path, queue_size=1000):
+        super().__init__(queue_size)
+        self.path = path
+
+    def export(self, spans):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+class OtlpExporter(BatchExporter):
+    """以 OTLP/HTTP JSON 格式发送到 OpenTelemetry Collector，不依赖 opentelemetry SDK"""
+
+    def __init__(self, endpoint, service_name, queue_size=1000):
+        super().__init__(queue_size)
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        if isinstance(value, str):
+            return {"stringValue": value}
+        return {"stringValue": json.dumps(value, ensure_ascii=False, default=str)}
+
+    def export(self, spans):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": self.service_name}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "ai-supervise"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": k, "value": self._value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": 2 if span.status == "error" else 1},
+                } for span in spans],
+            }],
+        }]}
+        request = urllib.request.Request(
+            self.url, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+class Tracer:
+    """
+    追踪入口：按采样率为请求创建 Trace，请求结束后交给导出器
+    """
+
+    def __init__(self, exporter=None, sample=1.0):
+        """
+        Args:
+            exporter: 导出器，None 表示关闭追踪
+            sample: 采样率
+        """
+        self.exporter = exporter
+        self.sample = sample
+
+    def start(self, name, headers, request_id):
+        """
+        为请求创建 Trace
+
+        Args:
+            name: 接口路由
+            headers: 请求头（traceparent）
+            request_id: 请求 ID
+
+        Returns:
+            Trace，未开启或未被采样时返回 None
+        """
+        if self.exporter is None:
+            return None
+        trace_id, parent_id = parse_traceparent(headers.get("traceparent"))
+        # 上游已经决定追踪的请求不再采样
+        if trace_id is None and self.sample < 1.0 and random.random() >= self.sample:
+            return None
+        return Trace(name, trace_id, parent_id, {"request_id": request_id, "pid": os.getpid()})
+
+    def finish(self, trace, status):
+        """
+        关闭根 span 并提交导出
+
+        Args:
+            trace: Trace
+            status: HTTP 状态码
+        """
+        trace.root.attributes["http.status_code"] = status
+        trace.end(trace.root, None)
+        if status >= 500:
+            trace.root.status = "error"
+        # 异常中断的阶段可能没有关闭
+        for span in trace.spans:
+            if span.end_ns is None:
+                span.end_ns = trace.root.end_ns
+        self.exporter.submit(trace.spans)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    标记一个业务函数的 span（不计入阶段耗时和监控指标）；没有请求上下文或未开启追踪时不做任何事
+
+    Args:
+        name: span 名称
+        **attributes: span 属性
+    """
+    ctx = current()
+    trace = ctx.trace if ctx is not None else None
+    if trace is None:
+        yield None
+        return
+    item = trace.start(name, attributes)
+    try:
+        yield item
+    except BaseException as e:
+        trace.end(item, e)
+        raise
+    trace.end(item)
+
+
+def set_attribute(key, value):
+    """给当前 span 设置属性；未开启追踪时不做任何事"""
+    ctx = current()
+    if ctx is not None and ctx.trace is not None:
+        ctx.trace.current.attributes[key] = value
+
+
+def build_tracer():
+    """
+    根据 server_config.json 创建 Tracer
+
+    Returns:
+        Tracer
+    """
+    config = tracing_config()
+    if not config["enabled"]:
+        return Tracer(None)
+    if config["exporter"] == "otlp":
+        exporter = OtlpExporter(config["otlp_endpoint"], config["service_name"], config["queue_size"])
+    else:
+        exporter = FileExporter(config["path"], config["queue_size"])
+    return Tracer(exporter, config["sample"])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+torch 人脸特征提取引擎基准测试
+分别以不同的优化选项构建 TorchFaceModel，测试每个人脸特征向量的提取耗时
+
+用法:
+    python bench/face_engine.py --batch 1 8 --repeat 20 --threads 4
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+import numpy as np
+from nets.face_torch import TorchFaceModel
+
+# 测试的选项组合
+OPTIONS = {
+    "eager(no_grad)": {},
+    "inference_mode": {"inference_mode": True},
+    "trace": {"inference_mode": True, "jit": "trace"},
+    "script": {"inference_mode": True, "jit": "script"},
+    "compile": {"inference_mode": True, "jit": "compile"},
+    "trace+channels_last": {"inference_mode": True, "jit": "trace", "channels_last": True},
+    "trace+bf16": {"inference_mode": True, "jit": "trace", "bf16": True},
+}
+
+
+def bench(model, batch, warmup, repeat):
+    """返回每个人脸特征向量的平均耗时（毫秒）"""
+    faces = np.random.uniform(-1, 1, (batch, 3, 160, 160)).astype(np.float32)
+    for _ in range(warmup):
+        model.embed(faces)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model.embed(faces)
+    return (time.perf_counter() - start) / repeat / batch * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="torch 人脸特征提取引擎基准测试")
+    parser.add_argument("--options", nargs="+", default=list(OPTIONS), choices=list(OPTIONS), help="测试的选项组合")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8], help="批大小")
+    parser.add_argument("--warmup", type=int, default=3, help="预热次数")
+    parser.add_argument("--repeat", type=int, default=20, help="重复次数")
+    parser.add_argument("--threads", type=int, default=0, help="intra_op_threads，0 表示 torch 默认值")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    rows = []
+    header = " ".join(f"{'batch=' + str(b) + '(ms)':>14}" for b in args.batch)
+    print(f"{'选项':<22} {header}")
+    for name in args.options:
+        model = TorchFaceModel(intra_op_threads=args.threads, **OPTIONS[name])
+        row = {"option": name}
+        for batch in args.batch:
+            row[f"batch_{batch}_ms"] = round(bench(model, batch, args.warmup, args.repeat), 3)
+        rows.append(row)
+        print(f"{name:<22} " + " ".join(f"{row[f'batch_{b}_ms']:>14.2f}" for b in args.batch))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"threads": args.threads, "results": rows}, f, indent=2)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
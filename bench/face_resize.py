@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+人脸检测输入缩放基准测试
+将样例图片放大到不同的最长边，分别测试不缩放（max_side=0）和缩放到 max_side 时
+FaceComparator.extract_face 的耗时
+
+用法:
+    python bench/face_resize.py --image data/1230.png --sides 640 1280 2560 4000 --repeat 5
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+from PIL import Image
+from app.face_compare import FaceComparator
+
+
+def time_extract(comparator, img, repeat):
+    """返回 extract_face 的平均耗时（毫秒）和是否检测到人脸"""
+    face = comparator.extract_face(img)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        comparator.extract_face(img)
+    return (time.perf_counter() - start) / repeat * 1000, face is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="人脸检测输入缩放基准测试")
+    parser.add_argument("--image", default="data/1230.png", help="样例图片")
+    parser.add_argument("--sides", type=int, nargs="+", default=[640, 1280, 2560, 4000], help="测试的最长边")
+    parser.add_argument("--max-side", type=int, default=1024, help="缩放后的最长边")
+    parser.add_argument("--repeat", type=int, default=5, help="每组重复次数")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    comparator = FaceComparator()
+    base = Image.open(args.image).convert("RGB")
+
+    rows = []
+    print(f"{'最长边':>8} {'不缩放(ms)':>12} {'缩放(ms)':>12} {'加速比':>8} {'检测结果':>10}")
+    for side in args.sides:
+        scale = side / max(base.size)
+        img = base.resize((round(base.width * scale), round(base.height * scale)), Image.BICUBIC)
+
+        comparator.max_side = 0
+        before_ms, before_found = time_extract(comparator, img, args.repeat)
+        comparator.max_side = args.max_side
+        after_ms, after_found = time_extract(comparator, img, args.repeat)
+
+        rows.append({
+            "side": side,
+            "before_ms": round(before_ms, 2),
+            "after_ms": round(after_ms, 2),
+            "speedup": round(before_ms / after_ms, 2) if after_ms > 0 else None,
+            "before_found": before_found,
+            "after_found": after_found,
+        })
+        print(f"{side:>8} {before_ms:>12.1f} {after_ms:>12.1f} {before_ms / after_ms:>8.2f} "
+              f"{str(before_found) + '/' + str(after_found):>10}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"image": args.image, "max_side": args.max_side, "results": rows}, f, indent=2)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+长时间稳定性测试（泄漏检测）
+在进程内通过与服务相同的处理流程（app.handlers.handle_request：保存临时文件、执行通道、推理、清理）
+持续处理混合输入，包括正常的条形码和人脸图片、无条形码图片、损坏图片、非法 base64 和缺少参数的请求。
+按固定间隔采样进程 RSS、打开的文件描述符数、线程数、临时目录（data/uploads）的文件数和大小，
+以及该时间段内各处理阶段耗时的 p50/p95，运行结束后对每个指标检查是否持续增长。
+--tracemalloc 模式在预热后拍摄内存快照，按调用位置列出增长最多的内存分配，定位泄漏来源。
+
+用法:
+    # 4 个并发线程运行 2 小时，每 60 秒采样一次
+    python bench/soak.py --duration 7200 --interval 60 --threads 4 --output soak_report.json
+    # 定位内存增长的调用位置（tracemalloc 会明显降低处理速度）
+    python bench/soak.py --duration 1800 --tracemalloc
+"""
+
+import os
+import sys
+import glob
+import time
+import json
+import base64
+import random
+import argparse
+import threading
+import tracemalloc
+from collections import defaultdict
+from io import BytesIO
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+# 默认在 CPU 上运行，模型模块在导入时读取 DEVICE
+os.environ.setdefault("DEVICE", "cpu")
+
+import numpy as np
+from PIL import Image
+
+UPLOAD_DIR = "data/uploads"
+
+
+def image_to_base64(image_path):
+    """将图片转换为base64编码"""
+    with open(image_path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def blank_image(size=(640, 480)):
+    """纯色图片（无条形码、无人脸）"""
+    buffer = BytesIO()
+    Image.new("RGB", size, (255, 255, 255)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def build_cases(face_pattern, barcode_pattern):
+    """
+    混合输入：[(名称, 接口, 请求体)]
+    """
+    faces = [image_to_base64(path) for path in sorted(glob.glob(face_pattern))]
+    barcode_paths = sorted(glob.glob(barcode_pattern))
+    blank = blank_image()
+    with open(barcode_paths[0], 'rb') as f:
+        raw = f.read()
+    truncated = base64.b64encode(raw[:len(raw) // 2]).decode('utf-8')
+    garbage = base64.b64encode(os.urandom(4096)).decode('utf-8')
+
+    cases = []
+    for path in barcode_paths:
+        data = image_to_base64(path)
+        cases.append((f"barcode:{os.path.basename(path)}", '/bar_decode', {'image': f'data:image/jpeg;base64,{data}'}))
+        cases.append((f"detect:{os.path.basename(path)}", '/bar_detect', {'image': data}))
+    cases += [
+        ("barcode:blank", '/bar_decode', {'image': blank}),
+        ("barcode:face", '/bar_decode', {'image': faces[0]}),
+        ("barcode:truncated", '/bar_decode', {'image': truncated}),
+        ("barcode:garbage", '/bar_decode', {'image': garbage}),
+        ("barcode:bad_base64", '/bar_decode', {'image': '@@not-base64@@'}),
+        ("barcode:missing", '/bar_decode', {}),
+        ("face:pair", '/face_compare', {'image1': faces[0], 'image2': faces[-1]}),
+        ("face:blank", '/face_compare', {'image1': faces[0], 'image2': blank}),
+        ("face:truncated", '/face_compare', {'image1': faces[0], 'image2': truncated}),
+        ("face:missing", '/face_compare', {'image1': faces[0]}),
+    ]
+    return cases
+
+
+def rss_mb():
+    """当前 RSS（MB）"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+
+
+def open_fds():
+    """打开的文件描述符数"""
+    return len(os.listdir("/proc/self/fd"))
+
+
+def dir_usage(path):
+    """目录内的文件数和总大小（MB）"""
+    files = [os.path.join(path, name) for name in os.listdir(path)] if os.path.isdir(path) else []
+    size = sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+    return len(files), round(size / 1024 / 1024, 2)
+
+
+class Window:
+    """两次采样之间的请求统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.statuses = defaultdict(int)
+        self.stages = defaultdict(list)
+
+    def add(self, outcome, cost):
+        with self.lock:
+            self.count += 1
+            self.statuses[outcome.status] += 1
+            self.stages['total'].append(cost * 1000)
+            for name, ms in outcome.timings().items():
+                self.stages[name].append(ms)
+
+    def take(self):
+        """取出本时间段的统计并清空"""
+        with self.lock:
+            stats = {
+                "requests": self.count,
+                "statuses": {str(k): v for k, v in self.statuses.items()},
+                "stages": {name: {"p50": round(float(np.percentile(values, 50)), 2),
+                                  "p95": round(float(np.percentile(values, 95)), 2)}
+                           for name, values in self.stages.items()},
+            }
+            self.reset()
+        return stats
+
+
+def sample(window, start):
+    """采样一次进程和临时目录的状态"""
+    files, size = dir_usage(UPLOAD_DIR)
+    point = {
+        "elapsed": round(time.time() - start, 1),
+        "rss_mb": rss_mb(),
+        "fds": open_fds(),
+        "threads": threading.active_count(),
+        "upload_files": files,
+        "upload_mb": size,
+    }
+    point.update(window.take())
+    return point
+
+
+def growth(values, min_growth):
+    """
+    判断一个指标是否持续增长：相邻采样中至少 80% 不下降、线性拟合斜率为正，且总增长超过 min_growth
+
+    Returns:
+        dict: 起止值、增长量、不下降的比例和是否判定为持续增长；采样点不足时返回 None
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size < 4:
+        return None
+    steps = np.diff(values)
+    slope = float(np.polyfit(np.arange(values.size), values, 1)[0])
+    total = float(values[-1] - values[0])
+    return {
+        "start": float(values[0]),
+        "end": float(values[-1]),
+        "growth": round(total, 3),
+        "non_decreasing": round(float((steps >= 0).mean()), 2),
+        "leak": bool((steps >= 0).mean() >= 0.8 and slope > 0 and total > min_growth),
+    }
+
+
+def analyze(points, args):
+    """对各指标做增长判断；预热阶段（第一个采样点）不参与"""
+    points = points[1:]
+    thresholds = {
+        "rss_mb": args.rss_growth_mb,
+        "fds": 5,
+        "threads": 2,
+        "upload_files": 0,
+        "upload_mb": 0,
+    }
+    result = {name: growth([p[name] for p in points], threshold) for name, threshold in thresholds.items()}
+    # 阶段耗时：p95 持续增长且增长超过 --latency-growth 比例
+    stage_names = {name for p in points for name in p["stages"]}
+    for name in sorted(stage_names):
+        values = [p["stages"][name]["p95"] for p in points if name in p["stages"]]
+        if values:
+            result[f"stage:{name}.p95"] = growth(values, values[0] * args.latency_growth)
+    return {name: item for name, item in result.items() if item is not None}
+
+
+def tracemalloc_diff(baseline, limit=20):
+    """与预热后的快照比较，按调用位置列出增长最多的内存分配"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    stats = snapshot.compare_to(baseline, "traceback")
+    top = []
+    for stat in stats[:limit]:
+        if stat.size_diff <= 0:
+            continue
+        top.append({
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count_diff": stat.count_diff,
+            "traceback": stat.traceback.format()[-12:],
+        })
+    return top
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长时间稳定性测试（泄漏检测）")
+    parser.add_argument("--duration", type=float, default=3600, help="持续时间（秒）")
+    parser.add_argument("--interval", type=float, default=60, help="采样间隔（秒）")
+    parser.add_argument("--threads", type=int, default=2, help="并发线程数")
+    parser.add_argument("--face-images", default="data/*.png", help="人脸样例")
+    parser.add_argument("--barcode-images", default="data/bar_test/*", help="条形码样例")
+    parser.add_argument("--rss-growth-mb", type=float, default=50, help="RSS 增长超过该值（MB）且持续增长时判定为泄漏")
+    parser.add_argument("--latency-growth", type=float, default=0.5, help="阶段 p95 增长超过该比例且持续增长时报告")
+    parser.add_argument("--tracemalloc", action="store_true", help="按调用位置统计内存增长")
+    parser.add_argument("--output", default="soak_report.json", help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    from app.handlers import handle_request
+    from app.pipelines import registry
+
+    cases = build_cases(args.face_images, args.barcode_images)
+    print(f"加载并预热模型，共 {len(cases)} 种输入")
+    registry.warmup(background=False)
+    leftover_before = set(os.listdir(UPLOAD_DIR)) if os.path.isdir(UPLOAD_DIR) else set()
+
+    window = Window()
+    stop = threading.Event()
+
+    def worker():
+        rng = random.Random()
+        while not stop.is_set():
+            _, path, body = rng.choice(cases)
+            begin = time.time()
+            outcome = handle_request(path, lambda: dict(body), {})
+            window.add(outcome, time.time() - begin)
+
+    start = time.time()
+    threads = [threading.Thread(target=worker, name=f"soak-{i}", daemon=True) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    points, snapshot = [], None
+    try:
+        while time.time() - start < args.duration:
+            time.sleep(min(args.interval, max(0.0, args.duration - (time.time() - start))))
+            point = sample(window, start)
+            points.append(point)
+            total = point["stages"].get("total", {})
+            print(f"[{point['elapsed']:>8.0f}s] rss={point['rss_mb']}MB fds={point['fds']} threads={point['threads']} "
+                  f"uploads={point['upload_files']} ({point['upload_mb']}MB) requests={point['requests']} "
+                  f"p95={total.get('p95', 0)}ms statuses={point['statuses']}")
+            if args.tracemalloc and snapshot is None:
+                # 第一个采样周期作为预热，之后的增长才计入
+                tracemalloc.start(25)
+                snapshot = tracemalloc.take_snapshot()
+    except KeyboardInterrupt:
+        print("提前结束")
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    # 所有请求结束后残留的临时文件即为泄漏
+    leftover = sorted(set(os.listdir(UPLOAD_DIR)) - leftover_before) if os.path.isdir(UPLOAD_DIR) else []
+    trends = analyze(points, args)
+    flagged = [name for name, item in trends.items() if item["leak"]]
+    report = {
+        "config": {"duration": args.duration, "interval": args.interval, "threads": args.threads,
+                   "cases": [name for name, _, _ in cases]},
+        "samples": points,
+        "trends": trends,
+        "leftover_uploads": leftover,
+        "flagged": flagged,
+    }
+    if snapshot is not None:
+        report["tracemalloc"] = tracemalloc_diff(snapshot)
+        tracemalloc.stop()
+
+    print("\n持续增长检查:")
+    for name, item in trends.items():
+        flag = "  <-- 持续增长" if item["leak"] else ""
+        print(f"  {name:<28} {item['start']:>10.2f} -> {item['end']:>10.2f} 不下降比例 {item['non_decreasing']:.0%}{flag}")
+    if leftover:
+        print(f"\n结束后残留 {len(leftover)} 个临时文件，例如: {leftover[:5]}")
+    for item in report.get("tracemalloc", [])[:10]:
+        print(f"\n+{item['size_diff_kb']} KB ({item['count_diff']:+d} blocks)")
+        print("\n".join(f"    {line}" for line in item["traceback"][-6:]))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n报告已保存到: {args.output}")
+    if flagged or leftover:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
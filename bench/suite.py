@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条形码和人脸流水线离线基准测试
+在进程内直接运行 BarDetect.barcode_decode 和 FaceComparator.compare（不经过 HTTP），输入为：
+- data/bar_test 下的条形码样例及其缩放、旋转变体
+- data/*.png 人脸样例组成的图片对及其缩放、旋转变体
+每个用例先预热再重复执行，借助请求上下文的 stage() 记录各处理阶段的耗时，
+输出总耗时和各阶段的 p50/p95/p99、吞吐量和峰值 RSS，写入 JSON 报告。
+指定基准报告时，p50/p95 相对基准的退化超过预算则以非零状态码退出，可用于 CI。
+
+用法（CPU 即可运行）:
+    python bench/suite.py --repeat 20 --output bench_report.json
+    # 保存为基准
+    python bench/suite.py --save-baseline bench/baseline.json
+    # 与基准比较，p50/p95 退化超过 15% 时失败
+    python bench/suite.py --baseline bench/baseline.json --budget 0.15
+"""
+
+import os
+import sys
+import glob
+import time
+import json
+import argparse
+import platform
+import resource
+from collections import defaultdict
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+# 默认在 CPU 上运行，模型模块在导入时读取 DEVICE
+os.environ.setdefault("DEVICE", "cpu")
+
+import numpy as np
+from PIL import Image
+from app.context import request_context
+
+# 合成变体：(名称, 缩放比例, 旋转角度)
+VARIANTS = [
+    ("orig", 1.0, 0),
+    ("x0.5", 0.5, 0),
+    ("x2", 2.0, 0),
+    ("rot15", 1.0, 15),
+    ("rot45", 1.0, 45),
+]
+# 人脸旋转过大时检测不到人脸，只使用小角度
+FACE_VARIANTS = [
+    ("orig", 1.0, 0),
+    ("x0.5", 0.5, 0),
+    ("x2", 2.0, 0),
+    ("rot5", 1.0, 5),
+    ("rot10", 1.0, 10),
+]
+
+
+def variant(img, scale, angle):
+    """生成缩放、旋转后的图片"""
+    if scale != 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+    if angle:
+        img = img.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=(255, 255, 255))
+    return img
+
+
+def barcode_cases(pattern):
+    """条形码用例：[(名称, (图片,))]"""
+    cases = []
+    for path in sorted(glob.glob(pattern)):
+        img = Image.open(path).convert("RGB")
+        for name, scale, angle in VARIANTS:
+            cases.append((f"{os.path.basename(path)}:{name}", (variant(img, scale, angle),)))
+    return cases
+
+
+def face_cases(pattern):
+    """人脸用例：相邻两张样例组成一对，第二张做变体 [(名称, (图片1, 图片2))]"""
+    paths = sorted(glob.glob(pattern))
+    images = [Image.open(path).convert("RGB") for path in paths]
+    cases = []
+    for i in range(len(images) - 1):
+        pair = f"{os.path.basename(paths[i])}-{os.path.basename(paths[i + 1])}"
+        for name, scale, angle in FACE_VARIANTS:
+            cases.append((f"{pair}:{name}", (images[i], variant(images[i + 1], scale, angle))))
+    return cases
+
+
+def percentiles(values):
+    """耗时列表（秒）的统计（毫秒）"""
+    ms = np.asarray(values) * 1000
+    return {
+        "count": int(ms.size),
+        "mean": round(float(ms.mean()), 3),
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "max": round(float(ms.max()), 3),
+    }
+
+
+def run_pipeline(func, cases, warmup, repeat):
+    """
+    运行一条流水线的全部用例
+
+    Args:
+        func: 处理函数，参数为用例的输入
+        cases: [(名称, 输入)]
+        warmup: 每个用例的预热次数
+        repeat: 每个用例的重复次数
+
+    Returns:
+        dict: 总耗时和各阶段耗时的统计、吞吐量、各用例的 p50、出错次数
+    """
+    totals, stages, per_case = [], defaultdict(list), {}
+    errors = defaultdict(int)
+    elapsed = 0.0
+    for name, inputs in cases:
+        for _ in range(warmup):
+            try:
+                func(*inputs)
+            except Exception:
+                pass
+        case_totals = []
+        for _ in range(repeat):
+            with request_context() as ctx:
+                start = time.perf_counter()
+                try:
+                    func(*inputs)
+                except Exception as e:
+                    # 人脸质量检查未通过等情况仍计入耗时
+                    errors[type(e).__name__] += 1
+                cost = time.perf_counter() - start
+            elapsed += cost
+            case_totals.append(cost)
+            # 同一阶段在一次调用中执行多次（如每个检测框一次 zbar）时累加
+            run_stages = defaultdict(float)
+            for stage_name, secs in ctx.stages:
+                run_stages[stage_name] += secs
+            for stage_name, secs in run_stages.items():
+                stages[stage_name].append(secs)
+        totals.extend(case_totals)
+        per_case[name] = percentiles(case_totals)["p50"]
+        print(f"  {name:<40} p50={per_case[name]:>10.2f} ms")
+    return {
+        "total": percentiles(totals),
+        "stages": {name: percentiles(values) for name, values in stages.items()},
+        "throughput": round(len(totals) / elapsed, 3) if elapsed else 0.0,
+        "cases": per_case,
+        "errors": dict(errors),
+    }
+
+
+def peak_rss_mb():
+    """进程的峰值 RSS（MB，Linux 的 ru_maxrss 单位为 KB）"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def compare(report, baseline, budget, min_ms):
+    """
+    与基准比较总耗时和各阶段的 p50/p95
+
+    Args:
+        report: 本次报告
+        baseline: 基准报告
+        budget: 允许的相对退化比例
+        min_ms: 基准值低于该毫秒数的指标不比较（计时噪声）
+
+    Returns:
+        list: 超出预算的项 (流水线, 指标, 基准值, 本次值, 变化比例)
+    """
+    failures = []
+    for pipeline, result in report["pipelines"].items():
+        base = baseline.get("pipelines", {}).get(pipeline)
+        if base is None:
+            continue
+        items = [("total", result["total"], base["total"])]
+        items += [(f"stage:{name}", stats, base["stages"][name])
+                  for name, stats in result["stages"].items() if name in base["stages"]]
+        for name, stats, base_stats in items:
+            for key in ("p50", "p95"):
+                if base_stats[key] < min_ms:
+                    continue
+                change = stats[key] / base_stats[key] - 1
+                if change > budget:
+                    failures.append((pipeline, f"{name}.{key}", base_stats[key], stats[key], change))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="条形码和人脸流水线离线基准测试")
+    parser.add_argument("--pipelines", nargs="+", default=["barcode", "face"], choices=["barcode", "face"])
+    parser.add_argument("--barcode-images", default="data/bar_test/*", help="条形码样例")
+    parser.add_argument("--face-images", default="data/*.png", help="人脸样例")
+    parser.add_argument("--warmup", type=int, default=2, help="每个用例的预热次数")
+    parser.add_argument("--repeat", type=int, default=10, help="每个用例的重复次数")
+    parser.add_argument("--output", default="bench_report.json", help="JSON 报告输出路径")
+    parser.add_argument("--baseline", default=None, help="基准报告，指定时检查退化")
+    parser.add_argument("--budget", type=float, default=0.15, help="p50/p95 允许的相对退化比例")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="低于该耗时（毫秒）的指标不参与比较")
+    parser.add_argument("--save-baseline", default=None, help="把本次报告保存为基准")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "device": os.environ["DEVICE"],
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+        },
+        "pipelines": {},
+    }
+
+    if "barcode" in args.pipelines:
+        from app.barcode_detect import BarDetect
+        bar = BarDetect()
+        print("条形码 (BarDetect.barcode_decode):")
+        report["pipelines"]["barcode"] = run_pipeline(
+            bar.barcode_decode, barcode_cases(args.barcode_images), args.warmup, args.repeat)
+    if "face" in args.pipelines:
+        from app.face_compare import FaceComparator
+        comparator = FaceComparator()
+        print("人脸 (FaceComparator.compare):")
+        report["pipelines"]["face"] = run_pipeline(
+            comparator.compare, face_cases(args.face_images), args.warmup, args.repeat)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    print(f"\n{'流水线/阶段':<28} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10}")
+    for pipeline, result in report["pipelines"].items():
+        print(f"{pipeline:<28} {result['total']['p50']:>10.2f} {result['total']['p95']:>10.2f} "
+              f"{result['total']['p99']:>10.2f}   吞吐量 {result['throughput']:.2f}/s")
+        for name, stats in result["stages"].items():
+            print(f"  {name:<26} {stats['p50']:>10.2f} {stats['p95']:>10.2f} {stats['p99']:>10.2f}")
+    print(f"峰值 RSS: {report['peak_rss_mb']} MB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"报告已保存到: {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"基准已保存到: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = compare(report, baseline, args.budget, args.min_ms)
+        if failures:
+            print(f"\n超出退化预算 {args.budget:.0%}:")
+            for pipeline, name, base_value, value, change in failures:
+                print(f"  {pipeline:<8} {name:<28} {base_value:>10.2f} -> {value:>10.2f} ms ({change:+.1%})")
+            sys.exit(1)
+        print(f"\n未超出退化预算 {args.budget:.0%}")
+
+
+if __name__ == "__main__":
+    main()
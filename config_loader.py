@@ -61,6 +61,10 @@ class Config:
         """支持 'in' 操作符: 'key' in config"""
         return key in self._config
 
+    def get(self, key, default=None):
+        """支持带默认值的访问: config.get('key', default)"""
+        return self._config.get(key, default)
+
 
 def get_config(config_path=None):
     """通用获取配置实例函数
@@ -0,0 +1,275 @@
+"""
+ONNX 人脸模型
+P-Net/R-Net/O-Net 与 InceptionResnetV1 以 ONNX 图的形式通过 hexai_backend 执行，支持 CPU/GPU/NPU
+MTCNN 的图像金字塔、NMS、边框回归等前后处理用 numpy 实现（与 facenet-pytorch 的 detect_face 一致），
+运行时不依赖 torch
+"""
+
+from hexai_backend import build_backend
+from PIL import Image
+import numpy as np
+import cv2, os
+
+device = os.getenv("DEVICE", "cpu")
+
+
+def nms(boxes, scores, threshold, method="Union"):
+    """
+    非极大值抑制
+
+    Args:
+        boxes: 边界框 [N, 4]
+        scores: 置信度 [N]
+        threshold: 重叠阈值
+        method: Union 为 IOU，Min 为交集除以较小框面积
+
+    Returns:
+        pick: 保留的下标
+    """
+    if boxes.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    # Union 与 torchvision.ops.nms 一致不加 1，Min 与 facenet-pytorch 的 nms_numpy 一致加 1
+    offset = 1 if method == "Min" else 0
+    area = (x2 - x1 + offset) * (y2 - y1 + offset)
+    order = np.argsort(scores)[::-1]
+    pick = []
+    while order.size > 0:
+        i = order[0]
+        pick.append(i)
+        rest = order[1:]
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + offset)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + offset)
+        inter = w * h
+        if method == "Min":
+            overlap = inter / np.minimum(area[i], area[rest])
+        else:
+            overlap = inter / (area[i] + area[rest] - inter)
+        order = rest[overlap <= threshold]
+    return np.array(pick, dtype=np.int64)
+
+
+def bbreg(boxes, reg):
+    """边框回归"""
+    w = boxes[:, 2] - boxes[:, 0] + 1
+    h = boxes[:, 3] - boxes[:, 1] + 1
+    boxes = boxes.copy()
+    boxes[:, 0] += reg[:, 0] * w
+    boxes[:, 1] += reg[:, 1] * h
+    boxes[:, 2] += reg[:, 2] * w
+    boxes[:, 3] += reg[:, 3] * h
+    return boxes
+
+
+def rerec(boxes):
+    """将边界框扩成正方形"""
+    boxes = boxes.copy()
+    h = boxes[:, 3] - boxes[:, 1]
+    w = boxes[:, 2] - boxes[:, 0]
+    side = np.maximum(w, h)
+    boxes[:, 0] = boxes[:, 0] + w * 0.5 - side * 0.5
+    boxes[:, 1] = boxes[:, 1] + h * 0.5 - side * 0.5
+    boxes[:, 2] = boxes[:, 0] + side
+    boxes[:, 3] = boxes[:, 1] + side
+    return boxes
+
+
+def pad(boxes, w, h):
+    """截断边界框到图像范围内（1 起始坐标）"""
+    boxes = np.trunc(boxes[:, :4]).astype(np.int32)
+    x, y, ex, ey = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    x[x < 1] = 1
+    y[y < 1] = 1
+    ex[ex > w] = w
+    ey[ey > h] = h
+    return y, ey, x, ex
+
+
+def normalize(im_data):
+    """MTCNN 输入归一化，HWC uint8 -> NCHW float32"""
+    im_data = (im_data.astype(np.float32) - 127.5) * 0.0078125
+    return im_data.transpose(2, 0, 1)[np.newaxis]
+
+
+class FaceOnnxModel:
+    """
+    人脸模型类（ONNX 引擎）
+    负责模型加载和推理，接口与 TorchFaceModel 一致
+    """
+
+    def __init__(self, pnet_path, rnet_path, onet_path, resnet_path,
+                 thresholds=(0.6, 0.7, 0.7), factor=0.709, image_size=160, margin=0, gpu_m_fraction=0.8):
+        """
+        初始化模型
+
+        Args:
+            pnet_path: P-Net ONNX 模型路径
+            rnet_path: R-Net ONNX 模型路径
+            onet_path: O-Net ONNX 模型路径
+            resnet_path: InceptionResnetV1 ONNX 模型路径
+            thresholds: MTCNN 三个网络的阈值
+            factor: 图像金字塔缩放因子
+            image_size: 对齐后的人脸尺寸
+            margin: 人脸边距
+            gpu_m_fraction: GPU/NPU 显存比例
+        """
+        if device != "gpu":
+            gpu_m_fraction = None
+        self.pnet = build_backend(pnet_path, device, input_names=['input'],
+                                  output_names=['reg', 'prob'], pgpu=gpu_m_fraction)
+        self.rnet = build_backend(rnet_path, device, input_names=['input'],
+                                  output_names=['reg', 'prob'], pgpu=gpu_m_fraction)
+        self.onet = build_backend(onet_path, device, input_names=['input'],
+                                  output_names=['reg', 'landmarks', 'prob'], pgpu=gpu_m_fraction)
+        self.resnet = build_backend(resnet_path, device, input_names=['input'],
+                                    output_names=['embedding'], pgpu=gpu_m_fraction)
+
+        self.thresholds = list(thresholds)
+        self.factor = factor
+        self.image_size = image_size
+        self.margin = margin
+
+        print(f"人脸模型加载成功: {os.path.dirname(resnet_path)}")
+        print(f"device: {device}")
+
+    def _stage_inputs(self, img, boxes, size):
+        """按边界框裁剪原图并缩放到 size x size，作为 R-Net/O-Net 的输入"""
+        h, w = img.shape[:2]
+        y, ey, x, ex = pad(boxes, w, h)
+        crops, keep = [], []
+        for k in range(len(y)):
+            if ey[k] > (y[k] - 1) and ex[k] > (x[k] - 1):
+                crop = img[y[k] - 1:ey[k], x[k] - 1:ex[k]]
+                crops.append(normalize(cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA))[0])
+                keep.append(k)
+        if not crops:
+            return None, None
+        return np.stack(crops).astype(np.float32), np.array(keep, dtype=np.int64)
+
+    def detect(self, img, min_face_size):
+        """
+        MTCNN 人脸检测
+
+        Args:
+            img: RGB 的 PIL Image
+            min_face_size: 最小人脸尺寸（img 坐标）
+
+        Returns:
+            boxes: 人脸框 [N, 5]，每行为 [x1, y1, x2, y2, prob]
+        """
+        img = np.asarray(img, dtype=np.uint8)
+        h, w = img.shape[:2]
+        empty = np.zeros((0, 5), dtype=np.float32)
+
+        # 图像金字塔
+        m = 12.0 / min_face_size
+        minl = min(h, w) * m
+        scales = []
+        scale = m
+        while minl >= 12:
+            scales.append(scale)
+            scale *= self.factor
+            minl *= self.factor
+
+        # 第一阶段: P-Net 全卷积扫描每个尺度
+        stride, cellsize = 2, 12
+        all_boxes = []
+        for scale in scales:
+            hs, ws = int(h * scale + 1), int(w * scale + 1)
+            im_data = normalize(cv2.resize(img, (ws, hs), interpolation=cv2.INTER_AREA))
+            reg, prob = self.pnet([im_data])
+            prob = prob[0, 1]
+            ys, xs = np.where(prob >= self.thresholds[0])
+            if len(ys) == 0:
+                continue
+            bb = np.stack([xs, ys], axis=1).astype(np.float32)
+            q1 = np.floor((stride * bb + 1) / scale)
+            q2 = np.floor((stride * bb + cellsize) / scale)
+            boxes = np.hstack([q1, q2, prob[ys, xs][:, None], reg[0][:, ys, xs].T])
+            # 每个尺度内部 NMS
+            all_boxes.append(boxes[nms(boxes[:, :4], boxes[:, 4], 0.5)])
+        if not all_boxes:
+            return empty
+        boxes = np.vstack(all_boxes)
+        boxes = boxes[nms(boxes[:, :4], boxes[:, 4], 0.7)]
+        regw = boxes[:, 2] - boxes[:, 0]
+        regh = boxes[:, 3] - boxes[:, 1]
+        boxes = np.stack([
+            boxes[:, 0] + boxes[:, 5] * regw,
+            boxes[:, 1] + boxes[:, 6] * regh,
+            boxes[:, 2] + boxes[:, 7] * regw,
+            boxes[:, 3] + boxes[:, 8] * regh,
+            boxes[:, 4],
+        ], axis=1)
+        boxes = rerec(boxes)
+
+        # 第二阶段: R-Net 精修
+        im_data, keep = self._stage_inputs(img, boxes, 24)
+        if im_data is None:
+            return empty
+        boxes = boxes[keep]
+        reg, prob = self.rnet([im_data])
+        score = prob[:, 1]
+        ipass = score > self.thresholds[1]
+        boxes = np.hstack([boxes[ipass, :4], score[ipass][:, None]])
+        reg = reg[ipass]
+        if len(boxes) == 0:
+            return empty
+        pick = nms(boxes[:, :4], boxes[:, 4], 0.7)
+        boxes = rerec(bbreg(boxes[pick], reg[pick]))
+
+        # 第三阶段: O-Net 输出最终人脸框
+        im_data, keep = self._stage_inputs(img, boxes, 48)
+        if im_data is None:
+            return empty
+        boxes = boxes[keep]
+        reg, _, prob = self.onet([im_data])
+        score = prob[:, 1]
+        ipass = score > self.thresholds[2]
+        boxes = np.hstack([boxes[ipass, :4], score[ipass][:, None]])
+        reg = reg[ipass]
+        if len(boxes) == 0:
+            return empty
+        boxes = bbreg(boxes, reg)
+        boxes = boxes[nms(boxes[:, :4], boxes[:, 4], 0.7, "Min")]
+        return boxes.astype(np.float32)
+
+    def extract(self, img, boxes):
+        """
+        按人脸框从原图裁剪并对齐到 image_size（与 facenet-pytorch 的 extract_face 一致）
+
+        Args:
+            img: RGB 的 PIL Image（原图分辨率）
+            boxes: 人脸框 [N, 4]
+
+        Returns:
+            faces: 标准化后的人脸 [N, 3, image_size, image_size]，float32
+        """
+        faces = []
+        for box in boxes:
+            margin = [
+                self.margin * (box[2] - box[0]) / (self.image_size - self.margin),
+                self.margin * (box[3] - box[1]) / (self.image_size - self.margin),
+            ]
+            crop_box = [
+                int(max(box[0] - margin[0] / 2, 0)),
+                int(max(box[1] - margin[1] / 2, 0)),
+                int(min(box[2] + margin[0] / 2, img.size[0])),
+                int(min(box[3] + margin[1] / 2, img.size[1])),
+            ]
+            face = img.crop(crop_box).resize((self.image_size, self.image_size), Image.BILINEAR)
+            face = np.asarray(face, dtype=np.float32).transpose(2, 0, 1)
+            faces.append((face - 127.5) / 128.0)
+        return np.stack(faces).astype(np.float32)
+
+    def embed(self, faces):
+        """
+        批量提取人脸特征向量
+
+        Args:
+            faces: 人脸 [N, 3, 160, 160]，float32
+
+        Returns:
+            embeddings: L2 归一化后的特征向量 [N, 512]
+        """
+        return self.resnet([faces.astype(np.float32)])[0]
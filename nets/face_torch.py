@@ -0,0 +1,207 @@
+"""
+facenet-pytorch 人脸模型（eager PyTorch）
+MTCNN (P-Net/R-Net/O-Net) 人脸检测 + InceptionResnetV1 特征提取
+支持 CPU/GPU/NPU
+"""
+
+import os
+
+# # 【NPU 修复】设置 NPU 相关环境变量，避免 TBE 子进程错误
+if os.getenv('DEVICE') == 'npu':
+    os.environ['TE_PARALLEL_COMPILER'] = '0'  # 禁用并行编译
+    os.environ['CPU_CORE_NUM'] = '1'  # 限制 CPU 核心数
+    os.environ['OMP_NUM_THREADS'] = '1'  # 限制 OpenMP 线程数
+    os.environ['MKL_NUM_THREADS'] = '1'  # 限制 MKL 线程数
+
+import logging
+import numpy as np
+import torch
+from facenet_pytorch import MTCNN, InceptionResnetV1, extract_face, fixed_image_standardization
+from facenet_pytorch.models.utils.detect_face import detect_face
+
+logger = logging.getLogger(__name__)
+device_type = os.getenv('DEVICE', 'cpu')
+
+
+class TorchFaceModel:
+    """
+    人脸模型类（PyTorch 引擎）
+    负责模型加载和推理，输入输出均为 numpy 数组
+    """
+
+    def __init__(self, thresholds=(0.6, 0.7, 0.7), factor=0.709, image_size=160, margin=0,
+                 inference_mode=False, jit=None, channels_last=False, bf16=False,
+                 intra_op_threads=0, inter_op_threads=0, defer_runtime=False):
+        """
+        初始化模型
+
+        Args:
+            thresholds: MTCNN 三个网络的阈值
+            factor: 图像金字塔缩放因子
+            image_size: 对齐后的人脸尺寸
+            margin: 人脸边距
+            inference_mode: 使用 torch.inference_mode 代替 torch.no_grad
+            jit: resnet 图优化方式，None/trace/script/compile
+            channels_last: resnet 使用 channels_last 内存布局
+            bf16: CPU 上以 bfloat16 autocast 执行 resnet
+            intra_op_threads: 本 worker 的算子内线程数，0 表示使用 torch 默认值
+            inter_op_threads: 本 worker 的算子间线程数，0 表示使用 torch 默认值
+            defer_runtime: 只加载权重，线程设置和图优化推迟到 setup_runtime()（preload 模式下 fork 之后调用）；
+                preload 模式下模型管理器传入 jit=None，避免每个 worker 各自生成一份优化后的权重
+        """
+        # 根据环境变量初始化设备
+        if device_type == 'npu':
+            self.device = self._init_npu_device()
+        elif device_type == 'gpu':
+            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        else:  # 'cpu' or 其他
+            self.device = torch.device('cpu')
+        logger.info(f"使用设备: {self.device} (DEVICE: {device_type})")
+
+        self.thresholds = list(thresholds)
+        self.factor = factor
+        self.image_size = image_size
+        self.margin = margin
+
+        # 初始化MTCNN人脸检测（只使用其中的 P-Net/R-Net/O-Net）
+        self.mtcnn = MTCNN(
+            image_size=image_size,
+            margin=margin,
+            thresholds=self.thresholds,
+            factor=factor,
+            post_process=True,
+            device=self.device
+        )
+        # 初始化InceptionResnetV1特征提取
+        self.resnet = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
+
+        # 参数占用的内存，供模型管理器估算缓存大小
+        self.nbytes = sum(
+            p.numel() * p.element_size()
+            for net in (self.mtcnn, self.resnet) for p in net.parameters()
+        )
+
+        self.grad_mode = torch.inference_mode if inference_mode else torch.no_grad
+        self.channels_last = channels_last
+        # bf16 autocast 只在 CPU 上开启
+        self.bf16 = bf16 and self.device.type == 'cpu'
+        if channels_last:
+            self.resnet = self.resnet.to(memory_format=torch.channels_last)
+
+        self.jit = jit
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        if not defer_runtime:
+            self.setup_runtime()
+
+    def setup_runtime(self):
+        """
+        设置线程数并对 resnet 做图优化
+        这两步会创建线程池或执行推理，fork 之后不能安全继承，preload 模式下由每个 worker 在 fork 后调用
+        """
+        # 按 worker 设置线程数，避免多个 gunicorn worker 各自占满所有核心
+        if self.intra_op_threads:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                # 算子间线程池只能在首次并行计算前设置
+                logger.warning(f"设置 inter_op_threads 失败: {e}")
+        if self.jit:
+            self.resnet = self._optimize(self.resnet, self.jit)
+        logger.info(f"torch 引擎: inference_mode={self.grad_mode is torch.inference_mode}, jit={self.jit}, "
+                    f"channels_last={self.channels_last}, bf16={self.bf16}, "
+                    f"threads={torch.get_num_threads()}/{torch.get_num_interop_threads()}")
+
+    def _optimize(self, resnet, jit):
+        """
+        对 resnet 做 TorchScript / torch.compile 图优化，失败时退回 eager 模式
+
+        Args:
+            resnet: InceptionResnetV1 模型
+            jit: trace/script/compile
+
+        Returns:
+            优化后的模型
+        """
+        try:
+            if jit == 'compile':
+                return torch.compile(resnet)
+            if jit == 'script':
+                graph = torch.jit.script(resnet)
+            else:
+                example = torch.randn(1, 3, self.image_size, self.image_size, device=self.device)
+                if self.channels_last:
+                    example = example.contiguous(memory_format=torch.channels_last)
+                with torch.no_grad():
+                    graph = torch.jit.trace(resnet, example)
+            return torch.jit.optimize_for_inference(torch.jit.freeze(graph.eval()))
+        except Exception as e:
+            logger.warning(f"resnet 图优化 ({jit}) 失败，使用 eager 模式: {e}")
+            return resnet
+
+    def _init_npu_device(self):
+        """初始化华为 NPU 设备"""
+        try:
+            import torch_npu
+            torch.npu.set_compile_mode(jit_compile=False)
+            torch_npu.npu.set_device("npu:0")
+            return torch.device('npu')
+        except Exception as e:
+            logger.warning(f"NPU 初始化失败，降级到 CPU: {e}")
+            return torch.device('cpu')
+
+    def detect(self, img, min_face_size):
+        """
+        MTCNN 人脸检测
+
+        Args:
+            img: RGB 的 PIL Image
+            min_face_size: 最小人脸尺寸（img 坐标）
+
+        Returns:
+            boxes: 人脸框 [N, 5]，每行为 [x1, y1, x2, y2, prob]
+        """
+        with self.grad_mode():
+            batch_boxes, _ = detect_face(
+                img, min_face_size,
+                self.mtcnn.pnet, self.mtcnn.rnet, self.mtcnn.onet,
+                self.thresholds, self.factor, self.device
+            )
+        boxes = np.array(batch_boxes[0], dtype=np.float32)
+        return boxes.reshape(-1, 5) if len(boxes) else np.zeros((0, 5), dtype=np.float32)
+
+    def extract(self, img, boxes):
+        """
+        按人脸框从原图裁剪并对齐到 image_size
+
+        Args:
+            img: RGB 的 PIL Image（原图分辨率）
+            boxes: 人脸框 [N, 4]
+
+        Returns:
+            faces: 标准化后的人脸 [N, 3, image_size, image_size]，float32
+        """
+        faces = [
+            fixed_image_standardization(extract_face(img, box, self.image_size, self.margin))
+            for box in boxes
+        ]
+        return torch.stack(faces).numpy()
+
+    def embed(self, faces):
+        """
+        批量提取人脸特征向量
+
+        Args:
+            faces: 人脸 [N, 3, 160, 160]，float32
+
+        Returns:
+            embeddings: L2 归一化后的特征向量 [N, 512]
+        """
+        inputs = torch.from_numpy(faces).to(self.device)
+        if self.channels_last:
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        with self.grad_mode(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=self.bf16):
+            embeddings = self.resnet(inputs)
+        return embeddings.float().cpu().numpy()
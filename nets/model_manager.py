@@ -7,6 +7,43 @@
 
 import os
 import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 支持的模型精度
+PRECISIONS = ("fp32", "fp16", "int8")
+
+
+def resolve_precision(model_type):
+    """
+    确定模型使用的精度
+    优先级: 环境变量 <MODEL_TYPE>_PRECISION > 环境变量 MODEL_PRECISION > server_config.json 的 precision
+    
+    Args:
+        model_type: 模型类型名称
+        
+    Returns:
+        str: 精度名称，未指定时返回 None（使用 model_config.json 中的默认值）
+    """
+    precision = os.getenv(f"{model_type.upper()}_PRECISION") or os.getenv("MODEL_PRECISION")
+    if precision:
+        return precision
+    from config_loader import get_config
+    return (get_config("server_config.json").get("precision") or {}).get(model_type)
+
+
+def _cache_config():
+    """读取 server_config.json 中的 model_cache 配置"""
+    from config_loader import get_config
+    model_cache = get_config("server_config.json").get("model_cache") or {}
+    return {
+        "max_bytes": int(model_cache.get("max_mb", 0) * 1024 * 1024),
+        "watch_interval": model_cache.get("watch_interval", 0),
+    }
 
 
 class ModelConfig:
@@ -20,20 +57,39 @@ class ModelConfig:
         # 需要路径处理的配置项（根据当前配置文件）
         self.filekeys = [
             "modelFile",
+            "pnetFile",
+            "rnetFile",
+            "onetFile",
+            "resnetFile",
         ]
     
-    def parse_config(self, gpu_m_fraction=0.5):
+    def parse_config(self, gpu_m_fraction=0.5, precision=None):
         """
         解析模型配置
         
+        model_config.json 中可通过 variants 为同一模型配置多个精度版本，值为模型文件名
+        或需要覆盖的配置项，例如:
+            "variants": {"fp16": "model_fp16.onnx", "int8": {"modelFile": "model_int8.onnx"}}
+        
         Args:
             gpu_m_fraction: GPU显存比例
+            precision: 精度版本（fp32/fp16/int8），None 时使用配置中的 precision，默认 fp32
             
         Returns:
             dict: 模型配置参数
         """
         if os.path.exists(self.config_path):
             configs = json.load(open(self.config_path, "r", encoding="utf-8-sig"))
+            # 选择精度版本
+            variants = configs.pop("variants", {})
+            precision = precision or configs.get("precision", "fp32")
+            if precision in variants:
+                variant = variants[precision]
+                configs.update(variant if isinstance(variant, dict) else {"modelFile": variant})
+            elif precision != "fp32":
+                logger.warning(f"模型 {self.model_dir} 没有 {precision} 版本，使用默认版本")
+                precision = "fp32"
+            configs["precision"] = precision
             # 处理文件路径
             for key, value in configs.items():
                 if key in self.filekeys:
@@ -42,6 +98,27 @@ class ModelConfig:
             return configs
         else:
             raise Exception(f"model config is not found: {self.config_path}")
+    
+    def watch_files(self):
+        """
+        返回热更新需要监控的文件：model_config.json 以及其中（含各精度版本）引用的模型文件
+        
+        Returns:
+            list: 文件路径列表，模型目录不存在时为空
+        """
+        if not os.path.exists(self.config_path):
+            return []
+        configs = json.load(open(self.config_path, "r", encoding="utf-8-sig"))
+        sections = [configs] + [v for v in configs.get("variants", {}).values() if isinstance(v, dict)]
+        paths = [self.config_path]
+        for section in sections:
+            for key in self.filekeys:
+                if key in section:
+                    paths.append(os.path.join(self.model_dir, section[key]))
+        for value in configs.get("variants", {}).values():
+            if isinstance(value, str):
+                paths.append(os.path.join(self.model_dir, value))
+        return sorted(set(paths))
 
 
 class Modelload:
@@ -50,7 +127,7 @@ class Modelload:
     """
     
     @staticmethod
-    def barcode(model_type, gpu_memory_fraction=0.8):
+    def barcode(model_type, gpu_memory_fraction=0.8, precision=None):
         """
         加载条形码检测模型
         从配置文件读取 model_type
@@ -58,6 +135,7 @@ class Modelload:
         Args:
             model_type: 模型类型名称（已弃用，从配置文件读取）
             gpu_memory_fraction: GPU显存比例
+            precision: 精度版本（fp32/fp16/int8），None 时按环境变量和配置选择
             
         Returns:
             BarcodeModel: 条形码检测模型实例
@@ -65,7 +143,8 @@ class Modelload:
         from nets.barcode import BarcodeModel
         
         model_dir = os.path.join("./model", model_type)
-        configs = ModelConfig(model_dir).parse_config(gpu_memory_fraction)
+        precision = precision or resolve_precision(model_type)
+        configs = ModelConfig(model_dir).parse_config(gpu_memory_fraction, precision)
         
         # 从配置文件读取 model_type（如果配置文件中有定义）
         model_type = configs.get("model_type", model_type)
@@ -78,9 +157,103 @@ class Modelload:
         return BarcodeModel(model_file, conf_threshold, iou_threshold, gpu_m_fraction)
 
 
+    @staticmethod
+    def face(model_type, gpu_memory_fraction=0.8, precision=None, defer_runtime=False):
+        """
+        加载人脸模型（MTCNN + InceptionResnetV1）
+        推理引擎由 conf/config.json 的 engine 或环境变量 FACE_ENGINE 选择：
+        torch 使用 facenet-pytorch，torch_opt 在 torch 基础上按 server_config.json 的 face_torch
+        开启 inference_mode、TorchScript 等优化，onnx 通过 hexai_backend 执行导出的 ONNX 模型
+        
+        Args:
+            model_type: 模型目录名称（onnx 引擎从 ./model/<model_type> 读取模型）
+            gpu_memory_fraction: GPU显存比例
+            precision: onnx 引擎的精度版本（fp32/fp16/int8），None 时按环境变量和配置选择
+            defer_runtime: torch 引擎只加载权重，线程设置在 fork 之后执行；此时不做 resnet 图优化
+            
+        Returns:
+            TorchFaceModel 或 FaceOnnxModel: 人脸模型实例
+        """
+        from config_loader import get_config
+        
+        config = get_config()
+        engine = os.getenv("FACE_ENGINE", config.get("engine", "torch"))
+        thresholds = config.get("mtcnn_thresholds", [0.6, 0.7, 0.7])
+        factor = config.get("mtcnn_factor", 0.709)
+        
+        if engine == "onnx":
+            from nets.face_onnx import FaceOnnxModel
+            
+            model_dir = os.path.join("./model", model_type)
+            precision = precision or resolve_precision(model_type)
+            configs = ModelConfig(model_dir).parse_config(gpu_memory_fraction, precision)
+            return FaceOnnxModel(
+                configs["pnetFile"], configs["rnetFile"], configs["onetFile"], configs["resnetFile"],
+                thresholds=thresholds, factor=factor, gpu_m_fraction=configs.get("gpu_m_fraction", 0.8)
+            )
+        
+        from nets.face_torch import TorchFaceModel
+        
+        options = {}
+        if engine == "torch_opt":
+            face_torch = get_config("server_config.json").get("face_torch") or {}
+            options = {
+                "inference_mode": face_torch.get("inference_mode", True),
+                "jit": face_torch.get("jit", "trace"),
+                "channels_last": face_torch.get("channels_last", False),
+                "bf16": face_torch.get("bf16", False),
+                "intra_op_threads": face_torch.get("intra_op_threads", 0),
+                "inter_op_threads": face_torch.get("inter_op_threads", 0),
+            }
+            if defer_runtime and options["jit"]:
+                # trace/freeze 生成的新图会在每个 worker 中各复制一份 resnet 权重，抵消 preload 共享的内存；
+                # 它又需要执行推理，不能在 fork 之前的主进程中完成，所以 preload 模式下不做图优化
+                logger.info(f"preload 模式下关闭 resnet 图优化 (jit={options['jit']})，worker 间共享 eager 模型的权重")
+                options["jit"] = None
+        return TorchFaceModel(thresholds=thresholds, factor=factor, defer_runtime=defer_runtime, **options)
+    
+    @staticmethod
+    def preload_barcode(model_type, gpu_memory_fraction=0.8, precision=None):
+        """
+        preload 模式下在 gunicorn 主进程中执行：只导入依赖模块（app 层的模块由 app.pipelines.preload 导入）
+        推理会话自带线程池和设备上下文，fork 后不能安全使用，由 worker 自行创建
+        
+        Returns:
+            None
+        """
+        import nets.barcode
+        return None
+    
+    @staticmethod
+    def preload_face(model_type, gpu_memory_fraction=0.8, precision=None):
+        """
+        preload 模式下在 gunicorn 主进程中执行
+        CPU 上的 torch 引擎在主进程加载权重，fork 后各 worker 以写时复制方式共享参数内存；
+        onnx 引擎和 GPU/NPU 设备只导入依赖模块（推理会话和设备上下文不能跨 fork 使用）
+        
+        Returns:
+            TorchFaceModel 或 None
+        """
+        from config_loader import get_config
+        
+        engine = os.getenv("FACE_ENGINE", get_config().get("engine", "torch"))
+        if engine == "onnx":
+            import nets.face_onnx
+            return None
+        import nets.face_torch
+        if os.getenv("DEVICE", "cpu") != "cpu":
+            return None
+        return Modelload.face(model_type, gpu_memory_fraction, precision, defer_runtime=True)
+
+
 class ModelManager:
     """
     模型管理器 - 单例模式
+    
+    按 (模型类型, 精度版本, 设备) 缓存已加载的模型实例：
+    - 超出 server_config.json 中 model_cache.max_mb 时按 LRU 淘汰（0 表示不限制）
+    - model_cache.watch_interval > 0 时后台线程监控 model_config.json 和模型文件的修改时间，
+      变化后在后台加载新版本并原子替换缓存，正在处理的请求继续使用旧实例
     """
     
     _instance = None
@@ -94,35 +267,214 @@ class ModelManager:
     def __init__(self):
         if not hasattr(self, '_initialized'):
             self._registry = {}
+            self._preloaders = {}
+            self._cache = OrderedDict()
+            self._precisions = {}
+            self._lock = threading.RLock()
+            self._load_lock = threading.Lock()
+            self._watcher = None
+            self._watcher_pid = None
+            self.max_bytes = 0
+            self.watch_interval = 0
             self._initialized = True
     
-    def register(self, name, loader):
+    def configure(self, max_bytes=0, watch_interval=0):
+        """
+        设置缓存参数
+        
+        Args:
+            max_bytes: 缓存模型的内存预算（字节），0 表示不限制
+            watch_interval: 热更新检查间隔（秒），0 表示不监控
+        """
+        self.max_bytes = max_bytes
+        self.watch_interval = watch_interval
+    
+    def register(self, name, loader, preload=None):
         """
         注册模型加载器
         
         Args:
             name: 模型类型名称
             loader: 加载函数
+            preload: preload 模式下在主进程执行的加载函数，返回可跨 fork 共享的模型实例或 None
         """
         self._registry[name] = loader
+        if preload is not None:
+            self._preloaders[name] = preload
     
-    def get_model(self, model_type, gpu_memory_fraction=0.5):
+    def preload(self, model_type, gpu_memory_fraction=0.5):
         """
-        获取模型实例
+        在 gunicorn 主进程 fork 之前预加载模型（preload 模式）
         
         Args:
             model_type: 模型类型名称
             gpu_memory_fraction: GPU显存比例
+        """
+        if model_type not in self._preloaders:
+            return
+        if model_type not in self._precisions:
+            self._precisions[model_type] = resolve_precision(model_type)
+        key = (model_type, self._precisions[model_type], os.getenv("DEVICE", "cpu"))
+        entry = self._load(key, gpu_memory_fraction, self._preloaders[model_type])
+        if entry["model"] is None:
+            logger.info(f"预加载 {model_type}: 只导入依赖模块")
+            return
+        with self._lock:
+            self._cache[key] = entry
+        logger.info(f"预加载 {model_type}: 权重已在主进程加载")
+    
+    def after_fork(self):
+        """
+        worker fork 之后调用：完成预加载模型的运行时初始化（线程池、图优化等）
+        """
+        with self._lock:
+            models = [entry["model"] for entry in self._cache.values()]
+        for model in models:
+            setup_runtime = getattr(model, "setup_runtime", None)
+            if setup_runtime is not None:
+                setup_runtime()
+    
+    def get_model(self, model_type, gpu_memory_fraction=0.5, precision=None):
+        """
+        获取模型实例，已加载的实例直接从缓存返回
+        
+        Args:
+            model_type: 模型类型名称
+            gpu_memory_fraction: GPU显存比例
+            precision: 精度版本（fp32/fp16/int8），None 时按环境变量和配置选择
             
         Returns:
             模型实例
         """
-        if model_type in self._registry:
-            return self._registry[model_type](model_type, gpu_memory_fraction)
-        else:
+        if model_type not in self._registry:
             raise Exception(f"未注册的模型类型: {model_type}")
+        
+        if precision is None:
+            if model_type not in self._precisions:
+                self._precisions[model_type] = resolve_precision(model_type)
+            precision = self._precisions[model_type]
+        key = (model_type, precision, os.getenv("DEVICE", "cpu"))
+        
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                return entry["model"]
+        
+        # 同一时刻只加载一个模型，避免并发请求重复加载
+        with self._load_lock:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None:
+                    return entry["model"]
+            entry = self._load(key, gpu_memory_fraction)
+            with self._lock:
+                self._cache[key] = entry
+                self._evict(keep=key)
+        self._ensure_watcher()
+        return entry["model"]
+    
+    def loaded(self):
+        """
+        返回已缓存模型的信息
+        
+        Returns:
+            list: 每项包含 model_type/precision/device/nbytes/loaded_at
+        """
+        with self._lock:
+            return [
+                {"model_type": key[0], "precision": key[1], "device": key[2],
+                 "nbytes": entry["nbytes"], "loaded_at": entry["loaded_at"]}
+                for key, entry in self._cache.items()
+            ]
+    
+    def _watch_paths(self, model_type):
+        """模型目录中需要监控的文件"""
+        return ModelConfig(os.path.join("./model", model_type)).watch_files()
+    
+    def _mtimes(self, paths):
+        """文件修改时间，文件不存在时为 None"""
+        return {path: os.path.getmtime(path) if os.path.exists(path) else None for path in paths}
+    
+    def _load(self, key, gpu_memory_fraction, loader=None):
+        """调用加载器加载模型，返回缓存条目"""
+        model_type, precision, _ = key
+        paths = self._watch_paths(model_type)
+        mtimes = self._mtimes(paths)
+        loader = loader or self._registry[model_type]
+        model = loader(model_type, gpu_memory_fraction, precision)
+        if model is None:
+            return {"model": None}
+        # 内存估算：模型自身提供 nbytes 时使用，否则按模型文件大小估算
+        nbytes = getattr(model, "nbytes", None)
+        if nbytes is None:
+            nbytes = sum(os.path.getsize(p) for p in paths if os.path.exists(p) and not p.endswith(".json"))
+        logger.info(f"模型加载完成: {key}, {nbytes / (1024 * 1024):.1f} MB")
+        return {
+            "model": model,
+            "nbytes": nbytes,
+            "mtimes": mtimes,
+            "gpu_memory_fraction": gpu_memory_fraction,
+            "loaded_at": time.time(),
+        }
+    
+    def _evict(self, keep=None):
+        """超出内存预算时按 LRU 淘汰，至少保留 keep 对应的实例"""
+        if not self.max_bytes:
+            return
+        while sum(e["nbytes"] for e in self._cache.values()) > self.max_bytes and len(self._cache) > 1:
+            oldest = next(iter(self._cache))
+            if oldest == keep:
+                self._cache.move_to_end(oldest)
+                oldest = next(iter(self._cache))
+            # 只从缓存移除，正在使用该实例的请求持有引用，处理完后自然释放
+            self._cache.pop(oldest)
+            logger.info(f"模型缓存超出预算，淘汰: {oldest}")
+    
+    def _ensure_watcher(self):
+        """启动热更新监控线程（fork 后的子进程需要重新启动）"""
+        if not self.watch_interval:
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive() and self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+            self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+            self._watcher.start()
+    
+    def _watch(self):
+        """定期检查模型文件，变化后在后台加载新版本并原子替换"""
+        while True:
+            time.sleep(self.watch_interval)
+            with self._lock:
+                entries = list(self._cache.items())
+            for key, entry in entries:
+                if entry.get("model") is None:
+                    continue
+                try:
+                    # 部署过程中 model_config.json 可能只写了一半，读取失败时下一轮再检查
+                    mtimes = self._mtimes(self._watch_paths(key[0]))
+                except Exception as e:
+                    logger.warning(f"读取模型文件状态失败，稍后重试 {key}: {e}")
+                    continue
+                if mtimes == entry["mtimes"]:
+                    continue
+                try:
+                    logger.info(f"检测到模型文件变化，重新加载: {key}")
+                    new_entry = self._load(key, entry["gpu_memory_fraction"])
+                except Exception as e:
+                    # 加载失败继续使用旧版本，记录本次的修改时间避免反复重试
+                    logger.error(f"模型热更新失败，继续使用旧版本 {key}: {e}")
+                    entry["mtimes"] = mtimes
+                    continue
+                with self._lock:
+                    if key in self._cache:
+                        self._cache[key] = new_entry
+                        self._evict(keep=key)
 
 
 # 注册默认的模型加载器
 manager = ModelManager()
-manager.register("barcode", Modelload.barcode)
+manager.configure(**_cache_config())
+manager.register("barcode", Modelload.barcode, preload=Modelload.preload_barcode)
+manager.register("face", Modelload.face, preload=Modelload.preload_face)
@@ -1,3 +1,4 @@
+import gc
 import os
 import sys
 import multiprocessing
@@ -30,14 +31,20 @@ if project_dir not in sys.path:
 
 from config_loader import get_config
 
+from app.metrics import setup_multiprocess, mark_process_dead
+
 # 读取服务器配置，使用通用的get_config函数
 s_configs = get_config('server_config.json')
 
+# 多个 worker 的监控指标通过 multiprocess 目录汇总，必须在任何进程导入 prometheus_client 之前设置
+setup_multiprocess()
+
 bind = f"{s_configs['host']}:{s_configs['port']}"
 workers = s_configs['workers']
 threads = s_configs['threads'] if 'threads' in s_configs else 1
-# 【关键修复】使用 sync worker 而不是 gthread，避免多线程与 multiprocessing 冲突
-worker_class = 'sync'
+# 【关键修复】默认使用 sync worker 而不是 gthread，避免多线程与 multiprocessing 冲突
+# 需要执行通道（lanes）在 worker 内按优先级调度时，配置 "worker_class": "gthread" 并把 threads 设为大于 1
+worker_class = s_configs['worker_class'] if 'worker_class' in s_configs else 'sync'
 loglevel = s_configs['log_level'] if 'log_level' in s_configs else 'info'
 
 proc_name = 'ai-face-recognition-server'
@@ -45,14 +52,56 @@ pidfile = './run.pid'
 timeout = 360
 keepalive = 75
 
-# 禁用预加载，让每个worker独立初始化（避免 fork 导致的 ForkAwareLocal ��接问题）
-preload_app = False
+# 默认禁用预加载，让每个worker独立初始化（避免 fork 导致的 ForkAwareLocal 连接问题）
+# preload 模式（server_config.json 的 preload 或环境变量 GUNICORN_PRELOAD=1）下主进程在 fork 前加载模型权重，
+# worker 以写时复制方式共享；推理会话、线程池和设备上下文在 post_fork 中由每个 worker 自行创建
+preload_app = os.getenv('GUNICORN_PRELOAD', '1' if s_configs.get('preload', False) else '0') == '1'
+os.environ['GUNICORN_PRELOAD'] = '1' if preload_app else '0'
 
 # worker 配置
 def on_starting(server):
-    """主进程启动时记录日志"""
+    """主进程启动时记录日志，推理服务模式下启动推理进程"""
     import logging
     logging.info("Gunicorn 主进程启动中...")
+    from app.infer_server import infer_server_config
+    config = infer_server_config()
+    if config['enabled'] and config['spawn']:
+        import subprocess
+        server.infer_processes = [
+            subprocess.Popen([sys.executable, '-m', 'app.infer_server', '--index', str(i)], cwd=project_dir)
+            for i in range(config['processes'])
+        ]
+        logging.info(f"已启动 {config['processes']} 个推理进程")
+
+def when_ready(server):
+    """主进程就绪、开始 fork worker 之前调用：preload 模式下预加载模型"""
+    if not preload_app:
+        return
+    import logging
+    from app.pipelines import preload
+    # 推理服务模式下模型由推理进程持有，HTTP worker 不需要预加载
+    roles = preload()
+    if not roles:
+        return
+    # 冻结主进程中已有的对象，worker 中的垃圾回收不再扫描它们，避免触碰对象头导致共享页面被复制
+    gc.collect()
+    gc.freeze()
+    logging.info(f"预加载完成: {roles}")
+
+def post_fork(server, worker):
+    """worker fork 之后调用：preload 模式下初始化线程池等不能跨 fork 的资源，并按配置预热"""
+    if not preload_app:
+        return
+    from nets.model_manager import manager
+    from app.handlers import start_warmup
+    from app.jobs import start_jobs
+    manager.after_fork()
+    start_warmup()
+    start_jobs()
+
+def child_exit(server, worker):
+    """worker 退出后清理它的监控指标文件"""
+    mark_process_dead(worker.pid)
 
 def worker_int(worker):
     """Worker 进程被杀死时调用"""
@@ -61,3 +110,10 @@ def worker_int(worker):
 def worker_abort(worker):
     """Worker 进程被中止时调用"""
     pass
+
+def on_exit(server):
+    """主进程退出时停止推理进程"""
+    for proc in getattr(server, 'infer_processes', []):
+        proc.terminate()
+    for proc in getattr(server, 'infer_processes', []):
+        proc.wait(timeout=30)
@@ -6,379 +6,136 @@
 """
 
 import os
-import base64
-import uuid
-import io
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, request, jsonify
 import logging
-from logging.handlers import RotatingFileHandler
-from PIL import Image
-from app.face_compare import FaceComparator
-from app.barcode_detect import BarDetect
-
-# 初始化模型
-comparator = FaceComparator()
-bar = BarDetect()
-# 配置日志
-def setup_logging():
-    """配置日志系统"""
-    # 获取项目根目录（兼容exec启动方式）
-    if '__file__' in dir():
-        # 正常Python脚本启动
-        project_dir = os.path.dirname(os.path.abspath(__file__))
-    else:
-        # exec方式启动，使用当前工作目录
-        project_dir = os.getcwd()
-    
-    log_dir = os.path.join(project_dir, 'logs')
-    os.makedirs(log_dir, exist_ok=True)
-    
-    log_file = os.path.join(log_dir, 'server.log')
-    
-    # 创建logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    
-    # 清除已有的handlers
-    logger.handlers.clear()
-    
-    # 创建文件处理器（带日志轮转，每个文件最大10MB，保留5个备份）
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.INFO)
-    
-    # 创建控制台处理器
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    
-    # 创建日志格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # 添加处理器到logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+from app.logs import setup_logging
+from app.pipelines import roles
+from app.handlers import (
+    enabled_endpoints, handle_request, log_outcome, health_status, ready_status,
+    start_warmup, save_base64_image, metrics, admin_profile, capture,
+)
+from app.jobs import manager as jobs, start_jobs
 
 # 初始化日志
 setup_logging()
 
 app = Flask(__name__)
 
-def validate_image_format(image_data):
-    """验证数据是否为有效的图片格式"""
-    try:
-        # 使用Pillow验证图片格式
-        img = Image.open(io.BytesIO(image_data))
-        img.verify()  # 验证图片完整性
-        
-        # 重新打开因为verify()会消耗文件
-        img = Image.open(io.BytesIO(image_data))
-        
-        # 支持的图片格式列表
-        supported_formats = {'JPEG', 'PNG', 'JPG', 'WEBP', 'BMP', 'GIF'}
-        img_format = img.format.upper() if img.format else ''
-        
-        if img_format not in supported_formats:
-            raise ValueError(f"不支持的图片格式: {img_format}")
-        
-        return True, img_format
-    except Exception as e:
-        logging.error(f"图片错误: {str(e)}")
-        return False, str(e)
-
-def save_base64_image(base64_string, upload_dir='./data/uploads'):
-    """将base64字符串保存为图片文件"""
-    # 确保上传目录存在
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # 解码base64
-    if ',' in base64_string:
-        # 移除data:image/jpeg;base64,等前缀
-        base64_string = base64_string.split(',')[1]
-    
-    image_data = base64.b64decode(base64_string)
-    
-    # 验证是否为有效的图片格式
-    is_valid, result = validate_image_format(image_data)
-    if not is_valid:
-        raise ValueError(f"图片格式错误: {result}")
-    
-    # 生成唯一文件名
-    filename = f"{uuid.uuid4()}.jpg"
-    filepath = os.path.join(upload_dir, filename)
-    
-    # 保存图片
-    with open(filepath, 'wb') as f:
-        f.write(image_data)
-    
-    return filepath
-
-def icr_process():
-    try:
-        img1_path = None
-        img2_path = None
-        
-        # 判断是JSON请求还是multipart/form-data请求
-        if request.is_json:
-            data = request.get_json()
-            
-            # 检查必需参数
-            if 'image1' not in data or 'image2' not in data:
-                logging.error("缺少必需参数：image1和image2")
-                return {
-                    'is_same_person': False,
-                    'message': '缺少必需参数：image1和image2'
-                }, 400
-            
-            # 保存base64图片（包含图片格式验证）
-            try:
-                img1_path = save_base64_image(data['image1'])
-                img2_path = save_base64_image(data['image2'])
-                logging.info(f"保存base64图片: {img1_path}, {img2_path}")
-            except ValueError as ve:
-                logging.error(f"图片格式错误: {str(ve)}")
-                return {
-                    'is_same_person': False,
-                    'message': str(ve)
-                }, 400
-        
-        # 进行人脸比对
-        logging.info(f"开始比对人脸: {img1_path} vs {img2_path}")
-        distance, is_same_person = comparator.compare(img1_path, img2_path)
-        
-        # 清理临时文件
-        try:
-            if os.path.exists(img1_path):
-                os.remove(img1_path)
-            if os.path.exists(img2_path):
-                os.remove(img2_path)
-            logging.info(f"清理临时文件成功")
-        except Exception as cleanup_error:
-            logging.warning(f"清理临时文件失败: {str(cleanup_error)}")
-        
-        # 返回成功结果
-        result = {
-            'is_same_person': is_same_person,
-            'message': 'ok'
-        }
-        logging.info(f"比对完成: distance={distance}, is_same_person={is_same_person}")
-        return result
-        
-    except Exception as e:
-        logging.error(f"服务器错误: {str(e)}", exc_info=True)
-        return {
-            'is_same_person': False,
-            'message': f'服务器错误: {str(e)}'
-        }, 500
-
-@app.route('/face_compare', methods=['POST'])
-def face_compare():
-    import time
-    logging.info("Call /face_compare")
-    start_time = time.time()
-    result = icr_process()
-    # 计算耗时（秒）并记录到日志
-    cost_time = round(time.time() - start_time, 3)
-    logging.info(f"cost_time: {cost_time}s")
-    # 返回结果
-    if isinstance(result, tuple):
-        # 处理有状态码的情况
-        response_data, status_code = result
-        return jsonify(response_data), status_code
-    else:
-        # 正常返回
-        return jsonify(result)
+# preload 模式下本模块在 gunicorn 主进程中导入，预热推迟到每个 worker fork 之后（见 pygunicorn.post_fork）
+if os.getenv('GUNICORN_PRELOAD') != '1':
+    start_warmup()
+    start_jobs()
+logging.info(f"启用的服务角色: {roles}")
 
+def load_json():
+    """解析 JSON 请求体，非 JSON 请求返回 None"""
+    return request.get_json(silent=True) if request.is_json else None
 
-def bd_process():
+def endpoint_view(path):
     """
-    条形码检测处理函数
-    接收 base64 编码的图片，返回检测结果
+    创建接口的视图函数，处理逻辑见 app.handlers
+    
+    Args:
+        path: 接口路由
     """
-    try:
-        img_path = None
-        
-        # 判断是JSON请求还是multipart/form-data请求
-        if request.is_json:
-            data = request.get_json()
-            
-            # 检查必需参数
-            if 'image' not in data:
-                logging.error("缺少必需参数：image")
-                return {
-                    'code': -1,
-                    'message': '缺少必需参数：image'
-                }, 400
-            
-            # 保存base64图片
-            try:
-                img_path = save_base64_image(data['image'])
-                logging.info(f"保存base64图片: {img_path}")
-            except ValueError as ve:
-                logging.error(f"图片格式错误: {str(ve)}")
-                return {
-                    'code': -1,
-                    'message': str(ve)
-                }, 400
-        else:
-            return {
-                'code': -1,
-                'message': '只支持 JSON 请求格式'
-            }, 400
-        
-        # 进行条形码检测
-        logging.info(f"开始检测条形码: {img_path}")
-        results, _ = bar.predict(img_path)
-        if 0 == len(results):
-            return {
-            'code': 0,
-            'message': '未检测到条形码！',
-            'results': results
-        }
-        # 删除 mask 字段
-        for result in results:
-            result.pop('mask', None)
-        
-        # 清理临时文件
-        try:
-            if os.path.exists(img_path):
-                os.remove(img_path)
-                logging.info(f"清理临时文件成功")
-        except Exception as cleanup_error:
-            logging.warning(f"清理临时文件失败: {str(cleanup_error)}")
+    def view():
+        logging.debug(f"Call {path}")
+        start_time = time.time()
+        outcome = handle_request(path, load_json, request.headers)
+        # 计算耗时（秒）并记录到日志，排队时间单独记录
+        log_outcome(path, outcome, start_time)
+        # 按采样率记录请求和响应，供 tools/replay.py 回放
+        capture.record(path, request.get_data(), request.headers, outcome, time.time() - start_time)
+        response = jsonify(outcome.body)
+        response.status_code = outcome.status
+        response.headers.update(outcome.headers())
+        return response
+    return view
 
-        return {
-            'code': 0,
-            'message': 'ok',
-            'results': results
-        }
-        
-    except Exception as e:
-        logging.error(f"服务器错误: {str(e)}", exc_info=True)
-        return {
-            'code': -1,
-            'message': f'服务器错误: {str(e)}'
-        }, 500
+# 按服务角色注册接口，未启用的角色不注册对应接口
+for path in enabled_endpoints():
+    app.add_url_rule(path, path.strip('/'), endpoint_view(path), methods=['POST'])
 
-def bc_process():
+@app.route('/healthz', methods=['GET'])
+def healthz():
     """
-    条形码解码处理函数
-    接收 base64 编码的图片，返回解码结果
+    存活检查接口
+    进程可以响应即返回 200，附带各模型的加载状态和耗时
     """
-    try:
-        img_path = None
-        
-        # 判断是JSON请求还是multipart/form-data请求
-        if request.is_json:
-            data = request.get_json()
-            
-            # 检查必需参数
-            if 'image' not in data:
-                logging.error("缺少必需参数：image")
-                return {
-                    'code': -1,
-                    'message': '缺少必需参数：image'
-                }, 400
-            
-            # 保存base64图片
-            try:
-                img_path = save_base64_image(data['image'])
-                logging.info(f"保存base64图片: {img_path}")
-            except ValueError as ve:
-                logging.error(f"图片格式错误: {str(ve)}")
-                return {
-                    'code': -1,
-                    'message': str(ve)
-                }, 400
-        else:
-            return {
-                'code': -1,
-                'message': '只支持 JSON 请求格式'
-            }, 400
-        
-        # 进行条形码解码
-        logging.info(f"开始解码条形码: {img_path}")
-        results = bar.barcode_decode(img_path)
-        message = 'ok'
-        if 0 == len(results):
-            message = '解码失败！'
-        # 清理临时文件
-        try:
-            if os.path.exists(img_path):
-                os.remove(img_path)
-                logging.info(f"清理临时文件成功")
-        except Exception as cleanup_error:
-            logging.warning(f"清理临时文件失败: {str(cleanup_error)}")
+    return jsonify(health_status())
 
-        response = {
-            'code': 0,
-            'message': message,
-            'results': results
-        }
-        
-        return response
-        
-    except Exception as e:
-        logging.error(f"服务器错误: {str(e)}", exc_info=True)
-        return {
-            'code': -1,
-            'message': f'服务器错误: {str(e)}'
-        }, 500
-
-@app.route('/bar_detect', methods=['POST'])
-def bar_detect():
+@app.route('/readyz', methods=['GET'])
+def readyz():
     """
-    条形码检测接口
-    接收 base64 编码的图片，返回检测结果
+    就绪检查接口
+    开启预热时所有模型加载并预热完成后返回 200，否则返回 503
     """
-    import time
-    logging.info("Call /bar_detect")
-    start_time = time.time()
-    
-    result = bd_process()
-    
-    # 计算耗时（秒）并记录到日志
-    cost_time = round(time.time() - start_time, 3)
-    if isinstance(result, tuple):
-        logging.info(f"cost_time: {cost_time}s")
-        response_data, status_code = result
-        return jsonify(response_data), status_code
-    else:
-        logging.info(f"检测完成: cost_time: {cost_time}s")
-        return jsonify(result)
+    body, status = ready_status()
+    return jsonify(body), status
 
-@app.route('/bar_decode', methods=['POST'])
-def bar_decode():
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
     """
-    条形码解码接口
-    接收 base64 编码的图片，返回解码结果
+    Prometheus 指标接口
+    多 worker 部署时读取 multiprocess 目录，返回所有 worker 汇总后的指标
     """
-    import time
-    logging.info("Call /bar_decode")
-    start_time = time.time()
-    
-    result = bc_process()
-    
-    # 计算耗时（秒）并记录到日志
-    cost_time = round(time.time() - start_time, 3)
-    if isinstance(result, tuple):
-        logging.info(f"cost_time: {cost_time}s")
-        response_data, status_code = result
-        return jsonify(response_data), status_code
-    else:
-        logging.info(f"解码完成: cost_time: {cost_time}s")
-        return jsonify(result)
+    rendered = metrics.render()
+    if rendered is None:
+        return jsonify({'message': '监控指标未启用'}), 404
+    data, content_type = rendered
+    return Response(data, content_type=content_type)
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile_view():
+    """
+    性能分析管理接口（需要 X-Admin-Token）
+    开启后本 worker 接下来的 N 个请求的分析结果写入 logs/profiles/
+    """
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    if request.method == 'POST' and data is None:
+        data = {} if not request.get_data() else False
+    body, status = admin_profile(data, request.headers)
+    return jsonify(body), status
+
+@app.route('/jobs', methods=['POST'])
+def jobs_submit_view():
+    """
+    提交批量任务，立即返回任务 ID（202）
+    任务在后台执行，进度和结果通过 /jobs/<job_id> 查询
+    """
+    if jobs is None:
+        return jsonify({'message': '批量任务未启用'}), 404
+    body, status = jobs.submit(load_json())
+    return jsonify(body), status
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def jobs_status_view(job_id):
+    """查询（GET）或取消（DELETE）批量任务"""
+    if jobs is None:
+        return jsonify({'message': '批量任务未启用'}), 404
+    body, status = jobs.cancel(job_id) if request.method == 'DELETE' else jobs.status(job_id)
+    return jsonify(body), status
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def jobs_results_view(job_id):
+    """
+    获取批量任务结果
+    默认分页返回（offset、limit）；format=ndjson 时逐行流式返回当前已完成的结果
+    follow=1（持续输出直到任务结束）只在 ASGI 模式下支持：sync worker 中会在整个任务期间占用 worker
+    """
+    if jobs is None:
+        return jsonify({'message': '批量任务未启用'}), 404
+    if request.args.get('format') == 'ndjson':
+        if request.args.get('follow') == '1':
+            return jsonify({'message': 'follow 只在 ASGI 模式下支持，请使用分页接口轮询'}), 400
+        stream = jobs.stream(job_id)
+        if stream is None:
+            return jsonify({'message': f'任务不存在: {job_id}'}), 404
+        return Response(stream, mimetype='application/x-ndjson')
+    body, status = jobs.results(job_id, request.args.get('offset', 0, type=int),
+                                request.args.get('limit', 100, type=int))
+    return jsonify(body), status
 
 if __name__ == '__main__':
     # from waitress import serve
@@ -24,4 +24,5 @@ if __name__ == "__main__":
     # 启动 web 服务
     print("* Starting web service...")
     logging.info("* Starting web service...")
-    serve(app, host='0.0.0.0', port=5002, threads=1)
+    # 多线程时由执行通道（lanes）在线程之间按优先级分配推理槽位
+    serve(app, host='0.0.0.0', port=5002, threads=s_configs['threads'] if 'threads' in s_configs else 1)
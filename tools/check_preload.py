@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+preload 模式内存共享检查工具（仅 Linux）
+读取 gunicorn 主进程（run.pid）及各 worker 的 /proc/<pid>/smaps_rollup，
+报告 RSS、PSS 和共享内存，用于确认模型权重在 worker 之间以写时复制方式共享。
+RSS 之和远大于 PSS 之和说明有大量共享页面；preload 关闭时两者接近。
+
+用法:
+    python tools/check_preload.py
+    # 先发送若干请求，确认推理之后共享页面没有被复制
+    python tools/check_preload.py --pidfile ./run.pid --output preload_report.json
+"""
+
+import os
+import sys
+import json
+import argparse
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+
+def children(pid):
+    """读取进程的直接子进程"""
+    pids = []
+    task_dir = f"/proc/{pid}/task"
+    for tid in os.listdir(task_dir):
+        with open(os.path.join(task_dir, tid, "children")) as f:
+            pids.extend(int(p) for p in f.read().split())
+    return pids
+
+
+def memory(pid):
+    """
+    读取进程内存统计
+
+    Returns:
+        dict: rss/pss/shared/private，单位 MB
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    shared = values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0)
+    private = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return {
+        "pid": pid,
+        "rss_mb": round(values.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(values.get("Pss", 0) / 1024, 1),
+        "shared_mb": round(shared / 1024, 1),
+        "private_mb": round(private / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="preload 模式内存共享检查工具")
+    parser.add_argument("--pidfile", default="./run.pid", help="gunicorn 主进程 pid 文件")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    with open(args.pidfile) as f:
+        master = int(f.read().strip())
+    rows = [dict(memory(master), role="master")]
+    rows += [dict(memory(pid), role="worker") for pid in children(master)]
+
+    print(f"{'进程':<8} {'pid':>8} {'RSS(MB)':>10} {'PSS(MB)':>10} {'共享(MB)':>10} {'私有(MB)':>10}")
+    for row in rows:
+        print(f"{row['role']:<8} {row['pid']:>8} {row['rss_mb']:>10.1f} {row['pss_mb']:>10.1f} "
+              f"{row['shared_mb']:>10.1f} {row['private_mb']:>10.1f}")
+    total_rss = sum(row["rss_mb"] for row in rows)
+    total_pss = sum(row["pss_mb"] for row in rows)
+    print(f"\n合计: RSS {total_rss:.1f}MB, PSS（实际占用）{total_pss:.1f}MB, 共享节省 {total_rss - total_pss:.1f}MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"processes": rows, "total_rss_mb": total_rss, "total_pss_mb": total_pss}, f, indent=2)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
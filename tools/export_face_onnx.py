@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+人脸模型 ONNX 导出工具
+将 facenet-pytorch 的 P-Net/R-Net/O-Net 和 InceptionResnetV1 (vggface2) 导出为 ONNX，
+并生成 onnx 引擎使用的 model_config.json
+
+用法:
+    # 导出到 ./model/face
+    python tools/export_face_onnx.py --output-dir ./model/face
+    # 导出后与 torch 引擎做一致性检查（特征向量误差超出容差时返回非 0）
+    python tools/export_face_onnx.py --output-dir ./model/face --check
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+import numpy as np
+from PIL import Image
+
+
+def export(output_dir, opset):
+    """导出四个 ONNX 模型并写入 model_config.json"""
+    import torch
+    from facenet_pytorch import MTCNN, InceptionResnetV1
+
+    os.makedirs(output_dir, exist_ok=True)
+    mtcnn = MTCNN(device=torch.device('cpu'))
+    resnet = InceptionResnetV1(pretrained='vggface2').eval()
+
+    # (模型, 输入尺寸, 输出名称, 动态维度)
+    specs = {
+        "pnet.onnx": (mtcnn.pnet, (1, 3, 120, 160), ['reg', 'prob'],
+                      {'input': {0: 'batch', 2: 'height', 3: 'width'},
+                       'reg': {0: 'batch', 2: 'out_height', 3: 'out_width'},
+                       'prob': {0: 'batch', 2: 'out_height', 3: 'out_width'}}),
+        "rnet.onnx": (mtcnn.rnet, (4, 3, 24, 24), ['reg', 'prob'],
+                      {'input': {0: 'batch'}, 'reg': {0: 'batch'}, 'prob': {0: 'batch'}}),
+        "onet.onnx": (mtcnn.onet, (4, 3, 48, 48), ['reg', 'landmarks', 'prob'],
+                      {'input': {0: 'batch'}, 'reg': {0: 'batch'}, 'landmarks': {0: 'batch'}, 'prob': {0: 'batch'}}),
+        "resnet.onnx": (resnet, (2, 3, 160, 160), ['embedding'],
+                        {'input': {0: 'batch'}, 'embedding': {0: 'batch'}}),
+    }
+    for filename, (net, shape, output_names, dynamic_axes) in specs.items():
+        path = os.path.join(output_dir, filename)
+        net.eval()
+        with torch.no_grad():
+            torch.onnx.export(
+                net, torch.randn(*shape), path,
+                input_names=['input'], output_names=output_names,
+                dynamic_axes=dynamic_axes, opset_version=opset
+            )
+        print(f"✓ 导出 {path} ({os.path.getsize(path) / (1024 * 1024):.2f} MB)")
+
+    config_path = os.path.join(output_dir, "model_config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "model_type": "face",
+            "pnetFile": "pnet.onnx",
+            "rnetFile": "rnet.onnx",
+            "onetFile": "onet.onnx",
+            "resnetFile": "resnet.onnx",
+        }, f, indent=2)
+    print(f"✓ 写入 {config_path}")
+
+
+def check(output_dir, images, tolerance):
+    """
+    与 torch 引擎做一致性检查
+
+    1. 同一批对齐人脸分别送入 torch/onnx 的 resnet，比较特征向量
+    2. 完整流程（检测 + 裁剪 + 特征）分别用两个引擎执行，比较最终特征向量
+
+    Returns:
+        bool: 是否通过
+    """
+    from nets.face_torch import TorchFaceModel
+    from nets.face_onnx import FaceOnnxModel
+
+    torch_model = TorchFaceModel()
+    onnx_model = FaceOnnxModel(*[os.path.join(output_dir, name) for name in
+                                 ("pnet.onnx", "rnet.onnx", "onet.onnx", "resnet.onnx")])
+
+    passed = True
+    print(f"\n{'图片':<24} {'resnet 误差':>12} {'流程误差':>12} {'人脸数 torch/onnx':>18}")
+    for path in images:
+        img = Image.open(path).convert('RGB')
+        torch_boxes = torch_model.detect(img, 20)
+        onnx_boxes = onnx_model.detect(img, 20)
+        if len(torch_boxes) == 0 or len(onnx_boxes) == 0:
+            print(f"{os.path.basename(path):<24} {'-':>12} {'-':>12} {len(torch_boxes):>9}/{len(onnx_boxes)}")
+            passed = passed and len(torch_boxes) == len(onnx_boxes)
+            continue
+
+        # 1. 相同输入下的 resnet 误差
+        faces = torch_model.extract(img, torch_boxes[:1, :4])
+        resnet_diff = float(np.linalg.norm(torch_model.embed(faces) - onnx_model.embed(faces)))
+
+        # 2. 完整流程的特征向量误差（取概率最高的人脸）
+        torch_best = torch_boxes[np.argmax(torch_boxes[:, 4]), :4][np.newaxis]
+        onnx_best = onnx_boxes[np.argmax(onnx_boxes[:, 4]), :4][np.newaxis]
+        pipeline_diff = float(np.linalg.norm(
+            torch_model.embed(torch_model.extract(img, torch_best))
+            - onnx_model.embed(onnx_model.extract(img, onnx_best))
+        ))
+
+        ok = resnet_diff <= 1e-3 and pipeline_diff <= tolerance
+        passed = passed and ok
+        print(f"{os.path.basename(path):<24} {resnet_diff:>12.6f} {pipeline_diff:>12.6f} "
+              f"{len(torch_boxes):>9}/{len(onnx_boxes)} {'✓' if ok else '✗'}")
+
+    print("\n✓ 一致性检查通过" if passed else "\n✗ 一致性检查未通过")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="人脸模型 ONNX 导出工具")
+    parser.add_argument("--output-dir", default="./model/face", help="输出目录")
+    parser.add_argument("--opset", type=int, default=13, help="ONNX opset 版本")
+    parser.add_argument("--check", action="store_true", help="导出后与 torch 引擎做一致性检查")
+    parser.add_argument("--skip-export", action="store_true", help="跳过导出，只做一致性检查")
+    parser.add_argument("--images", nargs="+", default=None, help="一致性检查使用的图片，默认 data/*.png")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="完整流程特征向量 L2 误差容差")
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        export(args.output_dir, args.opset)
+    if args.check or args.skip_export:
+        images = args.images or sorted(glob.glob("data/*.png"))
+        return 0 if check(args.output_dir, images, args.tolerance) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
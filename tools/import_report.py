@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动导入耗时报告
+以 python -X importtime 在子进程中导入 run_server 及对应角色的业务模块，
+按顶层包汇总导入耗时，并记录导入后的进程内存峰值（RSS），用于跟踪启动耗时回归。
+
+用法:
+    # 分别统计 face、barcode 和全部角色
+    python tools/import_report.py
+    # 只统计条形码角色，显示前 20 个包
+    python tools/import_report.py --roles barcode --top 20 --output import_report.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+from config_loader import get_config
+
+
+def role_modules(role):
+    """角色处理请求时实际导入的模块（模型加载前）"""
+    if role == "face":
+        engine = os.getenv("FACE_ENGINE") or get_config().get("engine", "torch")
+        return ["app.face_compare", "nets.face_onnx" if engine == "onnx" else "nets.face_torch"]
+    return ["app.barcode_detect", "nets.barcode"]
+
+
+def measure(roles):
+    """
+    在子进程中导入并解析 -X importtime 输出
+
+    Args:
+        roles: 角色列表
+
+    Returns:
+        dict: total_ms 总耗时，max_rss_mb 内存峰值，packages 各顶层包的耗时（毫秒）
+    """
+    modules = ["run_server"] + [m for role in roles for m in role_modules(role)]
+    code = "; ".join(f"import {m}" for m in modules) + (
+        "; import resource, sys; "
+        "sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))"
+    )
+    # 关闭启动预热，只统计导入耗时
+    env = dict(os.environ, SERVICE_ROLES=",".join(roles), WARMUP_EAGER="0")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise Exception(f"导入失败 ({','.join(roles)}): {proc.stderr.strip().splitlines()[-1]}")
+
+    packages = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        # 格式: import time: self [us] | cumulative | imported package
+        fields = line[len("import time:"):].split("|")
+        self_us, name = int(fields[0]), fields[2].strip()
+        # 按顶层包汇总自身耗时，避免嵌套导入重复计算
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0) + self_us
+        total_us += self_us
+    return {
+        "roles": roles,
+        "total_ms": round(total_us / 1000, 1),
+        # Linux 下 ru_maxrss 单位为 KB
+        "max_rss_mb": round(int(proc.stdout.strip() or 0) / 1024, 1),
+        "packages": {k: round(v / 1000, 1) for k, v in sorted(packages.items(), key=lambda kv: -kv[1])},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动导入耗时报告")
+    parser.add_argument("--roles", nargs="+", default=None,
+                        help="统计的角色组合，逗号分隔，例如 barcode face,barcode；默认分别统计 face、barcode、face,barcode")
+    parser.add_argument("--top", type=int, default=15, help="显示耗时最多的前 N 个包")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    combos = [r.split(",") for r in args.roles] if args.roles else [["face"], ["barcode"], ["face", "barcode"]]
+    reports = []
+    for roles in combos:
+        report = measure(roles)
+        reports.append(report)
+        print(f"\n角色 {','.join(roles)}: 导入 {report['total_ms']}ms, RSS 峰值 {report['max_rss_mb']}MB")
+        for name, ms in list(report["packages"].items())[:args.top]:
+            print(f"  {name:<28} {ms:>10.1f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
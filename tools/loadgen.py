@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP 压测工具
+按加权的请求组合向 /face_compare、/bar_detect、/bar_decode 发送请求，请求体取自样例图片：
+- 指定 --rps 时为开环模式：请求按计划时间（固定间隔或泊松到达）发出，不等待之前的请求返回，
+  延迟从计划发送时间算起，服务变慢时排队的时间也计入延迟，避免协调遗漏（coordinated omission）
+- 指定 --concurrency 时为闭环模式：固定数量的客户端各自串行发送，用于测量最大吞吐量
+输出每个接口的延迟分布（直方图和 p50/p90/p95/p99）、状态码和错误率，
+以及响应头 Server-Timing 中服务端各阶段的耗时。
+
+用法:
+    # 先在本机启动服务: python start.py
+    # 开环 20 RPS，持续 60 秒，人脸:检测:解码 = 1:2:2
+    python tools/loadgen.py --rps 20 --duration 60 --mix face_compare=1,bar_detect=2,bar_decode=2
+    # 闭环 8 并发，泊松到达对闭环模式无效
+    python tools/loadgen.py --concurrency 8 --duration 30 --output loadgen_report.json
+"""
+
+import os
+import sys
+import glob
+import time
+import json
+import base64
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+import numpy as np
+import requests
+
+# 直方图的桶上界（毫秒）
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+def image_to_base64(image_path):
+    """将图片转换为base64编码"""
+    with open(image_path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def build_payloads(face_pattern, barcode_pattern):
+    """
+    用样例图片生成各接口的请求体
+
+    Returns:
+        {接口: [请求体]}
+    """
+    faces = [image_to_base64(path) for path in sorted(glob.glob(face_pattern))]
+    barcodes = [image_to_base64(path) for path in sorted(glob.glob(barcode_pattern))]
+    face_bodies = [{'image1': faces[i], 'image2': faces[i + 1]} for i in range(len(faces) - 1)]
+    bar_bodies = [{'image': f'data:image/jpeg;base64,{data}'} for data in barcodes]
+    return {
+        'face_compare': face_bodies,
+        'bar_detect': bar_bodies,
+        'bar_decode': bar_bodies,
+    }
+
+
+def parse_mix(text):
+    """解析请求组合 "face_compare=1,bar_decode=3" -> {接口: 权重}"""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip().strip('/')] = float(weight or 1)
+    return mix
+
+
+def parse_server_timing(value):
+    """解析 Server-Timing 响应头 -> {阶段: 毫秒}"""
+    timings = {}
+    for item in (value or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        for part in parts[1:]:
+            if part.startswith('dur='):
+                try:
+                    timings[parts[0]] = float(part[4:])
+                except ValueError:
+                    pass
+    return timings
+
+
+class Recorder:
+    """线程安全地收集每个请求的结果"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.stages = defaultdict(lambda: defaultdict(list))
+
+    def add(self, endpoint, latency, status, timings):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+            for name, ms in timings.items():
+                self.stages[endpoint][name].append(ms)
+
+
+def send(session_local, url, endpoint, body, timeout, scheduled, recorder):
+    """
+    发送一个请求并记录结果
+
+    Args:
+        scheduled: 计划发送时间（perf_counter），延迟从该时间算起
+    """
+    session = getattr(session_local, 'session', None)
+    if session is None:
+        session = session_local.session = requests.Session()
+    try:
+        r = session.post(f"{url}/{endpoint}", json=body, timeout=timeout)
+        status = str(r.status_code)
+        timings = parse_server_timing(r.headers.get('Server-Timing'))
+    except requests.Timeout:
+        status, timings = 'timeout', {}
+    except requests.RequestException:
+        status, timings = 'error', {}
+    recorder.add(endpoint, (time.perf_counter() - scheduled) * 1000, status, timings)
+
+
+def run_open_loop(args, payloads, mix, recorder):
+    """
+    开环模式：按计划时间发出请求，线程池满时请求在本地排队，排队时间计入延迟
+
+    Returns:
+        int: 落后于计划超过 1 秒的次数（客户端能力不足）
+    """
+    endpoints, weights = list(mix), list(mix.values())
+    session_local = threading.local()
+    lagging = 0
+    with ThreadPoolExecutor(max_workers=args.max_inflight) as pool:
+        start = time.perf_counter()
+        scheduled = start
+        while scheduled - start < args.duration:
+            now = time.perf_counter()
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            elif now - scheduled > 1.0:
+                lagging += 1
+            endpoint = random.choices(endpoints, weights)[0]
+            body = random.choice(payloads[endpoint])
+            pool.submit(send, session_local, args.url, endpoint, body, args.timeout, scheduled, recorder)
+            interval = random.expovariate(args.rps) if args.arrival == 'poisson' else 1.0 / args.rps
+            scheduled += interval
+    return lagging
+
+
+def run_closed_loop(args, payloads, mix, recorder):
+    """闭环模式：每个客户端串行发送，上一个请求返回后立即发送下一个"""
+    endpoints, weights = list(mix), list(mix.values())
+    session_local = threading.local()
+    deadline = time.perf_counter() + args.duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            endpoint = random.choices(endpoints, weights)[0]
+            body = random.choice(payloads[endpoint])
+            send(session_local, args.url, endpoint, body, args.timeout, time.perf_counter(), recorder)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def summarize(values):
+    """延迟列表（毫秒）的分位数和直方图"""
+    ms = np.asarray(values)
+    histogram = {}
+    lower = 0
+    for upper in BUCKETS:
+        histogram[f"<={upper}"] = int(((ms > lower) & (ms <= upper)).sum())
+        lower = upper
+    histogram[f">{BUCKETS[-1]}"] = int((ms > BUCKETS[-1]).sum())
+    return {
+        "count": int(ms.size),
+        "mean": round(float(ms.mean()), 2),
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p90": round(float(np.percentile(ms, 90)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "max": round(float(ms.max()), 2),
+        "histogram": histogram,
+    }
+
+
+def build_report(args, recorder, elapsed, lagging):
+    """汇总结果"""
+    report = {
+        "config": {
+            "url": args.url,
+            "mode": "open" if args.rps else "closed",
+            "rps": args.rps,
+            "arrival": args.arrival,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+        },
+        "elapsed": round(elapsed, 2),
+        "client_lagging": lagging,
+        "endpoints": {},
+    }
+    for endpoint, latencies in recorder.latencies.items():
+        statuses = dict(recorder.statuses[endpoint])
+        ok = statuses.get('200', 0)
+        report["endpoints"][endpoint] = {
+            "throughput": round(len(latencies) / elapsed, 2),
+            "error_rate": round(1 - ok / len(latencies), 4),
+            "statuses": statuses,
+            "latency_ms": summarize(latencies),
+            "server_timing_ms": {
+                name: {
+                    "p50": round(float(np.percentile(values, 50)), 2),
+                    "p95": round(float(np.percentile(values, 95)), 2),
+                }
+                for name, values in recorder.stages[endpoint].items()
+            },
+        }
+    return report
+
+
+def print_report(report):
+    """打印结果"""
+    print(f"\n模式: {report['config']['mode']}, 用时 {report['elapsed']}s")
+    if report["client_lagging"]:
+        print(f"警告: 有 {report['client_lagging']} 个请求比计划晚发出 1 秒以上，请增大 --max-inflight 或降低 --rps")
+    for endpoint, result in report["endpoints"].items():
+        latency = result["latency_ms"]
+        print(f"\n/{endpoint}: {latency['count']} 个请求, {result['throughput']}/s, "
+              f"错误率 {result['error_rate']:.2%}, 状态码 {result['statuses']}")
+        print(f"  延迟(ms) p50={latency['p50']} p90={latency['p90']} p95={latency['p95']} "
+              f"p99={latency['p99']} max={latency['max']}")
+        peak = max(latency["histogram"].values()) or 1
+        for bucket, count in latency["histogram"].items():
+            if count:
+                print(f"  {bucket:>8} {count:>7} {'#' * max(1, round(40 * count / peak))}")
+        if result["server_timing_ms"]:
+            print("  服务端阶段(ms):")
+            for name, stats in result["server_timing_ms"].items():
+                print(f"    {name:<24} p50={stats['p50']:>9.2f} p95={stats['p95']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 压测工具")
+    parser.add_argument("--url", default="http://127.0.0.1:5002", help="服务地址")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--rps", type=float, help="开环模式的目标每秒请求数")
+    group.add_argument("--concurrency", type=int, help="闭环模式的并发客户端数")
+    parser.add_argument("--arrival", default="poisson", choices=["poisson", "uniform"], help="开环模式的到达分布")
+    parser.add_argument("--duration", type=float, default=30, help="持续时间（秒）")
+    parser.add_argument("--mix", default="face_compare=1,bar_detect=1,bar_decode=1", help="请求组合及权重")
+    parser.add_argument("--face-images", default="data/*.png", help="人脸样例")
+    parser.add_argument("--barcode-images", default="data/bar_test/*", help="条形码样例")
+    parser.add_argument("--timeout", type=float, default=30, help="单个请求的超时时间（秒）")
+    parser.add_argument("--max-inflight", type=int, default=256, help="开环模式同时在途的最大请求数")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.face_images, args.barcode_images)
+    mix = parse_mix(args.mix)
+    for endpoint in mix:
+        if not payloads.get(endpoint):
+            parser.error(f"接口 {endpoint} 不存在或没有可用的样例图片")
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    lagging = 0
+    if args.rps:
+        print(f"开环模式: {args.rps} RPS ({args.arrival}), {args.duration}s, 组合 {mix}")
+        lagging = run_open_loop(args, payloads, mix, recorder)
+    else:
+        print(f"闭环模式: {args.concurrency} 并发, {args.duration}s, 组合 {mix}")
+        run_closed_loop(args, payloads, mix, recorder)
+    elapsed = time.perf_counter() - start
+
+    report = build_report(args, recorder, elapsed, lagging)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
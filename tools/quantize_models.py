@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型量化与精度评估工具
+为条形码检测模型（以及已导出 ONNX 的人脸特征模型）生成 fp16 / int8 版本，写入 model_config.json 的 variants，
+并对比各版本的效果与耗时：
+- 条形码: data/bar_test 上的检测数、解码数、平均耗时
+- 人脸: data/*.png 上相对 fp32 的特征向量漂移（L2 距离）、平均耗时
+
+用法:
+    # 动态量化条形码模型并评估
+    python tools/quantize_models.py --model barcode --int8 dynamic
+    # 用 data/bar_test 做校准的静态量化，同时生成 fp16 版本
+    python tools/quantize_models.py --model barcode --int8 static --fp16
+    # 量化已导出的人脸特征模型（需先执行 tools/export_face_onnx.py）
+    python tools/quantize_models.py --model face --int8 dynamic
+    # 只评估已有版本
+    python tools/quantize_models.py --model barcode --eval-only
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+import numpy as np
+from PIL import Image
+from nets.model_manager import ModelConfig, Modelload, PRECISIONS
+
+# 每个模型需要量化的文件配置项
+MODEL_FILEKEYS = {
+    "barcode": ["modelFile"],
+    "face": ["resnetFile"],
+}
+
+
+def list_images(pattern):
+    """按通配符列出测试图片"""
+    return sorted(p for p in glob.glob(pattern) if p.lower().endswith(('.jpg', '.jpeg', '.png')))
+
+
+def variant_path(path, precision):
+    """生成精度版本的文件名，例如 model.onnx -> model_int8.onnx"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{precision}{ext}"
+
+
+class BarcodeCalibrationReader:
+    """静态量化校准数据，使用 BarDetect.preprocess 处理 data/bar_test 中的图片"""
+
+    def __init__(self, images, preprocess):
+        self.inputs = iter([{"input": preprocess(path)[0]} for path in images])
+
+    def get_next(self):
+        return next(self.inputs, None)
+
+
+def quantize_int8(src, dst, mode, calibration_reader=None):
+    """
+    生成 int8 模型
+
+    Args:
+        src: fp32 模型路径
+        dst: 输出路径
+        mode: dynamic 动态量化（只量化权重），static 静态量化（需要校准数据）
+        calibration_reader: 静态量化的校准数据
+    """
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat
+
+    if mode == "static":
+        quantize_static(src, dst, calibration_reader, quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    else:
+        quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    print(f"✓ int8 ({mode}) 模型: {dst}")
+
+
+def convert_fp16(src, dst):
+    """生成 fp16 模型，输入输出保持 float32"""
+    import onnx
+    from onnxconverter_common import float16
+
+    model = float16.convert_float_to_float16(onnx.load(src), keep_io_types=True)
+    onnx.save(model, dst)
+    print(f"✓ fp16 模型: {dst}")
+
+
+def update_variants(model_dir, key, precision, filename):
+    """把新版本写入 model_config.json 的 variants"""
+    config_path = os.path.join(model_dir, "model_config.json")
+    with open(config_path, "r", encoding="utf-8-sig") as f:
+        configs = json.load(f)
+    variants = configs.setdefault("variants", {})
+    variant = variants.get(precision)
+    if not isinstance(variant, dict):
+        variant = {"modelFile": variant} if variant else {}
+    variant[key] = filename
+    variants[precision] = variant
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(configs, f, indent=2, ensure_ascii=False)
+
+
+def eval_barcode(precisions, images, repeat):
+    """评估条形码模型各精度版本的检测/解码数量和耗时"""
+    from app.barcode_detect import BarDetect
+
+    rows = []
+    for precision in precisions:
+        bar = BarDetect(model=Modelload.barcode("barcode", precision=precision))
+        detected, decoded, costs = 0, 0, []
+        for path in images:
+            bar.predict(path)  # 预热
+            start = time.perf_counter()
+            for _ in range(repeat):
+                results, _ = bar.predict(path)
+            costs.append((time.perf_counter() - start) / repeat * 1000)
+            detected += len(results)
+            decoded += len(bar.barcode_decode(path))
+        rows.append({
+            "precision": precision,
+            "detections": detected,
+            "decoded": decoded,
+            "decode_rate": round(decoded / len(images), 3) if images else 0,
+            "mean_ms": round(float(np.mean(costs)), 2),
+        })
+    return rows
+
+
+def eval_face(precisions, images, repeat):
+    """评估人脸特征模型各精度版本相对 fp32 的特征向量漂移和耗时"""
+    from nets.face_onnx import FaceOnnxModel
+
+    model_dir = os.path.join("./model", "face")
+    baseline, rows = None, []
+    for precision in precisions:
+        configs = ModelConfig(model_dir).parse_config(precision=precision)
+        model = FaceOnnxModel(configs["pnetFile"], configs["rnetFile"], configs["onetFile"], configs["resnetFile"])
+        if baseline is None:
+            # 以第一个版本的检测结果作为所有版本共同的输入
+            faces = []
+            for path in images:
+                img = Image.open(path).convert('RGB')
+                boxes = model.detect(img, 20)
+                if len(boxes):
+                    faces.append(model.extract(img, boxes[:1, :4])[0])
+            if not faces:
+                # 没有可比较的输入，所有版本都记为未检测到人脸
+                print("评估图片中未检测到人脸")
+                return [{"precision": p, "faces": 0, "error": "no faces detected"} for p in precisions]
+            faces = np.stack(faces)
+        embeddings = model.embed(faces)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            model.embed(faces)
+        cost = (time.perf_counter() - start) / repeat / len(faces) * 1000
+        if baseline is None:
+            baseline = embeddings
+        drift = np.linalg.norm(embeddings - baseline, axis=1)
+        rows.append({
+            "precision": precision,
+            "faces": len(faces),
+            "drift_mean": round(float(drift.mean()), 5),
+            "drift_max": round(float(drift.max()), 5),
+            "per_face_ms": round(cost, 2),
+        })
+    return rows
+
+
+def print_rows(rows):
+    """打印评估结果，附带相对 fp32 的加速比；没有耗时的行（如未检测到人脸）原样打印"""
+    time_key = "mean_ms" if "mean_ms" in rows[0] else "per_face_ms"
+    base = rows[0].get(time_key)
+    for row in rows:
+        row["speedup"] = round(base / row[time_key], 2) if base is not None and row.get(time_key) else None
+        print("  " + ", ".join(f"{k}={v}" for k, v in row.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型量化与精度评估工具")
+    parser.add_argument("--model", choices=list(MODEL_FILEKEYS), default="barcode", help="模型类型")
+    parser.add_argument("--int8", choices=["dynamic", "static"], default=None, help="生成 int8 版本")
+    parser.add_argument("--fp16", action="store_true", help="生成 fp16 版本")
+    parser.add_argument("--eval-only", action="store_true", help="只评估已有版本")
+    parser.add_argument("--images", default=None, help="评估/校准图片通配符")
+    parser.add_argument("--repeat", type=int, default=5, help="耗时测试重复次数")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    model_dir = os.path.join("./model", args.model)
+    images = list_images(args.images or ("data/bar_test/*" if args.model == "barcode" else "data/*.png"))
+    base_configs = ModelConfig(model_dir).parse_config(precision="fp32")
+
+    if not args.eval_only:
+        for key in MODEL_FILEKEYS[args.model]:
+            src = base_configs[key]
+            if args.int8:
+                reader = None
+                if args.int8 == "static":
+                    if args.model != "barcode":
+                        raise Exception("静态量化只支持条形码模型")
+                    from app.barcode_detect import BarDetect
+                    reader = BarcodeCalibrationReader(images, BarDetect(model=Modelload.barcode("barcode", precision="fp32")).preprocess)
+                dst = variant_path(src, "int8")
+                quantize_int8(src, dst, args.int8, reader)
+                update_variants(model_dir, key, "int8", os.path.basename(dst))
+            if args.fp16:
+                dst = variant_path(src, "fp16")
+                convert_fp16(src, dst)
+                update_variants(model_dir, key, "fp16", os.path.basename(dst))
+
+    # 评估 model_config.json 中存在的全部版本
+    with open(os.path.join(model_dir, "model_config.json"), "r", encoding="utf-8-sig") as f:
+        variants = json.load(f).get("variants", {})
+    precisions = ["fp32"] + [p for p in PRECISIONS if p in variants and p != "fp32"]
+    print(f"\n评估 {args.model}: {precisions}，{len(images)} 张图片")
+    if args.model == "barcode":
+        rows = eval_barcode(precisions, images, args.repeat)
+    else:
+        rows = eval_face(precisions, images, args.repeat)
+    print_rows(rows)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "images": len(images), "results": rows}, f, indent=2)
+        print(f"报告已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流量回放工具
+读取 app/capture.py 记录的线上请求（logs/capture/*.bin），按原始节奏或加速回放：
+- --target: 发送到 HTTP 服务
+- --inprocess: 在本进程内调用与服务相同的处理流程（app.handlers.handle_request，含执行通道和各处理阶段）
+请求按计划时间发出（开环），延迟从计划发送时间算起。
+回放结果与记录中的响应比较（数值按容差），并按接口对比记录时和回放时的延迟分位数；
+指定 --against 时改为与另一次回放的报告比较，用于在同一份真实流量上比较两个版本。
+
+用法:
+    # 按原始节奏回放到本机服务
+    python tools/replay.py --target http://127.0.0.1:5002
+    # 进程内 4 倍速回放，保存报告
+    python tools/replay.py --inprocess --speed 4 --output replay_old.json
+    # 切换到新版本后回放同一份记录，与上一次的报告比较
+    python tools/replay.py --inprocess --speed 4 --against replay_old.json --output replay_new.json
+"""
+
+import os
+import sys
+import glob
+import math
+import time
+import json
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+import numpy as np
+
+from app.capture import read_records, rebuild_body
+
+# 比较响应时忽略的字段
+IGNORED_KEYS = {"debug"}
+
+
+def load_capture(patterns, endpoint=None, limit=0):
+    """
+    读取记录文件，按请求开始时间排序
+
+    Returns:
+        list: [(元数据, 请求体)]
+    """
+    records = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            for meta, blobs in read_records(path):
+                if endpoint is None or meta["endpoint"] == endpoint:
+                    records.append((meta, rebuild_body(meta, blobs)))
+    records.sort(key=lambda record: record[0]["time"])
+    return records[:limit] if limit else records
+
+
+def same(a, b, rtol, atol):
+    """比较两个响应，数值按容差比较"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        keys = (set(a) | set(b)) - IGNORED_KEYS
+        return all(same(a.get(k), b.get(k), rtol, atol) for k in keys)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y, rtol, atol) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+        return math.isclose(a, b, rel_tol=rtol, abs_tol=atol)
+    return a == b
+
+
+class HttpSender:
+    """发送到 HTTP 服务"""
+
+    def __init__(self, url, timeout):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def __call__(self, meta, body):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        headers = {k: v for k, v in meta["headers"].items() if k != "Content-Type"}
+        try:
+            r = session.post(self.url + meta["endpoint"], json=body, headers=headers, timeout=self.timeout)
+            return r.status_code, r.json()
+        except (self.requests.RequestException, ValueError) as e:
+            return "error", {"message": str(e)}
+
+
+class InProcessSender:
+    """在本进程内调用服务的处理流程"""
+
+    def __init__(self):
+        from app.handlers import handle_request, enabled_endpoints
+        from app.pipelines import registry
+        self.handle_request = handle_request
+        self.endpoints = enabled_endpoints()
+        # 同步加载并预热模型，回放延迟不包含首次加载
+        registry.warmup(background=False)
+
+    def __call__(self, meta, body):
+        if meta["endpoint"] not in self.endpoints:
+            return "error", {"message": f"本进程未启用接口 {meta['endpoint']}"}
+        outcome = self.handle_request(meta["endpoint"], lambda: body, dict(meta["headers"]))
+        return outcome.status, outcome.body
+
+
+def replay(records, sender, speed, max_inflight):
+    """
+    按记录的时间间隔回放（开环）
+
+    Args:
+        records: [(元数据, 请求体)]
+        sender: 发送函数，返回 (状态码, 响应体)
+        speed: 回放速度倍数，0 表示不等待，尽快发出
+        max_inflight: 同时在途的最大请求数
+
+    Returns:
+        list: 与 records 对应的 {status, latency_ms, response}
+    """
+    results = [None] * len(records)
+
+    def run(i, meta, body, scheduled):
+        status, response = sender(meta, body)
+        results[i] = {
+            "request_id": meta["request_id"],
+            "endpoint": meta["endpoint"],
+            "status": status,
+            "latency_ms": round((time.perf_counter() - scheduled) * 1000, 3),
+            "response": response,
+        }
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        start = time.perf_counter()
+        t0 = records[0][0]["time"]
+        for i, (meta, body) in enumerate(records):
+            scheduled = start + ((meta["time"] - t0) / speed if speed else 0.0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, i, meta, body, scheduled)
+    return results
+
+
+def latency_stats(values):
+    """延迟分位数（毫秒）"""
+    ms = np.asarray(values)
+    return {name: round(float(np.percentile(ms, q)), 2) for name, q in (("p50", 50), ("p95", 95), ("p99", 99))}
+
+
+def build_report(records, results, reference, rtol, atol):
+    """
+    按接口汇总输出差异和延迟
+
+    Args:
+        records: [(元数据, 请求体)]
+        results: 回放结果
+        reference: {request_id: 结果}，来自 --against 的报告；None 时与记录比较
+    """
+    endpoints = defaultdict(lambda: {"count": 0, "mismatches": [], "base": [], "replay": []})
+    for (meta, _), result in zip(records, results):
+        summary = endpoints[meta["endpoint"]]
+        summary["count"] += 1
+        if reference is not None:
+            base = reference.get(meta["request_id"])
+            if base is None:
+                continue
+        else:
+            base = {"status": meta["status"], "latency_ms": meta["cost_ms"], "response": meta["response"]}
+        summary["base"].append(base["latency_ms"])
+        summary["replay"].append(result["latency_ms"])
+        if base["status"] != result["status"] or not same(base["response"], result["response"], rtol, atol):
+            summary["mismatches"].append({
+                "request_id": meta["request_id"],
+                "expected": {"status": base["status"], "response": base["response"]},
+                "actual": {"status": result["status"], "response": result["response"]},
+            })
+
+    report = {"baseline": "report" if reference is not None else "capture", "endpoints": {}, "records": results}
+    for endpoint, summary in endpoints.items():
+        item = {"count": summary["count"], "compared": len(summary["replay"]),
+                "mismatch_count": len(summary["mismatches"]), "mismatches": summary["mismatches"][:20]}
+        if summary["replay"]:
+            item["base_latency_ms"] = latency_stats(summary["base"])
+            item["replay_latency_ms"] = latency_stats(summary["replay"])
+        report["endpoints"][endpoint] = item
+    return report
+
+
+def print_report(report):
+    """打印结果"""
+    print(f"\n比较对象: {'上一次回放报告' if report['baseline'] == 'report' else '记录时的响应和延迟'}")
+    for endpoint, item in report["endpoints"].items():
+        print(f"\n{endpoint}: {item['count']} 个请求, 比较 {item['compared']} 个, 输出不一致 {item['mismatch_count']} 个")
+        if "replay_latency_ms" in item:
+            base, new = item["base_latency_ms"], item["replay_latency_ms"]
+            for key in ("p50", "p95", "p99"):
+                change = new[key] / base[key] - 1 if base[key] else 0.0
+                print(f"  {key}: {base[key]:>10.2f} -> {new[key]:>10.2f} ms ({change:+.1%})")
+        for mismatch in item["mismatches"][:3]:
+            print(f"  不一致 {mismatch['request_id']}: {json.dumps(mismatch['expected'], ensure_ascii=False)[:200]}")
+            print(f"  {' ' * (len(mismatch['request_id']) + 7)}-> {json.dumps(mismatch['actual'], ensure_ascii=False)[:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流量回放工具")
+    parser.add_argument("files", nargs="*", default=["logs/capture/*.bin"], help="记录文件（支持通配符）")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--target", help="HTTP 服务地址，如 http://127.0.0.1:5002")
+    group.add_argument("--inprocess", action="store_true", help="在本进程内回放")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，0 表示不等待")
+    parser.add_argument("--endpoint", default=None, help="只回放该接口的请求")
+    parser.add_argument("--limit", type=int, default=0, help="最多回放的请求数")
+    parser.add_argument("--max-inflight", type=int, default=64, help="同时在途的最大请求数")
+    parser.add_argument("--timeout", type=float, default=60, help="HTTP 请求超时时间（秒）")
+    parser.add_argument("--rtol", type=float, default=1e-3, help="数值比较的相对容差")
+    parser.add_argument("--atol", type=float, default=0.5, help="数值比较的绝对容差（坐标为像素）")
+    parser.add_argument("--against", default=None, help="与另一次回放的报告比较")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    parser.add_argument("--strict", action="store_true", help="存在输出不一致时以状态码 1 退出")
+    args = parser.parse_args()
+
+    records = load_capture(args.files, args.endpoint, args.limit)
+    if not records:
+        print("没有可回放的记录")
+        return
+    span = records[-1][0]["time"] - records[0][0]["time"]
+    print(f"读取 {len(records)} 条记录，原始时长 {span:.1f}s，回放速度 {args.speed or '不等待'}")
+
+    sender = HttpSender(args.target, args.timeout) if args.target else InProcessSender()
+    results = replay(records, sender, args.speed, args.max_inflight)
+
+    reference = None
+    if args.against:
+        with open(args.against, encoding="utf-8") as f:
+            reference = {record["request_id"]: record for record in json.load(f)["records"]}
+    report = build_report(records, results, reference, args.rtol, args.atol)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"\n报告已保存到: {args.output}")
+    if args.strict and any(item["mismatch_count"] for item in report["endpoints"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求追踪查看工具
+读取 FileExporter 写出的 logs/traces.jsonl，按调用树打印一个或几个请求的全部 span。
+
+用法:
+    # 最慢的 5 个请求
+    python tools/trace_view.py --slowest 5
+    # 指定 trace id（响应头 X-Trace-Id）或请求 ID（响应头 X-Request-Id）
+    python tools/trace_view.py --trace 4bf92f3577b34da6a3ce929d0e0e4736
+    python tools/trace_view.py --request 3f2a9c0d1b7e4a55
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+# 添加项目根目录到Python路径
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+os.chdir(project_dir)
+
+
+def load_traces(path):
+    """
+    读取追踪文件
+
+    Returns:
+        {trace_id: [span]}
+    """
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                span = json.loads(line)
+                traces[span["trace_id"]].append(span)
+    return traces
+
+
+def roots(spans):
+    """没有父 span（或父 span 在上游服务中）的 span"""
+    ids = {span["span_id"] for span in spans}
+    return [span for span in spans if span["parent_id"] not in ids]
+
+
+def print_tree(spans):
+    """按调用树打印一个 trace"""
+    children = defaultdict(list)
+    for span in spans:
+        children[span["parent_id"]].append(span)
+
+    def walk(span, depth):
+        attributes = " ".join(f"{k}={json.dumps(v, ensure_ascii=False)}" for k, v in span["attributes"].items())
+        status = "" if span["status"] == "ok" else f" [{span['status']}]"
+        print(f"{'  ' * depth}{span['name']:<{40 - 2 * depth}} {span['duration_ms']:>10.2f} ms{status}  {attributes}")
+        for child in sorted(children[span["span_id"]], key=lambda s: s["start_ns"]):
+            walk(child, depth + 1)
+
+    for root in roots(spans):
+        print(f"trace {root['trace_id']}")
+        walk(root, 0)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="请求追踪查看工具")
+    parser.add_argument("--file", default="logs/traces.jsonl", help="追踪文件")
+    parser.add_argument("--trace", default=None, help="trace id")
+    parser.add_argument("--request", default=None, help="请求 ID")
+    parser.add_argument("--slowest", type=int, default=0, help="打印最慢的 N 个请求")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file)
+    if args.trace:
+        selected = [traces.get(args.trace, [])]
+    elif args.request:
+        selected = [spans for spans in traces.values()
+                    if any(span["attributes"].get("request_id") == args.request for span in spans)]
+    else:
+        def duration(spans):
+            return max(span["duration_ms"] for span in roots(spans))
+        selected = sorted(traces.values(), key=duration, reverse=True)[:args.slowest or 1]
+
+    if not any(selected):
+        print("未找到匹配的追踪记录")
+        return
+    for spans in selected:
+        print_tree(spans)
+
+
+if __name__ == "__main__":
+    main()